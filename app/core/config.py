@@ -2,6 +2,7 @@
 import os
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from dotenv import load_dotenv
+from typing import Optional
 from urllib.parse import quote_plus
 
 # --- ส่วนที่ 1: โหลดไฟล์ .env ---
@@ -45,11 +46,89 @@ class Settings(BaseSettings):
         encoded_pass = quote_plus(db_pass_raw)
         return f"mysql+pymysql://{db_user}:{encoded_pass}@{db_host}/{db_name}"
 
+    @property
+    def ASYNC_DATABASE_URL(self) -> str:
+        # Database เดียวกัน แต่ใช้ Driver แบบ Async (aiomysql) สำหรับ AsyncEngine
+        return self.DATABASE_URL.replace("mysql+pymysql://", "mysql+aiomysql://", 1)
+
+    # Connection Pool (ต่อ Engine ต่อ Process) - ดูสถิติจริงได้ที่ GET /api/v1/metrics/db-pool
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "10"))   # วินาทีที่ยอมรอ Connection ก่อน Error
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))     # ต้องน้อยกว่า wait_timeout ของ MySQL
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+    # Pool ของ run_worker.py (Job รันทีละงาน ไม่ต้องใช้ Pool ใหญ่เท่า API)
+    WORKER_DB_POOL_SIZE: int = int(os.getenv("WORKER_DB_POOL_SIZE", "2"))
+    WORKER_DB_MAX_OVERFLOW: int = int(os.getenv("WORKER_DB_MAX_OVERFLOW", "2"))
+
+    # Retry Transaction เมื่อเจอ Deadlock (1213) / Lock wait timeout (1205) - ดู app/db/transactions.py
+    TX_RETRY_ATTEMPTS: int = int(os.getenv("TX_RETRY_ATTEMPTS", "3"))
+    TX_RETRY_BASE_DELAY_MS: float = float(os.getenv("TX_RETRY_BASE_DELAY_MS", "50"))
+    TX_RETRY_MAX_DELAY_MS: float = float(os.getenv("TX_RETRY_MAX_DELAY_MS", "1000"))
+
+    # Response รายการ Shipment/Booking Round: True = RowSerializer + orjson, False = Pydantic TypeAdapter (ดู app/core/serialization.py)
+    FAST_SERIALIZATION: bool = os.getenv("FAST_SERIALIZATION", "true").lower() in ("1", "true", "yes")
+
+    # Read Replica (ไม่ตั้ง = อ่านจาก Primary เหมือนเดิม) ใช้ User/Password/DB Name เดียวกับ Primary
+    DB_REPLICA_HOST: str = os.getenv("DB_REPLICA_HOST", "")
+    # หลังผู้ใช้เขียนข้อมูล ให้ Request อ่านของผู้ใช้คนนั้นไปที่ Primary ต่ออีกกี่วินาที (กัน Replication Lag)
+    REPLICA_STICKY_SECONDS: float = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+
+    @property
+    def DATABASE_REPLICA_URL(self) -> Optional[str]:
+        if not self.DB_REPLICA_HOST:
+            return None
+        return f"mysql+pymysql://{self.DB_USER}:{quote_plus(self.DB_PASS)}@{self.DB_REPLICA_HOST}/{self.DB_NAME}"
+
+    @property
+    def ASYNC_DATABASE_REPLICA_URL(self) -> Optional[str]:
+        url = self.DATABASE_REPLICA_URL
+        return url.replace("mysql+pymysql://", "mysql+aiomysql://", 1) if url else None
+
     # JWT Configuration
     SECRET_KEY: str = os.getenv("SECRET_KEY", "default_very_unsafe_secret_key")
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
+    # FCM Notification - รวมข้อความต่อผู้รับ และจำกัดอัตราการส่ง (Token Bucket)
+    FCM_COALESCE_WINDOW_SECONDS: float = float(os.getenv("FCM_COALESCE_WINDOW_SECONDS", "2.0"))
+    FCM_RECIPIENT_RATE_PER_SEC: float = float(os.getenv("FCM_RECIPIENT_RATE_PER_SEC", "0.2")) # ~12 ข้อความ/นาที ต่อเครื่อง
+    FCM_RECIPIENT_BURST: int = int(os.getenv("FCM_RECIPIENT_BURST", "5"))
+    FCM_PROJECT_RATE_PER_SEC: float = float(os.getenv("FCM_PROJECT_RATE_PER_SEC", "500"))
+    FCM_PROJECT_BURST: int = int(os.getenv("FCM_PROJECT_BURST", "1000"))
+
+    # Real-time (WebSocket) - กระจาย Event ข้าม Process ผ่าน UDP บน localhost
+    REALTIME_FANOUT_PORT_BASE: int = int(os.getenv("REALTIME_FANOUT_PORT_BASE", "47650"))
+    REALTIME_FANOUT_PORT_COUNT: int = int(os.getenv("REALTIME_FANOUT_PORT_COUNT", "8")) # จำนวน Process สูงสุดที่รับ Event ได้
+    REALTIME_QUEUE_SIZE: int = int(os.getenv("REALTIME_QUEUE_SIZE", "100"))
+
+    # Conditional GET (ETag) ของ Master Data / รายการ Booking Round - ดู app/core/http_cache.py
+    MASTER_DATA_CACHE_SECONDS: int = int(os.getenv("MASTER_DATA_CACHE_SECONDS", "300")) # ทั้งอายุ Cache ใน Server และ max-age ของ Client
+    BOOKING_ROUND_CACHE_SECONDS: int = int(os.getenv("BOOKING_ROUND_CACHE_SECONDS", "60")) # กันพลาด Event: หมดอายุเองแม้ไม่มีการเขียน
+
+    # Delta-sync (/shipments/changes): high_water_mark คือเลขที่ขอไปแล้วอย่างน้อยกี่วินาที
+    # Transaction ที่ขอเลขแล้ว commit ภายในช่วงนี้จะไม่ถูกข้าม (ควรมากกว่า EVENT_LOG_FLUSH_INTERVAL_SECONDS ด้วย)
+    DELTA_SYNC_LAG_SECONDS: float = float(os.getenv("DELTA_SYNC_LAG_SECONDS", "10"))
+    CHANGE_LOG_RETENTION_HOURS: int = int(os.getenv("CHANGE_LOG_RETENTION_HOURS", "24")) # Worker ลบแถวของ shipment_change_log ที่เก่ากว่านี้
+
+    # Shipment Event Log - Buffer แล้วเขียนเป็น Multi-row INSERT
+    EVENT_LOG_FLUSH_SIZE: int = int(os.getenv("EVENT_LOG_FLUSH_SIZE", "200"))
+    EVENT_LOG_FLUSH_INTERVAL_SECONDS: float = float(os.getenv("EVENT_LOG_FLUSH_INTERVAL_SECONDS", "2.0"))
+
+    # Idempotency-Key สำหรับ Action Endpoints (confirm/reject/...)
+    IDEMPOTENCY_KEY_TTL_HOURS: int = int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+    # Request แรกถือคีย์ได้นานเท่านี้ ถ้า Process ตายกลางทาง Retry หลังจากนี้จะทำงานต่อแทนได้ (ควรนานกว่า Action ที่ช้าที่สุด รวม Lock wait)
+    IDEMPOTENCY_LEASE_SECONDS: int = int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "120"))
+
+    # POST /shipments/confirm-batch: จำนวนงานสูงสุดต่อ Request
+    CONFIRM_BATCH_MAX_ITEMS: int = int(os.getenv("CONFIRM_BATCH_MAX_ITEMS", "100"))
+
+    # Keyset Pagination ของ Endpoint ที่คืนรายการ (?limit=&cursor=)
+    PAGE_SIZE_DEFAULT: int = int(os.getenv("PAGE_SIZE_DEFAULT", "200"))
+    PAGE_SIZE_MAX: int = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+    # Export แบบ Stream (/shipments/export): จำนวนแถวต่อชุดที่ดึงจาก Server-side Cursor
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
     # Pydantic V2 model_config
     model_config = SettingsConfigDict(
         env_file=dotenv_path, # Pydantic สามารถโหลด .env ได้เองด้วย (ถ้า python-dotenv ไม่ได้โหลด)
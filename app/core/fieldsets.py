@@ -0,0 +1,44 @@
+# app/core/fieldsets.py
+# Sparse Fieldsets ของ Endpoint รายการ: ?fields=shipid,docstat,apmdate&include=details,mvendor
+#   fields  - Field ธรรมดาของ Schema ที่ต้องการ (ไม่ส่ง = ทุก Field)
+#   include - Field ที่เป็น Object/รายการซ้อน (Relationship เช่น details, mvendor) ที่ต้องการ
+# ไม่ส่งทั้งสองตัว = Response เต็มเหมือนเดิม, ส่ง fields อย่างเดียว = ไม่มี Relationship
+# ผลลัพธ์คือชุด Key ของ Schema ที่จะตอบ (frozenset) ใช้ทั้งตัดคอลัมน์/JOIN ใน SQL และตัด Field ตอน Serialize
+from typing import Iterable, List, Optional, Type, Union, get_args, get_origin
+
+from pydantic import BaseModel
+
+def _is_relation(annotation) -> bool:
+    if get_origin(annotation) is Union:
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        annotation = args[0] if len(args) == 1 else annotation
+    if get_origin(annotation) in (list, List):
+        return True
+    return isinstance(annotation, type) and issubclass(annotation, BaseModel)
+
+def relations(model: Type[BaseModel]) -> frozenset:
+    """Key ของ Field ที่เป็น Object/รายการซ้อน (ใช้กับ include)"""
+    return frozenset(field.alias or name for name, field in model.model_fields.items() if _is_relation(field.annotation))
+
+def _split(value: str) -> set:
+    return {part.strip() for part in value.split(",") if part.strip()}
+
+def parse(model: Type[BaseModel], fields: Optional[str], include: Optional[str], required: Iterable[str] = ()) -> Optional[frozenset]:
+    """
+    คืนชุด Key ที่จะตอบ (รวม required เสมอ) หรือ None ถ้าไม่ได้ขอ Sparse Fieldset
+    ชื่อที่ Schema ไม่มี (หรือใส่ Relationship ใน fields) raise ValueError
+    """
+    if fields is None and include is None:
+        return None
+    nested = relations(model)
+    scalars = {field.alias or name for name, field in model.model_fields.items()} - nested
+
+    chosen = scalars if fields is None else _split(fields)
+    unknown = chosen - scalars
+    if unknown:
+        raise ValueError(f"Unknown field(s) in 'fields': {', '.join(sorted(unknown))} (use 'include' for: {', '.join(sorted(nested))})")
+    included = set() if include is None else _split(include)
+    unknown = included - nested
+    if unknown:
+        raise ValueError(f"Unknown relation(s) in 'include': {', '.join(sorted(unknown))} (available: {', '.join(sorted(nested))})")
+    return frozenset(chosen | included | set(required))
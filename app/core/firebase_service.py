@@ -1,7 +1,11 @@
 # app/core/firebase_service.py
 import firebase_admin
 from firebase_admin import credentials, messaging
+import heapq
 import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
 from .config import settings # Import settings เพื่อเอา Path
 
 # Global variable to check if app is initialized
@@ -53,4 +57,186 @@ def send_fcm_notification(token: str, title: str, body: str, data: dict = None)
         return response
     except Exception as e:
         print(f"Error sending FCM message: {e}")
-        return str(e)
\ No newline at end of file
+        return str(e)
+
+# ===================================================================
+# Coalescing + Rate Limiting (อยู่หน้า send_fcm_notification)
+# ===================================================================
+# ระหว่างจัดสรรงาน Vendor คนเดียวอาจได้ Push หลายสิบครั้งในวินาทีเดียว
+# จึงพักข้อความไว้ต่อ Token ชั่วคราว (FCM_COALESCE_WINDOW_SECONDS) แล้วรวมเป็นข้อความเดียว
+# และจำกัดอัตราการส่งด้วย Token Bucket ทั้งต่อผู้รับ และต่อทั้ง Project
+
+MAX_SHIPMENT_IDS_IN_BODY = 10
+
+class TokenBucket:
+    """Token Bucket แบบง่าย: เติม `rate` token ต่อวินาที เก็บได้สูงสุด `capacity`"""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now: float) -> float:
+        """คืนจำนวนวินาทีที่ต้องรอจนกว่าจะมี 1 token (0 = ส่งได้ทันที)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+class _PendingBatch:
+    """ข้อความที่รอส่งของ Token หนึ่ง ๆ"""
+    def __init__(self, title: str, body: str, data: Optional[dict]):
+        self.title = title
+        self.body = body
+        self.data = dict(data or {})
+        self.count = 0
+        self.shipment_ids: List[str] = []
+
+    def add(self, title: str, body: str, data: Optional[dict], shipment_id: Optional[str]):
+        if self.count > 0 and title != self.title:
+            self.title = None # ข้อความคนละประเภท ใช้หัวข้อรวมแทน
+        self.body = body
+        self.data.update(data or {})
+        self.count += 1
+        if shipment_id and shipment_id not in self.shipment_ids:
+            self.shipment_ids.append(shipment_id)
+
+    def build_message(self):
+        """รวมเป็น (title, body, data) เดียว"""
+        if self.count <= 1:
+            return self.title, self.body, self.data
+
+        title = self.title or f"มีการแจ้งเตือนใหม่ {self.count} รายการ"
+        shown_ids = self.shipment_ids[:MAX_SHIPMENT_IDS_IN_BODY]
+        body = f"{self.count} รายการ"
+        if shown_ids:
+            body += f": Shipment ID {', '.join(shown_ids)}"
+            if len(self.shipment_ids) > len(shown_ids):
+                body += f" และอีก {len(self.shipment_ids) - len(shown_ids)} รายการ"
+        data = dict(self.data)
+        data.pop("shipment_id", None)
+        # FCM data ต้องเป็น String ทั้งหมด
+        data["count"] = str(self.count)
+        data["shipment_ids"] = ",".join(self.shipment_ids)
+        data["type"] = "batch"
+        return title, body, data
+
+# เวลาส่งของแต่ละ Token อยู่ใน Heap เดียว มี Thread เดียว (_run_scheduler) คอยส่งตามเวลา
+# แทนการสร้าง threading.Timer ต่อ Token (ช่วงจัดสรรงานอาจมีหลายร้อย Thread พร้อมกัน)
+_queue_lock = threading.Lock()
+_wakeup = threading.Condition(_queue_lock)
+_pending: Dict[str, _PendingBatch] = {}
+_due: Dict[str, float] = {}              # Token -> เวลาที่จะส่ง (time.monotonic) รายการใน Heap ที่ไม่ตรงกับค่านี้ถือว่ายกเลิกแล้ว
+_due_heap: List[Tuple[float, str]] = []
+_scheduler: Optional[threading.Thread] = None
+_recipient_buckets: Dict[str, TokenBucket] = {}
+_project_bucket = TokenBucket(settings.FCM_PROJECT_RATE_PER_SEC, settings.FCM_PROJECT_BURST)
+
+def _schedule_flush(token: str, delay: float):
+    # ต้องถือ _queue_lock อยู่ก่อนเรียก
+    global _scheduler
+    due = time.monotonic() + delay
+    _due[token] = due
+    heapq.heappush(_due_heap, (due, token))
+    if _scheduler is None or not _scheduler.is_alive():
+        _scheduler = threading.Thread(target=_run_scheduler, name="fcm-scheduler", daemon=True)
+        _scheduler.start()
+    _wakeup.notify()
+
+def _next_due_token() -> str:
+    # ต้องถือ _queue_lock อยู่ก่อนเรียก: รอจนถึงเวลาของรายการแรกใน Heap แล้วคืน Token นั้น
+    while True:
+        if not _due_heap:
+            _wakeup.wait()
+            continue
+        due, token = _due_heap[0]
+        wait = due - time.monotonic()
+        if wait > 0:
+            _wakeup.wait(wait)
+            continue
+        heapq.heappop(_due_heap)
+        if _due.get(token) == due:
+            del _due[token]
+            return token
+
+def _run_scheduler():
+    while True:
+        with _queue_lock:
+            token = _next_due_token()
+        try:
+            _flush_token(token)
+        except Exception as e:
+            print(f"ERROR: Failed to flush notifications for token {token[:12]}...: {e}")
+
+def _recipient_bucket(token: str) -> TokenBucket:
+    bucket = _recipient_buckets.get(token)
+    if bucket is None:
+        if len(_recipient_buckets) >= 10000:
+            # ทิ้ง Bucket ที่เต็มแล้ว (ไม่ได้ใช้งานนาน) กันหน่วยความจำโตไม่สิ้นสุด
+            now = time.monotonic()
+            for key in [k for k, b in _recipient_buckets.items() if b.wait_time(now) == 0 and b.tokens >= b.capacity]:
+                del _recipient_buckets[key]
+        bucket = TokenBucket(settings.FCM_RECIPIENT_RATE_PER_SEC, settings.FCM_RECIPIENT_BURST)
+        _recipient_buckets[token] = bucket
+    return bucket
+
+def queue_fcm_notification(token: str, title: str, body: str, data: dict = None, shipment_id: str = None):
+    """
+    ใส่ข้อความเข้าคิวแทนการส่งทันที ข้อความที่มาถึง Token เดียวกันภายในช่วงเวลา
+    FCM_COALESCE_WINDOW_SECONDS จะถูกรวมเป็นข้อความเดียว (มีจำนวน + รายการ Shipment ID)
+    """
+    if not token:
+        return
+    if shipment_id is None and data and data.get("shipment_id"):
+        shipment_id = str(data["shipment_id"])
+
+    with _queue_lock:
+        batch = _pending.get(token)
+        if batch is None:
+            batch = _PendingBatch(title, body, data)
+            _pending[token] = batch
+        batch.add(title, body, data, shipment_id)
+        if token not in _due:
+            _schedule_flush(token, settings.FCM_COALESCE_WINDOW_SECONDS)
+
+def _flush_token(token: str, ignore_limits: bool = False):
+    with _queue_lock:
+        _due.pop(token, None)
+        batch = _pending.pop(token, None)
+        if batch is None:
+            return
+
+        if not ignore_limits:
+            now = time.monotonic()
+            recipient_bucket = _recipient_bucket(token)
+            wait = max(recipient_bucket.wait_time(now), _project_bucket.wait_time(now))
+            if wait > 0:
+                # ยังส่งไม่ได้ คืนเข้าคิว (ข้อความใหม่ที่ตามมาจะถูก add รวมเข้าไป) แล้วลองใหม่เมื่อมี token
+                _pending[token] = batch
+                _schedule_flush(token, min(wait, 60.0))
+                return
+            recipient_bucket.consume()
+            _project_bucket.consume()
+
+    title, body, data = batch.build_message()
+    if batch.count > 1:
+        print(f"INFO: Coalesced {batch.count} notifications into one for token {token[:12]}...")
+    send_fcm_notification(token=token, title=title, body=body, data=data)
+
+def flush_pending_notifications():
+    """ส่งข้อความที่ค้างอยู่ทั้งหมดทันที (ใช้ตอน Shutdown)"""
+    with _queue_lock:
+        tokens = list(_pending.keys())
+        _due.clear()
+        _due_heap.clear()
+    for token in tokens:
+        _flush_token(token, ignore_limits=True)
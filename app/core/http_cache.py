@@ -0,0 +1,109 @@
+# app/core/http_cache.py
+# Conditional GET (ETag / If-None-Match) สำหรับข้อมูลที่เปลี่ยนไม่บ่อย (Master Data, รายการ Booking Round ตามวัน)
+# - ResponseCache เก็บ Body ที่ encode แล้ว + Strong ETag (hash ของ Body) ไว้ใน Process ตาม Key ของ Request
+# - Request ถัดไปที่ Key ตรงกัน: If-None-Match ตรง -> 304 ทันที, ไม่ตรง -> ส่ง Body จาก Cache
+#   ทั้งสองกรณีไม่แตะฐานข้อมูล (Session จาก Dependency ยังไม่ขอ Connection จนกว่าจะ Query จริง)
+# - Cache หมดอายุตาม ttl หรือเมื่อ invalidate()
+#   BOOKING_ROUNDS ล้างทุกครั้งที่มี Event จาก realtime (ทุก Write Path ของ Shipment/Booking Round และ Worker ส่งอยู่แล้ว
+#   และกระจายถึงทุก Process ของ API) ttl เป็นแค่ตัวกันพลาดกรณี Event หาย
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Hashable, Optional
+
+from fastapi import Request, Response, status
+
+from . import realtime, serialization
+from .config import settings
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: str
+    media_type: Optional[str]
+    headers: dict
+    expires_at: float
+
+def make_etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match ใช้ Weak Comparison (RFC 9110): W/"x" ถือว่าตรงกับ "x" และ * ตรงกับทุกค่า"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+class ResponseCache:
+    def __init__(self, name: str, ttl_seconds: float, cache_control: str, max_entries: int = 1024):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.cache_control = cache_control
+        self.max_entries = max_entries
+        self._entries = {}
+        self._generation = 0
+        self._settle_until = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self, settle_seconds: float = 0.0):
+        """
+        ล้าง Cache ทั้งหมด; settle_seconds: ช่วงที่ Replica อาจยังตามไม่ทัน
+        Response ที่สร้างในช่วงนี้ยังส่งได้แต่ไม่เก็บ (ไม่ให้ข้อมูลเก่าจาก Replica ค้างอยู่จนหมด ttl)
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._settle_until = max(self._settle_until, time.monotonic() + settle_seconds)
+
+    def _get(self, key) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            return entry
+        return None
+
+    def _store(self, key, response: Response, generation: int) -> Optional[CachedResponse]:
+        body = getattr(response, "body", None)
+        if response.status_code != status.HTTP_200_OK or not isinstance(body, bytes):
+            return None
+        headers = {k: v for k, v in response.headers.items() if k not in ("content-length", "content-type")}
+        entry = CachedResponse(body=body, etag=make_etag(body), media_type=response.media_type,
+                               headers=headers, expires_at=time.monotonic() + self.ttl_seconds)
+        with self._lock:
+            # มีการ invalidate ระหว่าง Query -> ข้อมูลนี้อาจเก่าแล้ว ส่งได้แต่ไม่เก็บ
+            if generation == self._generation and time.monotonic() >= self._settle_until:
+                if len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+                self._entries[key] = entry
+        return entry
+
+    def respond(self, request: Request, key: Hashable, build: Callable[[], Response]) -> Response:
+        """
+        ตอบจาก Cache ถ้ามี (304 เมื่อ If-None-Match ตรง) ไม่เช่นนั้นเรียก build() (Query + encode) แล้วเก็บไว้
+        Key รวมรูปแบบ Response (JSON / MessagePack) ให้อัตโนมัติ
+        """
+        key = (key, serialization.response_media_type())
+        entry = self._get(key)
+        if entry is None:
+            generation = self._generation
+            response = build()
+            entry = self._store(key, response, generation)
+            if entry is None:
+                return response
+
+        cache_headers = {"ETag": entry.etag, "Cache-Control": self.cache_control}
+        if etag_matches(request.headers.get("if-none-match"), entry.etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+        return serialization.EncodedResponse(entry.body, media_type=entry.media_type, headers={**entry.headers, **cache_headers})
+
+# Master Data: แก้ผ่านฐานข้อมูลโดยตรง (ไม่มี Write Endpoint) อายุตาม MASTER_DATA_CACHE_SECONDS ทั้งใน Server และ Client
+MASTER_DATA = ResponseCache("master-data", settings.MASTER_DATA_CACHE_SECONDS,
+                            f"public, max-age={settings.MASTER_DATA_CACHE_SECONDS}")
+# รายการ Booking Round: Client ต้องถามใหม่ทุกครั้ง (no-cache) แต่ส่วนใหญ่ได้ 304 จาก Cache
+BOOKING_ROUNDS = ResponseCache("booking-rounds", settings.BOOKING_ROUND_CACHE_SECONDS, "no-cache")
+
+def _on_realtime_event(event: dict):
+    BOOKING_ROUNDS.invalidate(settle_seconds=settings.REPLICA_STICKY_SECONDS if settings.DATABASE_REPLICA_URL else 0.0)
+
+realtime.broker.add_listener(_on_realtime_event)
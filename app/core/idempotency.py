@@ -0,0 +1,131 @@
+# app/core/idempotency.py
+# รองรับ Header "Idempotency-Key" สำหรับ Action ที่ Client บนเครือข่ายมือถือมัก Retry
+# - Request แรก: จองคีย์ (commit ทันที) -> ทำงานจริง -> เก็บ Response ไว้
+# - Request ซ้ำ (คีย์ + body เดิม): คืน Response ที่เก็บไว้ ไม่ทำงาน/ไม่ส่ง Notification ซ้ำ
+# - คีย์เดิมแต่ body ต่างกัน: 422, ถ้า Request แรกยังทำงานอยู่: 409
+# - Request แรกถือคีย์เป็น Lease (locked_until) ถ้า Process ตายก่อนเก็บผล Retry หลังหมด Lease จะรับคีย์ไปทำต่อ
+#   แทนที่จะได้ 409 ไปจนคีย์หมดอายุ
+# handler() ทุกตัวรันผ่าน transactions.run_with_retry (ลองใหม่เมื่อเจอ Deadlock / Lock wait timeout)
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional, Type
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import serialization
+from .config import settings
+from ..db import models, transactions
+
+REPLAY_HEADER = "Idempotent-Replayed"
+
+def _fingerprint(endpoint: str, payload) -> str:
+    if isinstance(payload, BaseModel):
+        payload = payload.model_dump(mode="json")
+    raw = json.dumps({"endpoint": endpoint, "payload": payload}, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _release(db: Session, username: str, key: str):
+    db.rollback()
+    (db.query(models.IdempotencyKey)
+       .filter(models.IdempotencyKey.username == username, models.IdempotencyKey.idempotency_key == key)
+       .delete(synchronize_session=False))
+    db.commit()
+
+def _store(db: Session, username: str, key: str, status_code: int, body):
+    db.rollback()
+    (db.query(models.IdempotencyKey)
+       .filter(models.IdempotencyKey.username == username, models.IdempotencyKey.idempotency_key == key)
+       .update({"status_code": status_code, "response_body": body, "locked_until": None}, synchronize_session=False))
+    db.commit()
+
+def run_idempotent(
+    db: Session,
+    key: Optional[str],
+    username: str,
+    endpoint: str,
+    payload,
+    handler: Callable,
+    response_model: Type[BaseModel],
+    status_code: int = status.HTTP_200_OK,
+):
+    """
+    เรียก handler() แบบ Idempotent ถ้า Client ส่ง Idempotency-Key มา
+    ไม่มีคีย์ -> เรียก handler() ตามปกติ
+    """
+    if not key:
+        return transactions.run_with_retry(db, handler, endpoint)
+
+    fingerprint = _fingerprint(endpoint, payload)
+    now = datetime.now(timezone.utc)
+
+    # คีย์ที่หมดอายุแล้วถือว่าไม่มี
+    (db.query(models.IdempotencyKey)
+       .filter(models.IdempotencyKey.username == username,
+               models.IdempotencyKey.idempotency_key == key,
+               models.IdempotencyKey.expires_at <= now)
+       .delete(synchronize_session=False))
+
+    existing = (db.query(models.IdempotencyKey)
+                  .filter(models.IdempotencyKey.username == username, models.IdempotencyKey.idempotency_key == key)
+                  .first())
+    in_progress = HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A request with this Idempotency-Key is already being processed.")
+    locked_until = now + timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+    if existing is None:
+        db.add(models.IdempotencyKey(
+            username=username,
+            idempotency_key=key,
+            endpoint=endpoint,
+            fingerprint=fingerprint,
+            created_at=now,
+            expires_at=now + timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS),
+            locked_until=locked_until,
+        ))
+        try:
+            db.commit()
+        except IntegrityError:
+            # มี Request อื่นที่ใช้คีย์เดียวกันจองไปพร้อมกัน
+            db.rollback()
+            raise in_progress
+    elif existing.fingerprint != fingerprint:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Idempotency-Key was already used with a different request.")
+    elif existing.status_code is None:
+        # Request แรกยังไม่เก็บผล: รับคีย์ต่อได้เมื่อ Lease หมดแล้วเท่านั้น (UPDATE แบบมีเงื่อนไข มีผู้ชนะคนเดียว)
+        taken = (db.query(models.IdempotencyKey)
+                   .filter(models.IdempotencyKey.username == username,
+                           models.IdempotencyKey.idempotency_key == key,
+                           models.IdempotencyKey.status_code.is_(None),
+                           or_(models.IdempotencyKey.locked_until.is_(None), models.IdempotencyKey.locked_until <= now))
+                   .update({"locked_until": locked_until}, synchronize_session=False))
+        db.commit()
+        if taken != 1:
+            raise in_progress
+        print(f"WARNING: Taking over Idempotency-Key {key} ({endpoint}) of {username} after its lease expired")
+    else:
+        print(f"INFO: Replaying stored response for Idempotency-Key {key} ({endpoint}) of {username}")
+        db.commit()
+        # Error ที่เก็บไว้ตอบเป็น JSON เสมอเหมือนครั้งแรก (HTTPException ไม่ผ่าน Content Negotiation)
+        media_type = serialization.JSON_MEDIA_TYPE if existing.status_code >= 400 else None
+        return serialization.ORJSONResponse(content=existing.response_body, status_code=existing.status_code,
+                                            headers={REPLAY_HEADER: "true"}, media_type=media_type)
+
+    try:
+        result = transactions.run_with_retry(db, handler, endpoint)
+    except HTTPException as e:
+        if e.status_code < 500:
+            # ผลลัพธ์ที่ตัดสินแล้ว (เช่น 409 งานถูกคนอื่นรับไป) ตอบเหมือนเดิมทุกครั้งที่ Retry
+            _store(db, username, key, e.status_code, {"detail": e.detail})
+        else:
+            _release(db, username, key)
+        raise
+    except Exception:
+        _release(db, username, key)
+        raise
+
+    body = response_model.model_validate(result).model_dump(mode="json", by_alias=True)
+    _store(db, username, key, status_code, body)
+    return serialization.ORJSONResponse(content=body, status_code=status_code)
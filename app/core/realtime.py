@@ -0,0 +1,237 @@
+# app/core/realtime.py
+# Broker สำหรับส่ง Event การเปลี่ยนสถานะ Shipment แบบ Real-time (WebSocket)
+# - ภายใน Process: ส่งเข้า asyncio.Queue ของแต่ละ Subscriber โดยตรง
+# - ข้าม Process (uvicorn หลาย worker / run_worker.py): ส่ง UDP Datagram ไปยัง
+#   Port ช่วง REALTIME_FANOUT_PORT_BASE .. +REALTIME_FANOUT_PORT_COUNT บน localhost
+#   ทุก Process ของ API จะ Bind Port ว่างตัวแรกในช่วงนั้นไว้รับ Event
+import asyncio
+import json
+import os
+import socket
+import threading
+import uuid
+from datetime import date, datetime, timezone
+from typing import Callable, List, Optional, Set
+
+from .config import settings
+
+# ใช้แยกว่า Datagram ไหนมาจาก Process ตัวเอง (ส่งในเครื่องไปแล้ว ไม่ต้องส่งซ้ำ)
+PROCESS_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+DISPATCHER_ROLES = ("dispatcher", "admin")
+VENDOR_ONGOING_STATUSES = ("03", "04")
+
+def _jsonable(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def _role_value(role) -> str:
+    return getattr(role, "value", role)
+
+# ===================================================================
+# Event Builders
+# ===================================================================
+
+def snapshot(shipment) -> dict:
+    """เก็บสถานะที่ใช้กรองผู้รับ Event ไว้ก่อนแก้ไข Shipment"""
+    return {
+        "docstat": shipment.docstat,
+        "current_grade_to_assign": shipment.current_grade_to_assign,
+        "vencode": shipment.vencode,
+        "booking_round_id": shipment.booking_round_id,
+        "is_on_hold": bool(shipment.is_on_hold),
+        "rejected_by_vencodes": list(shipment.rejected_by_vencodes or []),
+    }
+
+def shipment_event(shipment, before: Optional[dict] = None, actor: Optional[str] = None) -> dict:
+    """
+    สร้าง Event จาก Shipment (เรียกก่อน commit ได้ เพื่อไม่ต้องโหลดข้อมูลใหม่หลัง commit)
+    """
+    event = {
+        "type": "shipment.changed",
+        "shipid": shipment.shipid,
+        **snapshot(shipment),
+        "chuser": actor or shipment.chuser,
+        "chdate": _jsonable(shipment.chdate),
+        "previous": before,
+    }
+    return event
+
+def bulk_event(reason: str, shipids: Optional[List[str]] = None, round_id: Optional[int] = None, actor: Optional[str] = None) -> dict:
+    """
+    Event สำหรับการแก้ไขแบบ Bulk (UPDATE หลายแถว) ที่ไม่มีสถานะรายแถว
+    ส่งให้ Dispatcher เท่านั้น เพื่อให้ไป Refresh รายการเอง
+    """
+    return {
+        "type": "shipments.bulk_changed",
+        "reason": reason,
+        "shipids": shipids,
+        "booking_round_id": round_id,
+        "chuser": actor,
+        "chdate": datetime.now(timezone.utc).isoformat(),
+    }
+
+# ===================================================================
+# Subscriber / Filter
+# ===================================================================
+
+class Subscription:
+    """การเชื่อมต่อหนึ่งตัว พร้อมข้อมูล role/grade/vencode ที่ใช้กรอง Event"""
+    def __init__(self, role: str, grade: Optional[str], vencode: Optional[str], loop: asyncio.AbstractEventLoop):
+        self.role = _role_value(role)
+        self.grade = grade
+        self.vencode = vencode
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.REALTIME_QUEUE_SIZE)
+
+    def _can_see(self, state: Optional[dict]) -> bool:
+        if not state:
+            return False
+        docstat = state.get("docstat")
+        if docstat == "02" and state.get("current_grade_to_assign") == self.grade:
+            return True
+        if docstat == "BC" and self.vencode not in (state.get("rejected_by_vencodes") or []):
+            return True
+        if docstat in VENDOR_ONGOING_STATUSES and state.get("vencode") == self.vencode:
+            return True
+        return False
+
+    def wants(self, event: dict) -> bool:
+        if self.role in DISPATCHER_ROLES:
+            return True
+        if event.get("type") != "shipment.changed":
+            return False
+        # Vendor ได้รับ Event ถ้างานนั้น "เข้ามา" หรือ "ออกไป" จากมุมมองของตัวเอง
+        return self._can_see(event) or self._can_see(event.get("previous"))
+
+    def _put(self, event: dict):
+        # ทำงานใน Event Loop ของ Subscriber เท่านั้น
+        if self.queue.full():
+            # Client ตามไม่ทัน: ล้างคิวแล้วบอกให้ดึงข้อมูลใหม่ทั้งหมด
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+            return
+        self.queue.put_nowait(event)
+
+    def deliver(self, event: dict):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            pass # Loop ถูกปิดไปแล้ว
+
+class ShipmentBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Set[Subscription] = set()
+        self._send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._listen_port: Optional[int] = None
+        self._transport = None
+        self._listeners: List[Callable[[dict], None]] = []
+
+    # --- Subscribers ---
+    def subscribe(self, role: str, grade: Optional[str] = None, vencode: Optional[str] = None) -> Subscription:
+        subscription = Subscription(role, grade, vencode, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def add_listener(self, callback: Callable[[dict], None]):
+        """ฟังก์ชันที่ถูกเรียกทุก Event ที่ถึง Process นี้ (ทั้งที่ Publish เองและจาก Process อื่น) เช่นล้าง Cache"""
+        self._listeners.append(callback)
+
+    def deliver_local(self, event: dict):
+        for callback in self._listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"WARNING: Realtime listener failed: {e}")
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if subscription.wants(event):
+                subscription.deliver(event)
+
+    # --- Publish ---
+    def publish(self, event: dict):
+        """ส่ง Event ให้ Subscriber ใน Process นี้ และกระจายไปยัง Process อื่นบนเครื่องเดียวกัน"""
+        self.deliver_local(event)
+        self._send_fanout(event)
+
+    def _send_fanout(self, event: dict):
+        if settings.REALTIME_FANOUT_PORT_COUNT <= 0:
+            return
+        try:
+            payload = json.dumps({"origin": PROCESS_ID, "event": event}, default=str).encode("utf-8")
+            for offset in range(settings.REALTIME_FANOUT_PORT_COUNT):
+                port = settings.REALTIME_FANOUT_PORT_BASE + offset
+                if port == self._listen_port:
+                    continue
+                try:
+                    self._send_sock.sendto(payload, ("127.0.0.1", port))
+                except OSError:
+                    pass # ไม่มี Process ฟังอยู่ที่ Port นี้
+        except Exception as e:
+            print(f"WARNING: Failed to fan out realtime event: {e}")
+
+    # --- Cross-process Listener ---
+    async def start_fanout_listener(self):
+        """Bind Port ว่างตัวแรกในช่วง Fan-out เพื่อรับ Event จาก Process อื่น"""
+        loop = asyncio.get_running_loop()
+        for offset in range(settings.REALTIME_FANOUT_PORT_COUNT):
+            port = settings.REALTIME_FANOUT_PORT_BASE + offset
+            try:
+                self._transport, _ = await loop.create_datagram_endpoint(
+                    lambda: _FanoutProtocol(self), local_addr=("127.0.0.1", port)
+                )
+                self._listen_port = port
+                print(f"INFO: Realtime fan-out listening on 127.0.0.1:{port}")
+                return
+            except OSError:
+                continue
+        print("WARNING: No free realtime fan-out port. Events from other processes will not be received.")
+
+    def stop_fanout_listener(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+            self._listen_port = None
+
+class _FanoutProtocol(asyncio.DatagramProtocol):
+    def __init__(self, broker: ShipmentBroker):
+        self.broker = broker
+
+    def datagram_received(self, data, addr):
+        try:
+            message = json.loads(data.decode("utf-8"))
+        except ValueError:
+            return
+        if message.get("origin") == PROCESS_ID:
+            return
+        event = message.get("event")
+        if isinstance(event, dict):
+            self.broker.deliver_local(event)
+
+broker = ShipmentBroker()
+
+# ===================================================================
+# Helpers สำหรับ Write Paths
+# ===================================================================
+
+def publish(event: dict):
+    try:
+        broker.publish(event)
+    except Exception as e:
+        # การแจ้งเตือน Real-time ต้องไม่ทำให้ Transaction หลักล้มเหลว
+        print(f"WARNING: Failed to publish realtime event: {e}")
+
+def publish_shipment_change(shipment, before: Optional[dict] = None, actor: Optional[str] = None):
+    publish(shipment_event(shipment, before=before, actor=actor))
+
+def publish_bulk_change(reason: str, shipids: Optional[List[str]] = None, round_id: Optional[int] = None, actor: Optional[str] = None):
+    publish(bulk_event(reason, shipids=shipids, round_id=round_id, actor=actor))
@@ -4,12 +4,13 @@ from datetime import datetime, timedelta, timezone
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer # สำหรับดึง Token จาก Header
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
 from datetime import datetime, timedelta, timezone # เพิ่ม timezone
 from typing import Optional
 from .config import settings # Import settings ที่เราสร้าง
-from ..db import models, crud, database
+from ..db import models, crud, async_crud, database
 from ..schemas import token_schemas
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -29,27 +30,77 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
-async def get_current_active_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(database.get_db)
-) -> models.SystemUser:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+# Dependency ของ Auth แยกตาม Session ที่ Route ใช้: FastAPI Cache Dependency ต่อ Request
+# Auth กับ Handler จึงใช้ Session (และ Connection) เดียวกัน แทนที่จะยืม Connection จาก Pool สองอัน
+# - get_current_active_user            : async def ที่เขียน (get_async_db)
+# - get_current_active_user_async_read : async def ที่อ่านอย่างเดียว (get_async_read_db)
+# - get_current_active_user_sync       : def ที่เขียน (get_db)
+# - get_current_active_user_read       : def ที่อ่านอย่างเดียว (get_read_db)
+# vendor_details ถูก Eager Load มาแล้ว ฝั่ง Sync จะ expunge User ออกจาก Session
+# commit/rollback ใน Handler จึงไม่ทำให้ค่าของ current_user หมดอายุ (เหมือน User จาก AsyncSession เดิม)
+async def get_current_active_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(database.get_async_db)
+) -> models.SystemUser:
+    """ดึง User จาก Token ผ่าน AsyncSession (ไม่ Block Event Loop)"""
+    token_data = _decode_token(token)
+    user = await async_crud.get_user_by_username(db, username=token_data.username)
+    return _check_active(user)
+
+async def get_current_active_user_async_read(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(database.get_async_read_db)
+) -> models.SystemUser:
+    token_data = _decode_token(token)
+    user = await async_crud.get_user_by_username(db, username=token_data.username)
+    return _check_active(user)
+
+def get_current_active_user_sync(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(database.get_db)
+) -> models.SystemUser:
+    return _detached(db, get_user_from_token(db, token))
+
+def get_current_active_user_read(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(database.get_read_db)
+) -> models.SystemUser:
+    return _detached(db, get_user_from_token(db, token))
+
+def _detached(db: Session, user: models.SystemUser) -> models.SystemUser:
+    db.expunge(user)
+    if user.vendor_details is not None:
+        db.expunge(user.vendor_details)
+    return user
+
+def get_user_from_token(db: Session, token: str) -> models.SystemUser:
+    """
+    ตรวจสอบ JWT และคืน User ที่ Active อยู่ (Session แบบ Sync ใช้กับ WebSocket)
+    """
+    token_data = _decode_token(token)
+    user = crud.get_user_by_username(db, username=token_data.username) # Query ด้วย username
+    return _check_active(user)
+
+def _decode_token(token: str) -> token_schemas.TokenData:
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username_from_token: Optional[str] = payload.get("sub") # "sub" คือ username
         if username_from_token is None:
-            raise credentials_exception
-        token_data = token_schemas.TokenData(username=username_from_token) # ใช้ TokenData schema
+            raise _credentials_exception()
+        return token_schemas.TokenData(username=username_from_token) # ใช้ TokenData schema
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
 
-    user = crud.get_user_by_username(db, username=token_data.username) # Query ด้วย username
+def _check_active(user: Optional[models.SystemUser]) -> models.SystemUser:
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     if not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return user
\ No newline at end of file
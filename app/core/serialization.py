@@ -0,0 +1,336 @@
+# app/core/serialization.py
+# Fast path สำหรับส่ง Response ที่เป็นรายการยาว (Shipments / Booking Rounds)
+# ปกติ FastAPI จะ Validate ทุกแถวผ่าน response_model (รวม Validator check_zero_date) แล้ว encode ด้วย json ของ stdlib
+# ที่นี่มี 2 ทาง (เลือกด้วย settings.FAST_SERIALIZATION):
+#   - RowSerializer (ค่าเริ่มต้น): อ่านค่าจาก ORM Object หรือ Row Mapping ตรง ๆ ตาม Field ของ Schema แล้ว orjson.dumps
+#     ได้ JSON เหมือน response_model ทุก Key แต่ไม่สร้าง Pydantic Object ต่อแถว
+#   - TypeAdapter ที่ Compile ไว้ตอน Import: Validate + dump_json ใน pydantic-core (ทางเดิมแต่ไม่ต้องสร้าง Adapter ทุก Request)
+# Endpoint ยังประกาศ response_model ไว้เหมือนเดิมเพื่อให้ OpenAPI ถูกต้อง (FastAPI ไม่ Validate ซ้ำเมื่อคืน Response เอง)
+#
+# Content Negotiation: Router ที่ใช้ route_class=NegotiatingRoute จะตอบเป็น MessagePack เมื่อ Client ส่ง
+# "Accept: application/msgpack" (ค่าเริ่มต้นยังเป็น JSON) โครงสร้างข้อมูลเหมือน JSON ทุกอย่าง วันที่/เวลาเป็น ISO String
+#
+# Export: ExportEncoder แปลงแถวเป็น NDJSON / CSV ทีละชุด ให้ Endpoint ส่งต่อด้วย StreamingResponse
+import csv
+import enum
+import io
+from collections.abc import Mapping
+from contextvars import ContextVar
+from datetime import date, datetime, time, timedelta
+from typing import Any, Callable, Dict, List, Optional, Type, Union, get_args, get_origin
+
+import msgpack
+import orjson
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, TypeAdapter
+
+from .config import settings
+from ..schemas import booking_round_schemas, master_data_schemas, shipment_schemas, warehouse_schemas
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z # "Z" สำหรับเวลา UTC ให้ตรงกับ Pydantic
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+_MSGPACK_ACCEPT = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+
+# รูปแบบ Response ของ Request ปัจจุบัน (NegotiatingRoute ตั้งให้จาก Accept Header)
+_response_media_type: ContextVar[str] = ContextVar("response_media_type", default=JSON_MEDIA_TYPE)
+
+def response_media_type() -> str:
+    """รูปแบบ Response ที่ตกลงกับ Client ของ Request ปัจจุบัน (JSON_MEDIA_TYPE / MSGPACK_MEDIA_TYPE)"""
+    return _response_media_type.get()
+
+def negotiate(accept: Optional[str]) -> str:
+    """
+    เลือก JSON หรือ MessagePack จาก Accept Header (รองรับ q=) เลือก MessagePack เฉพาะเมื่อ q สูงกว่า JSON
+    ไม่มี Header / "*/*" / q เท่ากัน -> JSON
+    """
+    if not accept or "msgpack" not in accept:
+        return JSON_MEDIA_TYPE
+    msgpack_q = json_q = 0.0
+    for part in accept.split(","):
+        media_type, _, params = part.partition(";")
+        media_type = media_type.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type in _MSGPACK_ACCEPT:
+            msgpack_q = max(msgpack_q, q)
+        elif media_type in (JSON_MEDIA_TYPE, "application/*", "*/*"):
+            json_q = max(json_q, q)
+    return MSGPACK_MEDIA_TYPE if msgpack_q > json_q else JSON_MEDIA_TYPE
+
+def _msgpack_default(value):
+    # ให้ค่าออกมาเหมือนใน JSON (Pydantic/orjson) Client จึงใช้ Model เดิมได้ทั้งสองแบบ
+    if isinstance(value, datetime):
+        text = value.isoformat()
+        return text[:-6] + "Z" if text.endswith("+00:00") else text
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    raise TypeError(f"Cannot serialize {type(value).__name__} to MessagePack")
+
+def packb(content: Any) -> bytes:
+    return msgpack.packb(content, default=_msgpack_default, use_bin_type=True)
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSONResponse ที่ encode ด้วย orjson (ใช้เป็น default_response_class ของ App)
+    ถ้า Request นี้ผ่าน NegotiatingRoute และ Client ขอ MessagePack จะ encode เป็น MessagePack แทน
+    """
+    def __init__(self, content: Any = None, status_code: int = 200, headers=None, media_type: Optional[str] = None, background=None):
+        if media_type is None and _response_media_type.get() == MSGPACK_MEDIA_TYPE:
+            media_type = MSGPACK_MEDIA_TYPE
+        super().__init__(content, status_code=status_code, headers=headers, media_type=media_type, background=background)
+
+    def render(self, content: Any) -> bytes:
+        if self.media_type == MSGPACK_MEDIA_TYPE:
+            return packb(content)
+        return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+class EncodedResponse(Response):
+    """Response ที่ Body encode ไว้แล้ว (JSON หรือ MessagePack ตาม media_type ที่ส่งมา)"""
+    media_type = JSON_MEDIA_TYPE
+
+class NegotiatingRoute(APIRoute):
+    """route_class ของ Router ที่รองรับ Accept: application/msgpack (ใส่ Vary: Accept ให้ Cache แยกเก็บ)"""
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def negotiating_handler(request: Request) -> Response:
+            token = _response_media_type.set(negotiate(request.headers.get("accept")))
+            try:
+                response = await handler(request)
+            finally:
+                _response_media_type.reset(token)
+            vary = response.headers.get("vary")
+            if not vary:
+                response.headers["Vary"] = "Accept"
+            elif "accept" not in vary.lower():
+                response.headers["Vary"] = vary + ", Accept"
+            return response
+
+        return negotiating_handler
+
+# Before-validator ที่ RowSerializer ทำแทนได้ (Validator อื่นต้องผ่าน Pydantic จึงไม่รองรับ)
+_KNOWN_VALIDATORS = {
+    shipment_schemas.Shipment.check_zero_date.__func__: shipment_schemas.zero_date_to_none,
+}
+_PASSTHROUGH = (str, int, date, datetime, time)
+_MISSING = object()
+
+def _unwrap_optional(annotation):
+    if get_origin(annotation) is Union:
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+class RowSerializer:
+    """
+    แปลง ORM Object / Row Mapping เป็น dict ตาม Field ของ Schema (by_alias เหมือน response_model)
+    Compile ตอนสร้าง: ถ้า Schema มี Type หรือ Validator ที่ทำแทนไม่ได้จะ raise TypeError ทันที ไม่ใช่ตอนตอบ Request
+    """
+    def __init__(self, model: Type[BaseModel], only: Optional[frozenset] = None):
+        self.model = model
+        self._readable_by_class = {}
+        validators = {}
+        for decorator in model.__pydantic_decorators__.field_validators.values():
+            func = getattr(decorator.func, "__func__", decorator.func)
+            if decorator.info.mode != "before" or func not in _KNOWN_VALIDATORS:
+                raise TypeError(f"{model.__name__}: validator {decorator.cls_var_name} is not supported")
+            for name in decorator.info.fields:
+                validators[name] = _KNOWN_VALIDATORS[func]
+
+        # (Key ใน JSON, ชื่อที่ใช้อ่านค่า, ตัวแปลงค่า, ค่า Default)
+        self.fields = []
+        for name, field in model.model_fields.items():
+            key = field.alias or name
+            if only is not None and key not in only:
+                continue # Sparse Fieldset: ตอบเฉพาะ Key ที่ขอ
+            sources = (key, name) if key != name else (name,)
+            convert = self._converter(model, name, field.annotation)
+            before = validators.get(name)
+            if before:
+                convert = (lambda f, c: (lambda v: c(f(v))))(before, convert) if convert else before
+            default = None if field.is_required() else field.get_default(call_default_factory=True)
+            self.fields.append((key, sources, convert, default))
+
+    @staticmethod
+    def _converter(model, name: str, annotation) -> Optional[Callable]:
+        annotation = _unwrap_optional(annotation)
+        if get_origin(annotation) in (list, List):
+            (item,) = get_args(annotation)
+            item_convert = RowSerializer._converter(model, name, item)
+            if item_convert is None:
+                return lambda v: None if v is None else list(v)
+            return lambda v: None if v is None else [item_convert(i) for i in v]
+        if get_origin(annotation) in (dict, Dict) and all(arg in _PASSTHROUGH for arg in get_args(annotation)):
+            return lambda v: None if v is None else dict(v)
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            nested = RowSerializer(annotation)
+            return lambda v: None if v is None else nested.dump_one(v)
+        if annotation is float:
+            return lambda v: None if v is None else float(v) # DECIMAL -> float เหมือน Pydantic
+        if annotation is bool:
+            return lambda v: None if v is None else bool(v)
+        if annotation in _PASSTHROUGH:
+            return None
+        raise TypeError(f"{model.__name__}.{name}: type {annotation!r} is not supported")
+
+    def _readable(self, cls) -> frozenset:
+        # ชื่อที่ Class มีจริง (Column/Relationship/property) ชื่อที่ไม่มีจะไม่ getattr ให้เสียเวลากับ AttributeError ทุกแถว
+        readable = self._readable_by_class.get(cls)
+        if readable is None:
+            readable = frozenset(source for _, sources, _, _ in self.fields for source in sources if hasattr(cls, source))
+            self._readable_by_class[cls] = readable
+        return readable
+
+    def dump_one(self, row) -> dict:
+        if isinstance(row, Mapping):
+            values, readable = row, ()
+        else:
+            # ORM Object: ค่าที่โหลดแล้วอยู่ใน __dict__ (อ่านตรงเร็วกว่า Descriptor) ที่เหลือค่อย getattr
+            values, readable = getattr(row, "__dict__", {}), self._readable(type(row))
+        out = {}
+        for key, sources, convert, default in self.fields:
+            value = _MISSING
+            for source in sources:
+                value = values.get(source, _MISSING)
+                if value is _MISSING and source in readable:
+                    value = getattr(row, source)
+                if value is not _MISSING:
+                    break
+            if value is _MISSING:
+                value = default
+            elif convert is not None:
+                value = convert(value)
+            out[key] = value
+        return out
+
+    def dump(self, rows) -> list:
+        return [self.dump_one(row) for row in rows]
+
+class ListSerializer:
+    """RowSerializer + TypeAdapter ของ List[model] ที่ Compile ไว้ตั้งแต่ Import"""
+    _MAX_SUBSETS = 256
+
+    def __init__(self, model: Type[BaseModel], only: Optional[frozenset] = None):
+        self.model = model
+        self.rows = RowSerializer(model, only)
+        # Subset (Sparse Fieldset) ใช้ RowSerializer เสมอ: TypeAdapter ต้องการ Field บังคับครบทุกแถว
+        self.adapter = TypeAdapter(List[model]) if only is None else None
+        self._subsets = {}
+
+    def subset(self, fieldset: Optional[frozenset]) -> "ListSerializer":
+        """Serializer ที่ตอบเฉพาะ Key ใน fieldset (จาก app/core/fieldsets.parse) None = ตัวเอง; Compile ครั้งแรกแล้ว Cache"""
+        if fieldset is None:
+            return self
+        serializer = self._subsets.get(fieldset)
+        if serializer is None:
+            serializer = ListSerializer(self.model, fieldset)
+            if len(self._subsets) < self._MAX_SUBSETS:
+                self._subsets[fieldset] = serializer
+        return serializer
+
+    def dump_json(self, rows) -> bytes:
+        """รายการ ORM Object / Row Mapping -> JSON bytes (Array)"""
+        if settings.FAST_SERIALIZATION or self.adapter is None:
+            return orjson.dumps(self.rows.dump(rows), option=ORJSON_OPTIONS)
+        return self.adapter.dump_json(self.adapter.validate_python(list(rows), from_attributes=True), by_alias=True)
+
+    def dump_msgpack(self, rows) -> bytes:
+        """รายการ ORM Object / Row Mapping -> MessagePack bytes (Array) โครงสร้างเดียวกับ dump_json"""
+        if settings.FAST_SERIALIZATION or self.adapter is None:
+            return packb(self.rows.dump(rows))
+        validated = self.adapter.validate_python(list(rows), from_attributes=True)
+        return packb(self.adapter.dump_python(validated, mode="json", by_alias=True))
+
+SHIPMENT_LIST = ListSerializer(shipment_schemas.Shipment)
+BOOKING_ROUND_LIST = ListSerializer(booking_round_schemas.BookingRound)
+BOOKING_ROUND_SUMMARY_LIST = ListSerializer(booking_round_schemas.BookingRoundSummary)
+WAREHOUSE_LIST = ListSerializer(warehouse_schemas.Warehouse)
+CONTROL_CODE_LIST = ListSerializer(master_data_schemas.ControlCode)
+MASTER_BOOKING_ROUND_LIST = ListSerializer(master_data_schemas.MasterBookingRound)
+
+def list_response(serializer: ListSerializer, rows, response: Optional[Response] = None) -> Response:
+    """
+    สร้าง Response ของรายการ โดยคง Header/Status ที่ Endpoint ตั้งไว้บน response (เช่น X-Next-Cursor)
+    encode เป็น MessagePack ถ้า Client ขอผ่าน NegotiatingRoute ไม่เช่นนั้นเป็น JSON
+    """
+    headers = None
+    status_code = 200
+    if response is not None:
+        headers = {k: v for k, v in response.headers.items() if k not in ("content-length", "content-type")}
+        status_code = response.status_code or 200
+    if _response_media_type.get() == MSGPACK_MEDIA_TYPE:
+        return EncodedResponse(serializer.dump_msgpack(rows), status_code=status_code, headers=headers, media_type=MSGPACK_MEDIA_TYPE)
+    return EncodedResponse(serializer.dump_json(rows), status_code=status_code, headers=headers)
+
+# --- Export (NDJSON / CSV แบบ Stream) ---
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+CSV_MEDIA_TYPE = "text/csv; charset=utf-8"
+EXPORT_MEDIA_TYPES = {"ndjson": NDJSON_MEDIA_TYPE, "csv": CSV_MEDIA_TYPE}
+
+class ExportEncoder:
+    """
+    แปลงแถว (ORM Object / Row Mapping) เป็น bytes ของ NDJSON หรือ CSV ทีละชุด ค่าเหมือน RowSerializer (by_alias)
+    Field ใน exclude (เช่น details ที่เป็นรายการซ้อน) ไม่ถูกส่งออก
+    CSV: Field ที่เป็น Model ซ้อนแตกเป็นคอลัมน์ "<field>.<sub>" ชุดคอลัมน์คงที่ตาม Schema (ไม่ขึ้นกับแถวแรก)
+    """
+    def __init__(self, model: Type[BaseModel], format: str, exclude=()):
+        if format not in EXPORT_MEDIA_TYPES:
+            raise ValueError(f"Unsupported export format: {format}")
+        self.format = format
+        self.media_type = EXPORT_MEDIA_TYPES[format]
+        self.rows = RowSerializer(model)
+        self.exclude = frozenset(exclude)
+        self.columns = [] # (Key, Key ย่อยของ Model ซ้อน หรือ None)
+        for name, field in model.model_fields.items():
+            key = field.alias or name
+            if key in self.exclude:
+                continue
+            annotation = _unwrap_optional(field.annotation)
+            if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+                self.columns += [(key, sub_field.alias or sub) for sub, sub_field in annotation.model_fields.items()]
+            else:
+                self.columns.append((key, None))
+
+    def _records(self, rows):
+        for row in rows:
+            record = self.rows.dump_one(row)
+            for key in self.exclude:
+                record.pop(key, None)
+            yield record
+
+    def _csv(self, lines) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(lines)
+        return buffer.getvalue().encode("utf-8")
+
+    def header(self) -> bytes:
+        """ส่วนหัวของไฟล์ (CSV: BOM ให้ Excel อ่านภาษาไทยถูก + แถวชื่อคอลัมน์, NDJSON: ไม่มี)"""
+        if self.format != "csv":
+            return b""
+        return "\ufeff".encode("utf-8") + self._csv([[key if sub is None else f"{key}.{sub}" for key, sub in self.columns]])
+
+    def encode(self, rows) -> bytes:
+        if self.format == "ndjson":
+            return b"".join(orjson.dumps(record, option=ORJSON_OPTIONS) + b"\n" for record in self._records(rows))
+        lines = []
+        for record in self._records(rows):
+            lines.append([record.get(key) if sub is None else (record.get(key) or {}).get(sub) for key, sub in self.columns])
+        return self._csv(lines)
+
+# Export ประวัติ Shipment (/shipments/export): ไม่มี details เพื่อให้ 1 แถวต่อ 1 Shipment ทั้ง NDJSON และ CSV
+SHIPMENT_EXPORT = {format: ExportEncoder(shipment_schemas.Shipment, format, exclude=("details",)) for format in EXPORT_MEDIA_TYPES}
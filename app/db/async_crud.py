@@ -0,0 +1,236 @@
+# app/db/async_crud.py
+# CRUD แบบ Async (AsyncSession) สำหรับ Endpoint ที่ถูกเรียกบ่อย
+# Query เขียนด้วย select() แล้วแยกเป็นฟังก์ชัน *_stmt เพื่อให้อ่าน/ทดสอบกับ Session ปกติได้ด้วย
+# Relationship ของ Shipment เป็น lazy="raise" ทุก Query เลือก Profile จาก load_profiles
+# หมายเหตุ: Profile อาจ JOIN Collection (เช่น SHIPMENT_DETAIL -> details)
+#          จึงต้องเรียก .unique() ทุกครั้งที่ดึงผลลัพธ์เป็น Entity
+# Endpoint ที่คืนรายการแบ่งหน้าด้วย Keyset (app/db/pagination.py) ตาม *_KEYS ด้านล่าง
+# รายการ Shipment (อ่านอย่างเดียว) ใช้ Projection แบบ Core (app/db/projections.py) แทน Entity:
+#   ได้ dict ตามโครงสร้าง Schema (ไม่ใช่ models.Shipment) + DOH ของทั้งหน้าใน Query เดียว
+from datetime import datetime, time, timedelta
+from typing import AsyncIterator, List, Optional
+
+from sqlalchemy import and_, exists, or_, select, union
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from . import load_profiles, models, pagination, projections
+
+# --- Keyset (คีย์ที่ใช้เรียง + shipid กันค่าซ้ำ) ---
+# InnoDB เก็บ Primary Key ต่อท้ายทุก Secondary Index ORDER BY apmdate, shipid จึงอ่านตาม ix_shipment_apmdate ได้เลย
+APMDATE_KEYS = ((models.Shipment.apmdate, "apmdate"), (models.Shipment.shipid, "shipid"))
+CHDATE_KEYS = ((models.Shipment.chdate, "chdate"), (models.Shipment.shipid, "shipid"))
+SHIPID_KEYS = ((models.Shipment.shipid, "shipid"),)
+
+# --- Statement Builders ---
+def user_by_username_stmt(username: str):
+    return (select(models.SystemUser)
+              .options(joinedload(models.SystemUser.vendor_details))
+              .where(models.SystemUser.username == username))
+
+def shipment_by_id_stmt(shipid: str):
+    return select(models.Shipment).options(*load_profiles.SHIPMENT_DETAIL).where(models.Shipment.shipid == shipid)
+
+def shipments_stmt(filters: dict = None, projection: projections.ShipmentProjection = projections.FULL):
+    if filters is None:
+        filters = {}
+
+    stmt = projection.select()
+    if filters.get("docstat"):
+        stmt = stmt.where(models.Shipment.docstat == filters["docstat"])
+    if filters.get("is_on_hold") is not None:
+        is_on_hold_bool = str(filters["is_on_hold"]).lower() == 'true'
+        stmt = stmt.where(models.Shipment.is_on_hold == is_on_hold_bool)
+    if filters.get("apmdate_from"):
+        stmt = stmt.where(models.Shipment.apmdate >= filters["apmdate_from"])
+    if filters.get("apmdate_to"):
+        stmt = stmt.where(models.Shipment.apmdate <= filters["apmdate_to"])
+    return stmt.order_by(models.Shipment.apmdate.desc())
+
+def shipments_for_vendor_stmt(grade: str, vencode: str, projection: projections.ShipmentProjection = projections.FULL):
+    return (projection.select()
+              .where(or_(
+                  and_(models.Shipment.docstat == '02', models.Shipment.current_grade_to_assign == grade),
+                  and_(
+                      models.Shipment.docstat == 'BC',
+                      ~exists().where(
+                          models.ShipmentRejection.shipid == models.Shipment.shipid,
+                          models.ShipmentRejection.vencode == vencode
+                      )
+                  )
+              ))
+              .order_by(models.Shipment.apmdate.desc()))
+
+def unassigned_shipments_stmt(filters: dict, projection: projections.ShipmentProjection = projections.FULL):
+    stmt = (projection.select()
+              .where(models.Shipment.booking_round_id == None, models.Shipment.is_on_hold == False))
+    if filters.get("shippoint"):
+        stmt = stmt.where(models.Shipment.shippoint == filters["shippoint"])
+    if filters.get("crdate"):
+        day_start = datetime.combine(filters["crdate"], time.min)
+        stmt = stmt.where(models.Shipment.apmdate >= day_start, models.Shipment.apmdate < day_start + timedelta(days=1))
+    return stmt.order_by(models.Shipment.shipid)
+
+def held_shipments_stmt(filters: dict, projection: projections.ShipmentProjection = projections.FULL):
+    stmt = (projection.select()
+              .where(models.Shipment.is_on_hold == True))
+    if filters:
+        if filters.get("shippoint"):
+            stmt = stmt.where(models.Shipment.shippoint == filters["shippoint"])
+        if filters.get("apmdate_from"):
+            stmt = stmt.where(models.Shipment.apmdate >= filters["apmdate_from"])
+        if filters.get("apmdate_to"):
+            stmt = stmt.where(models.Shipment.apmdate <= filters["apmdate_to"])
+    return stmt.order_by(models.Shipment.apmdate.desc())
+
+def ongoing_shipments_stmt(vencode: Optional[str] = None, projection: projections.ShipmentProjection = projections.FULL):
+    stmt = (projection.select()
+              .where(models.Shipment.docstat.in_(['03', '04'])))
+    if vencode:
+        stmt = stmt.where(models.Shipment.vencode == vencode)
+    return stmt.order_by(models.Shipment.apmdate.asc())
+
+def past_shipments_stmt(vencode: Optional[str] = None, filters: dict = None, projection: projections.ShipmentProjection = projections.FULL):
+    if filters is None:
+        filters = {}
+
+    stmt = (projection.select()
+              .where(models.Shipment.docstat.in_(['06', 'RJ', '05'])))
+    if vencode:
+        stmt = stmt.where(models.Shipment.vencode == vencode)
+    if filters.get("shipid"):
+        stmt = stmt.where(models.Shipment.shipid.like(f"%{filters['shipid']}%"))
+    if filters.get("route"):
+        # ใช้ EXISTS แทน JOIN: Shipment ที่มีหลาย DOH ใน route เดียวกันจะไม่ซ้ำจนกิน limit ของหน้า
+        stmt = stmt.where(exists().where(models.DOH.shipid == models.Shipment.shipid, models.DOH.route == filters["route"]))
+    if filters.get("apmdate_from"):
+        stmt = stmt.where(models.Shipment.apmdate >= filters["apmdate_from"])
+    if filters.get("apmdate_to"):
+        end_date = datetime.fromisoformat(filters["apmdate_to"]) + timedelta(days=1)
+        stmt = stmt.where(models.Shipment.apmdate < end_date)
+    return stmt.order_by(models.Shipment.chdate.desc())
+
+# --- Search (FULLTEXT ngram จาก Migration v6) ---
+# คำที่สั้นกว่า ngram_token_size (2) ไม่มี Token ใน Index จึงค้นไม่ได้
+SEARCH_MIN_WORD_LENGTH = 2
+
+def search_against(q: str) -> str:
+    """
+    ข้อความค้นหา -> เงื่อนไข Boolean Mode: ทุกคำต้องพบ (+) และค้นแต่ละคำเป็น Phrase ("...")
+    Phrase ของ ngram คือ Token ที่ต่อกันตามลำดับ จึงได้ผลแบบ Substring (รวม Prefix) แม้ข้อความไทยไม่มีช่องว่าง
+    มีคำที่สั้นกว่า SEARCH_MIN_WORD_LENGTH (หรือไม่มีคำเลย) raise ValueError แทนการตัดคำนั้นทิ้งเงียบ ๆ
+    """
+    words = [word.replace('"', "") for word in q.split()]
+    short = [word for word in words if len(word) < SEARCH_MIN_WORD_LENGTH]
+    if not words or short:
+        raise ValueError(f"Every search word needs at least {SEARCH_MIN_WORD_LENGTH} characters"
+                         + (f" (too short: {', '.join(repr(word) for word in short)})" if short else ""))
+    return " ".join(f'+"{word}"' for word in words)
+
+def search_shipments_stmt(q: str, vencode: Optional[str] = None, projection: projections.ShipmentProjection = projections.FULL):
+    """
+    ค้น Shipment จาก shipid / customer_name และ DOH (doid / cusname)
+    MATCH ที่อยู่ใน OR กับเงื่อนไขอื่นใช้ FULLTEXT Index ไม่ได้ (MySQL จะสแกนทั้งตาราง)
+    จึงแยกแต่ละทางเป็น SELECT shipid ที่ใช้ Index ของตัวเองแล้ว UNION เป็น Derived Table ก่อน JOIN กลับ:
+      - MATCH(shipment.shipid, customer_name) และ MATCH(doh.doid, cusname) ผ่าน ft_*_search
+      - ข้อความคำเดียว: Prefix ของ shipid / doid ด้วย LIKE 'x%' (Range Scan บน Primary Key) ครอบคลุมรหัสที่สั้นกว่า Token
+    """
+    against = search_against(q)
+    hits = [
+        select(models.Shipment.shipid)
+          .where(match(models.Shipment.shipid, models.Shipment.customer_name, against=against).in_boolean_mode()),
+        select(models.DOH.shipid)
+          .where(match(models.DOH.doid, models.DOH.cusname, against=against).in_boolean_mode()),
+    ]
+    text = q.strip()
+    if text and len(text.split()) == 1:
+        hits += [
+            select(models.Shipment.shipid).where(models.Shipment.shipid.startswith(text, autoescape=True)),
+            select(models.DOH.shipid).where(models.DOH.doid.startswith(text, autoescape=True)),
+        ]
+    search_hits = union(*hits).subquery("search_hits")
+
+    stmt = projection.select().join(search_hits, search_hits.c.shipid == models.Shipment.shipid)
+    if vencode:
+        stmt = stmt.where(models.Shipment.vencode == vencode)
+    return stmt.order_by(models.Shipment.apmdate.desc())
+
+# --- User ---
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[models.SystemUser]:
+    result = await db.execute(user_by_username_stmt(username))
+    return result.unique().scalars().first()
+
+async def update_user_fcm_token(db: AsyncSession, user: models.SystemUser, new_token: str) -> models.SystemUser:
+    """อัปเดต FCM Token (user ต้องมาจาก AsyncSession เดียวกัน เช่นจาก get_current_active_user)"""
+    if user:
+        user.fcm_token = new_token
+        await db.commit()
+        await db.refresh(user)
+    return user
+
+# --- Shipment ---
+async def get_shipment_by_id(db: AsyncSession, shipid: str) -> Optional[models.Shipment]:
+    result = await db.execute(shipment_by_id_stmt(shipid))
+    return result.unique().scalars().first()
+
+async def _with_details(db: AsyncSession, rows, projection: projections.ShipmentProjection) -> List[dict]:
+    """แถวจาก projection.select() -> dict พร้อม details (DOH ของทุกแถวดึงครั้งเดียวต่อ DETAIL_BATCH_SIZE แถว)"""
+    detail_rows = []
+    for shipids in projection.detail_batches(rows):
+        result = await db.execute(projections.details_stmt(shipids))
+        detail_rows.extend(result.all())
+    return projection.assemble(rows, detail_rows)
+
+async def _paginate(db: AsyncSession, stmt, keys, cursor: Optional[str], limit: Optional[int],
+                    projection: projections.ShipmentProjection, descending: bool = False) -> pagination.Page:
+    limit = pagination.clamp_limit(limit)
+    result = await db.execute(pagination.keyset(stmt, keys, cursor, limit, descending=descending))
+    page = pagination.page(result.all(), keys, limit)
+    page.items = await _with_details(db, page.items, projection)
+    return page
+
+# fieldset: ชุด Key จาก app/core/fieldsets.parse (None = ทุก Field) ตัดคอลัมน์/JOIN/DOH ที่ไม่ได้ขอออกจาก Query
+async def get_shipments(db: AsyncSession, filters: dict = None, cursor: Optional[str] = None, limit: Optional[int] = None,
+                        fieldset: Optional[frozenset] = None) -> pagination.Page:
+    projection = projections.for_fieldset(fieldset)
+    return await _paginate(db, shipments_stmt(filters, projection), APMDATE_KEYS, cursor, limit, projection, descending=True)
+
+async def get_shipments_for_vendor(db: AsyncSession, grade: str, vencode: str, cursor: Optional[str] = None, limit: Optional[int] = None,
+                                   fieldset: Optional[frozenset] = None) -> pagination.Page:
+    projection = projections.for_fieldset(fieldset)
+    return await _paginate(db, shipments_for_vendor_stmt(grade, vencode, projection), APMDATE_KEYS, cursor, limit, projection, descending=True)
+
+async def get_unassigned_shipments(db: AsyncSession, filters: dict, cursor: Optional[str] = None, limit: Optional[int] = None,
+                                   fieldset: Optional[frozenset] = None) -> pagination.Page:
+    projection = projections.for_fieldset(fieldset)
+    return await _paginate(db, unassigned_shipments_stmt(filters, projection), SHIPID_KEYS, cursor, limit, projection)
+
+async def get_held_shipments(db: AsyncSession, filters: dict, cursor: Optional[str] = None, limit: Optional[int] = None,
+                             fieldset: Optional[frozenset] = None) -> pagination.Page:
+    projection = projections.for_fieldset(fieldset)
+    return await _paginate(db, held_shipments_stmt(filters, projection), APMDATE_KEYS, cursor, limit, projection, descending=True)
+
+async def get_ongoing_shipments(db: AsyncSession, vencode: Optional[str] = None, fieldset: Optional[frozenset] = None) -> List[dict]:
+    projection = projections.for_fieldset(fieldset)
+    result = await db.execute(ongoing_shipments_stmt(vencode, projection))
+    return await _with_details(db, result.all(), projection)
+
+async def search_shipments(db: AsyncSession, q: str, vencode: Optional[str] = None, cursor: Optional[str] = None,
+                           limit: Optional[int] = None, fieldset: Optional[frozenset] = None) -> pagination.Page:
+    projection = projections.for_fieldset(fieldset)
+    return await _paginate(db, search_shipments_stmt(q, vencode, projection), APMDATE_KEYS, cursor, limit, projection, descending=True)
+
+async def get_past_shipments(db: AsyncSession, vencode: Optional[str] = None, filters: dict = None, cursor: Optional[str] = None,
+                             limit: Optional[int] = None, fieldset: Optional[frozenset] = None) -> pagination.Page:
+    projection = projections.for_fieldset(fieldset)
+    return await _paginate(db, past_shipments_stmt(vencode, filters, projection), CHDATE_KEYS, cursor, limit, projection, descending=True)
+
+async def stream_past_shipments(db: AsyncSession, vencode: Optional[str] = None, filters: dict = None, batch_size: int = 1000) -> AsyncIterator[List[dict]]:
+    """
+    ประวัติ Shipment ทั้งหมดตาม Filter เดียวกับ get_past_shipments ทีละ batch_size แถว (ไม่แบ่งหน้า ไม่มี details)
+    อ่านผ่าน Server-side Cursor (stream + yield_per) หน่วยความจำคงที่ไม่ว่าผลลัพธ์จะมีกี่แถว
+    """
+    result = await db.stream(past_shipments_stmt(vencode, filters).execution_options(yield_per=batch_size))
+    async for rows in result.partitions():
+        yield projections.FULL.assemble(rows, ())
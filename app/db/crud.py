@@ -2,18 +2,29 @@
 from collections import defaultdict
 import math
 from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.orm.exc import StaleDataError
 
-from app.core import firebase_service
-from . import models
+from app.core import firebase_service, realtime
+from . import event_log, load_profiles, models, pagination, transactions, versioning
 from ..schemas import shipment_schemas, booking_round_schemas
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from datetime import date, datetime, timedelta, time, timezone
-from sqlalchemy import and_, func, not_, or_
+from sqlalchemy import and_, case, exists, func, or_
 # --- User CRUD ---
 def get_user_by_username(db: Session, username: str) -> Optional[models.SystemUser]:
     return db.query(models.SystemUser).options(joinedload(models.SystemUser.vendor_details)).filter(models.SystemUser.username == username).first()
-def get_shipment_by_id(db: Session, shipid: str) -> Optional[models.Shipment]:
-    return db.query(models.Shipment).filter(models.Shipment.shipid == shipid).first()
+def get_shipment_by_id(db: Session, shipid: str, options=load_profiles.SHIPMENT_DETAIL) -> Optional[models.Shipment]:
+    return db.query(models.Shipment).options(*options).filter(models.Shipment.shipid == shipid).first()
+def reload_shipment(db: Session, shipid: str, options=load_profiles.SHIPMENT_RELOAD) -> Optional[models.Shipment]:
+    """
+    โหลด Shipment ใหม่หลัง commit พร้อม Relationship ตาม Profile (ใช้แทน db.refresh ก่อนตอบกลับ)
+    populate_existing ทำให้ Object เดิมใน Session ถูกเติม Relationship ที่ยังไม่ได้โหลด
+    """
+    return (db.query(models.Shipment)
+              .options(*options)
+              .filter(models.Shipment.shipid == shipid)
+              .execution_options(populate_existing=True)
+              .first())
 # --- Master Data CRUD ---
 def get_warehouses(db: Session) -> List[models.MWarehouse]:
     return db.query(models.MWarehouse).filter(models.MWarehouse.is_active == True).all()
@@ -27,12 +38,7 @@ def get_shipments(db: Session, filters: dict = None) -> List[models.Shipment]:
     if filters is None:
         filters = {}
         
-    query = db.query(models.Shipment).options(
-        selectinload(models.Shipment.details),  # Eager load details
-        joinedload(models.Shipment.warehouse),  # Eager load warehouse
-        joinedload(models.Shipment.mshiptype),  # Eager load ship type
-        joinedload(models.Shipment.mleadtime)   # Eager load lead time
-    )
+    query = db.query(models.Shipment).options(*load_profiles.SHIPMENT_LIST)
     
 
     if filters.get("docstat"):
@@ -67,7 +73,7 @@ def get_shipments_for_vendor(db: Session, grade: str, vencode: str) -> List[mode
     - งานเปิดที่ทุกคนเห็น (docstat='BC')
     """
     return (db.query(models.Shipment)
-              .options(selectinload(models.Shipment.details))
+              .options(*load_profiles.SHIPMENT_LIST)
               .filter(
     or_(
         # เงื่อนไขกลุ่มที่ 1: ต้องเป็นจริงทั้งสองอย่าง
@@ -79,18 +85,87 @@ def get_shipments_for_vendor(db: Session, grade: str, vencode: str) -> List[mode
         # เงื่อนไขกลุ่มที่ 2
            and_(
                           models.Shipment.docstat == 'BC',
-                          # --- แก้ไขเงื่อนไขนี้ ---
-                          or_(
-                              # กรณีที่ยังไม่มีใครปฏิเสธเลย (field เป็น NULL)
-                              models.Shipment.rejected_by_vencodes.is_(None),
-                              # กรณีที่มีคนปฏิเสธแล้ว และเราไม่ได้อยู่ในนั้น
-                              not_(models.Shipment.rejected_by_vencodes.contains(vencode))
-                          )
+                          # งานเปิดที่เรายังไม่เคยปฏิเสธ (Anti-join กับ PK ของ shipment_rejection)
+                          not_vendor_rejected(vencode)
                       )
     )
 )
               .order_by(models.Shipment.apmdate.desc())
               .all())
+
+def not_vendor_rejected(vencode: str):
+    """เงื่อนไข NOT EXISTS ว่า vencode ไม่เคยปฏิเสธ Shipment แถวนั้น (ใช้ PK shipid + vencode)"""
+    return ~exists().where(
+        models.ShipmentRejection.shipid == models.Shipment.shipid,
+        models.ShipmentRejection.vencode == vencode
+    )
+
+def add_shipment_rejection(db: Session, shipment: models.Shipment, vencode: Optional[str]) -> bool:
+    """บันทึกว่า vencode ไม่รับงานนี้ (ถ้ามีอยู่แล้วไม่ทำอะไร) ยังไม่ commit"""
+    if not vencode or vencode in shipment.rejected_by_vencodes:
+        return False
+    shipment.rejections.append(models.ShipmentRejection(vencode=vencode, rejected_at=datetime.now(timezone.utc)))
+    return True
+
+def is_shipment_visible_to_vendor(shipment: models.Shipment, grade: str, vencode: str) -> bool:
+    """เงื่อนไขเดียวกับ get_shipments_for_vendor แต่ตรวจกับ Object ที่โหลดมาแล้ว"""
+    if shipment.docstat == '02' and shipment.current_grade_to_assign == grade:
+        return True
+    if shipment.docstat == 'BC' and vencode not in (shipment.rejected_by_vencodes or []):
+        return True
+    return False
+
+# Keyset ของ Delta-sync: เรียงตามเลขที่เปลี่ยน แล้วตาม shipid กันค่าซ้ำ (หลายแถวใน Transaction เดียวได้เลขเดียวกัน)
+CHANGE_KEYS = ((models.Shipment.row_version, "row_version"), (models.Shipment.shipid, "shipid"))
+
+def _shipids_seen_by_vendor(db: Session, shipments: List[models.Shipment], grade: str, vencode: str) -> set:
+    """
+    shipid ที่ Vendor นี้เคยเห็นในรายการของตน: เคยถูกเสนอให้เกรดนี้ ('02'), เคยเข้า Broadcast ('BC') หรือ Vendor เคยปฏิเสธ
+    ใช้กรอง Tombstone ไม่ให้ shipid ของงานที่ไม่เคยเกี่ยวกับ Vendor นี้หลุดออกไป
+    """
+    seen = {s.shipid for s in shipments if vencode in (s.rejected_by_vencodes or [])}
+    remaining = [s.shipid for s in shipments if s.shipid not in seen]
+    if remaining:
+        seen.update(shipid for (shipid,) in db.query(models.ShipmentEvent.shipid)
+                      .filter(
+                          models.ShipmentEvent.shipid.in_(remaining),
+                          or_(
+                              and_(models.ShipmentEvent.docstat_to == '02', models.ShipmentEvent.grade == grade),
+                              models.ShipmentEvent.docstat_to == 'BC'
+                          )
+                      )
+                      .distinct())
+    return seen
+
+def get_shipment_changes(db: Session, since: int, grade: Optional[str] = None, vencode: Optional[str] = None,
+                         cursor: Optional[str] = None, limit: Optional[int] = None):
+    """
+    ดึง Shipments ที่เปลี่ยนแปลงหลังเลข since (Delta-sync) ทีละหน้า
+    - Dispatcher/Admin (ไม่ส่ง vencode): ได้ทุกแถวที่เปลี่ยน
+    - Vendor: แถวที่ยังอยู่ในรายการของตน -> changes, แถวที่เคยเห็นแต่หลุดออกไป -> tombstones
+    คืนค่า (page, changes, tombstones, high_water_mark) โดย page.items คือแถวทั้งหมดของหน้านี้
+    """
+    # อ่าน High-water mark ก่อน แล้วอ่านเฉพาะแถวที่เลข <= ค่านี้ (แถวที่เลขสูงกว่าจะมาในรอบถัดไป)
+    # (ไม่ต่ำกว่า since: Client ที่อ่านถึง since แล้วไม่ต้องย้อนกลับไปอ่านซ้ำ)
+    high_water_mark = max(versioning.stable_change_version(db), since)
+
+    query = (db.query(models.Shipment)
+               .options(*load_profiles.SHIPMENT_LIST, selectinload(models.Shipment.rejections))
+               .filter(models.Shipment.row_version > since, models.Shipment.row_version <= high_water_mark))
+    result = _paginate(query, CHANGE_KEYS, cursor, limit)
+
+    if vencode is None:
+        return result, result.items, [], high_water_mark
+
+    changes, hidden = [], []
+    for shipment in result.items:
+        if is_shipment_visible_to_vendor(shipment, grade, vencode):
+            changes.append(shipment)
+        elif since > 0: # Sync ครั้งแรก Client ยังไม่มีแถวไหนให้ลบ
+            hidden.append(shipment)
+    seen = _shipids_seen_by_vendor(db, hidden, grade, vencode) if hidden else set()
+    tombstones = [{"shipid": s.shipid, "row_version": s.row_version} for s in hidden if s.shipid in seen]
+    return result, changes, tombstones, high_water_mark
 # --- Booking Round CRUD ---
 def get_booking_round_by_id(db: Session, round_id: int) -> Optional[models.BookingRound]:
     """
@@ -98,25 +173,67 @@ def get_booking_round_by_id(db: Session, round_id: int) -> Optional[models.Booki
     """
     return (
         db.query(models.BookingRound)
-          .options(
-              selectinload(models.BookingRound.shipments)
-          )
+          .options(*load_profiles.ROUND_DETAIL)
           .filter(models.BookingRound.id == round_id)
+          .execution_options(populate_existing=True) # เผื่อรอบนี้ถูกโหลดไว้แล้วด้วย Profile อื่น
           .first()
     )
-def get_booking_rounds_by_date(db: Session, round_date: date, warehouse_code: str) -> List[models.BookingRound]:
-    return (
+# Keyset ของรายการ BookingRound / MVendor (ดู app/db/pagination.py)
+ROUND_TIME_KEYS = ((models.BookingRound.round_time, "round_time"), (models.BookingRound.id, "id"))
+ROUND_DATE_KEYS = ((models.BookingRound.round_date, "round_date"),) + ROUND_TIME_KEYS
+VENDOR_KEYS = ((models.MVendor.grade, "grade"), (models.MVendor.venname, "venname"), (models.MVendor.vencode, "vencode"))
+
+def _paginate(query, keys, cursor: Optional[str], limit: Optional[int], descending: bool = False) -> pagination.Page:
+    limit = pagination.clamp_limit(limit)
+    return pagination.page(pagination.keyset(query, keys, cursor, limit, descending=descending).all(), keys, limit)
+
+def get_booking_rounds_by_date(db: Session, round_date: date, warehouse_code: str, cursor: Optional[str] = None, limit: Optional[int] = None,
+                               fieldset: Optional[frozenset] = None) -> pagination.Page:
+    query = (
         db.query(models.BookingRound)
-          .options(
-              selectinload(models.BookingRound.shipments)
-          )
+          .options(*load_profiles.round_list(fieldset))
           .filter(
               models.BookingRound.round_date == round_date, 
               models.BookingRound.warehouse_code == warehouse_code
           )
-          .order_by(models.BookingRound.round_time)
-          .all()
     )
+    return _paginate(query, ROUND_TIME_KEYS, cursor, limit)
+def summarize_booking_rounds(db: Session, rounds: List[models.BookingRound]) -> List[dict]:
+    """
+    ?view=summary: แปลงรอบ (โหลดแบบไม่มี shipments) เป็น dict ของคอลัมน์ที่โหลดไว้ + ตัวเลขสรุป
+    นับด้วย Aggregate Query เดียวของทั้งหน้า (GROUP BY booking_round_id, docstat, vencode)
+    แทนการโหลด Shipment ทุกแถวพร้อม Relation; vencode อยู่ใน GROUP BY เพื่อนับ Vendor ที่ไม่ซ้ำข้าม docstat ได้
+    """
+    summaries = {
+        booking_round.id: {"shipment_count": 0, "docstat_counts": {}, "shipment_volume_cbm": 0.0, "vendor_count": 0}
+        for booking_round in rounds
+    }
+    if summaries:
+        vendors = defaultdict(set)
+        aggregate = (
+            db.query(models.Shipment.booking_round_id, models.Shipment.docstat, models.Shipment.vencode,
+                     func.count(), func.coalesce(func.sum(models.Shipment.volume_cbm), 0))
+              .filter(models.Shipment.booking_round_id.in_(list(summaries)))
+              .group_by(models.Shipment.booking_round_id, models.Shipment.docstat, models.Shipment.vencode)
+        )
+        for round_id, docstat, vencode, count, volume in aggregate:
+            summary = summaries[round_id]
+            summary["shipment_count"] += count
+            if docstat is not None:
+                summary["docstat_counts"][docstat] = summary["docstat_counts"].get(docstat, 0) + count
+            summary["shipment_volume_cbm"] += float(volume)
+            if vencode:
+                vendors[round_id].add(vencode)
+        for round_id, vencodes in vendors.items():
+            summaries[round_id]["vendor_count"] = len(vencodes)
+
+    items = []
+    for booking_round in rounds:
+        # เฉพาะ Attribute ที่โหลดแล้ว (load_only) ไม่ getattr คอลัมน์ที่ไม่ได้โหลดให้เกิด Lazy Load
+        item = {key: value for key, value in vars(booking_round).items() if not key.startswith("_")}
+        item.update(summaries[booking_round.id])
+        items.append(item)
+    return items
 def create_booking_round(db: Session, round_in: booking_round_schemas.BookingRoundCreate, creator_id: str) -> models.BookingRound:
     db_round = models.BookingRound(
         round_name=round_in.round_name,
@@ -139,26 +256,34 @@ def create_booking_round(db: Session, round_in: booking_round_schemas.BookingRou
                 models.Shipment.is_on_hold == False # ป้องกันการ assign งานที่ถูก hold
             )
         )
-        shipments_to_assign.update({"booking_round_id": db_round.id, "docstat": '01'}, synchronize_session=False)
+        shipments_to_assign.update({"booking_round_id": db_round.id, "docstat": '01', "row_version": versioning.next_change_version(db)}, synchronize_session=False)
+    # รอบเพิ่งสร้างใหม่ แถวที่มี booking_round_id นี้จึงเป็นแถวที่เพิ่ง Assign เท่านั้น
+    assigned_ids = [shipid for (shipid,) in db.query(models.Shipment.shipid).filter(models.Shipment.booking_round_id == db_round.id)]
+    unheld_ids = [shipid for (shipid,) in db.query(models.Shipment.shipid).filter(models.Shipment.is_on_hold == True)]
     (db.query(models.Shipment)
        .filter(models.Shipment.is_on_hold == True)
-       .update({"is_on_hold": False, "docstat": models.Shipment.docstat_before_hold}, synchronize_session=False))
+       .update({"is_on_hold": False, "docstat": models.Shipment.docstat_before_hold, "row_version": versioning.next_change_version(db)}, synchronize_session=False))
     db.commit()
-    db.refresh(db_round)
+    db_round = get_booking_round_by_id(db, db_round.id)
+    realtime.publish_bulk_change("round_created", shipids=assigned_ids + unheld_ids, round_id=db_round.id, actor=creator_id)
+    event_log.append(event_log.bulk_rows("round_assigned", assigned_ids, actor=creator_id, docstat_to='01', booking_round_id=db_round.id))
+    event_log.append(event_log.bulk_rows("unheld", unheld_ids, actor=creator_id))
     return db_round
-def toggle_shipment_hold_status(db: Session, shipid: str, hold: bool, current_user_id: str) -> Optional[models.Shipment]:
+def toggle_shipment_hold_status(db: Session, shipid: str, hold: bool, current_user_id: str, expected_version: Optional[int] = None) -> Optional[models.Shipment]:
     """
     สลับสถานะ Hold ของ Shipment
     """
-    db_shipment = db.query(models.Shipment).filter(models.Shipment.shipid == shipid).first()
+    db_shipment = get_shipment_by_id(db, shipid, options=load_profiles.SHIPMENT_WRITE)
     if not db_shipment:
         return None
+    ensure_expected_version(db_shipment, expected_version)
     
     # สามารถ Hold ได้เฉพาะงานที่ยังไม่เข้ารอบ
     if db_shipment.booking_round_id is not None:
         # อาจจะ return error หรือแค่ return object เดิมไปเฉยๆ
         return None
 
+    before = realtime.snapshot(db_shipment)
     try:
         if hold: # ถ้าต้องการ "Hold"
             if not db_shipment.is_on_hold:
@@ -175,29 +300,127 @@ def toggle_shipment_hold_status(db: Session, shipid: str, hold: bool, current_us
         db_shipment.chuser = current_user_id
         db_shipment.chdate = datetime.now(timezone.utc)
         db.commit()
-        db.refresh(db_shipment)
+        db_shipment = reload_shipment(db, shipid)
+        realtime.publish_shipment_change(db_shipment, before)
+        if before["is_on_hold"] != db_shipment.is_on_hold:
+            event_log.record("held" if hold else "unheld", db_shipment, before, actor=current_user_id)
         return db_shipment
+    except StaleDataError:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
+        if transactions.is_retryable(e):
+            raise # ให้ transactions.run_with_retry ลองใหม่ทั้ง Transaction
         print(f"ERROR: Failed to toggle hold status for shipment {shipid}: {e}")
         return None
+# (event_type ของ Event Log / realtime, ค่าที่ SET) ของแต่ละ action ของ bulk_update_shipments
+def _bulk_changes(action: str, round_id: Optional[int]) -> Tuple[str, dict]:
+    if action == "hold":
+        # docstat_before_hold = docstat เดิมของแถว (ไม่เปลี่ยน docstat ระหว่าง Hold เหมือน toggle_shipment_hold_status)
+        return "held", {"is_on_hold": True, "docstat_before_hold": models.Shipment.docstat}
+    if action == "unhold":
+        return "unheld", {"is_on_hold": False, "docstat": models.Shipment.docstat_before_hold}
+    if action == "move":
+        return "round_assigned", {"booking_round_id": round_id, "docstat": '01'}
+    return "round_removed", {"booking_round_id": None}
+
+def _bulk_skip_reason(action: str, shipment, round_id: Optional[int]) -> Optional[str]:
+    """เหตุผลที่งานนี้แก้ไม่ได้ (None = แก้ได้) เงื่อนไขเดียวกับ WHERE ของ UPDATE ใน bulk_update_shipments"""
+    if action in ("hold", "unhold"):
+        if shipment.booking_round_id is not None:
+            return "in_round" # Hold ได้เฉพาะงานที่ยังไม่เข้ารอบ
+        if action == "hold" and shipment.is_on_hold:
+            return "already_held"
+        if action == "unhold" and not shipment.is_on_hold:
+            return "not_held"
+        return None
+    if shipment.is_on_hold:
+        return "on_hold"
+    if shipment.docstat != '01':
+        return "not_waiting_round" # เสนองานให้ Vendor ไปแล้ว ย้ายรอบไม่ได้
+    if action == "move" and shipment.booking_round_id == round_id:
+        return "already_in_round"
+    if action == "remove_from_round" and shipment.booking_round_id is None:
+        return "not_in_round"
+    return None
+
+def bulk_update_shipments(
+    db: Session,
+    shipids: List[str],
+    action: str,
+    current_user_id: str,
+    round_id: Optional[int] = None
+) -> Tuple[List[models.Shipment], List[dict]]:
+    """
+    Hold / Unhold / ย้ายเข้ารอบ / เอาออกจากรอบ หลายงานใน Transaction เดียว (POST /shipments/bulk)
+    แทนการเรียกทีละงาน (Query + commit + refresh ต่องาน):
+    1. Lock แถวทั้งชุดด้วย SELECT ... FOR UPDATE คำสั่งเดียว แล้วแยกงานที่แก้ไม่ได้พร้อมเหตุผล
+    2. UPDATE งานที่เหลือด้วยคำสั่งเดียว (Set-based, ใส่ row_version ใหม่ตาม versioning) แล้ว commit
+    3. โหลดงานที่ถูกแก้กลับมาด้วย Query เดียวเพื่อตอบ
+    action = move ต้องมี round_id ของรอบที่มีอยู่จริง (ไม่มี raise ValueError)
+    คืน (งานที่ถูกแก้, [{"shipid", "reason"}] ของงานที่ข้าม)
+    """
+    if action == "move" and db.query(models.BookingRound.id).filter(models.BookingRound.id == round_id).first() is None:
+        raise ValueError(f"Booking round with ID {round_id} not found.")
+
+    shipids = list(dict.fromkeys(shipids))
+    locked = {
+        shipment.shipid: shipment
+        for shipment in (db.query(models.Shipment.shipid, models.Shipment.booking_round_id,
+                                  models.Shipment.is_on_hold, models.Shipment.docstat)
+                           .filter(models.Shipment.shipid.in_(shipids))
+                           .order_by(models.Shipment.shipid)
+                           .with_for_update())
+    }
+    skipped, eligible = [], []
+    for shipid in shipids:
+        shipment = locked.get(shipid)
+        reason = "not_found" if shipment is None else _bulk_skip_reason(action, shipment, round_id)
+        if reason:
+            skipped.append({"shipid": shipid, "reason": reason})
+        else:
+            eligible.append(shipid)
+    if not eligible:
+        db.rollback()
+        return [], skipped
+
+    event_type, changes = _bulk_changes(action, round_id)
+    (db.query(models.Shipment)
+       .filter(models.Shipment.shipid.in_(eligible))
+       .update({
+           **changes,
+           "chuser": current_user_id,
+           "chdate": datetime.now(timezone.utc),
+           "row_version": versioning.next_change_version(db),
+       }, synchronize_session=False))
+    db.commit()
+
+    updated = (db.query(models.Shipment)
+                 .options(*load_profiles.SHIPMENT_LIST)
+                 .filter(models.Shipment.shipid.in_(eligible))
+                 .order_by(models.Shipment.shipid)
+                 .all())
+    affected_round = round_id if action == "move" else None
+    realtime.publish_bulk_change(event_type, shipids=eligible, round_id=affected_round, actor=current_user_id)
+    event_log.append(event_log.bulk_rows(event_type, eligible, actor=current_user_id,
+                                         docstat_to='01' if action in ("move", "remove_from_round") else None,
+                                         booking_round_id=affected_round))
+    print(f"INFO: Bulk {action} by {current_user_id}: {len(eligible)} updated, {len(skipped)} skipped.")
+    return updated, skipped
 # --- Shipment CRUD ---
 def get_unassigned_shipments(db: Session, filters: dict) -> List[models.Shipment]:
     query = (db.query(models.Shipment)
-               # --- จุดสำคัญคือบรรทัดนี้ ---
-                .options(
-                   joinedload(models.Shipment.warehouse),
-                   joinedload(models.Shipment.mshiptype),
-                   joinedload(models.Shipment.mleadtime),
-               )
+               .options(*load_profiles.SHIPMENT_LIST)
                .filter(models.Shipment.booking_round_id == None, models.Shipment.is_on_hold == False)
     )
 
     if filters.get("shippoint"):
         query = query.filter(models.Shipment.shippoint == filters["shippoint"])
     if filters.get("crdate"):
-        # แปลง string date เป็น date object ก่อนเทียบ
-        query = query.filter(func.date(models.Shipment.apmdate) == filters["crdate"]) 
+        # ช่วงครึ่งเปิด [วันนั้น 00:00, วันถัดไป 00:00) แทน func.date() เพื่อให้ใช้ Index ได้
+        day_start = datetime.combine(filters["crdate"], time.min)
+        query = query.filter(models.Shipment.apmdate >= day_start, models.Shipment.apmdate < day_start + timedelta(days=1))
         
     return query.order_by(models.Shipment.shipid).all()
 def get_held_shipments(db: Session, filters: dict) -> List[models.Shipment]:
@@ -205,12 +428,7 @@ def get_held_shipments(db: Session, filters: dict) -> List[models.Shipment]:
     ดึงรายการ Shipments ที่ถูก Hold ไว้
     """
     query = (db.query(models.Shipment)
-             .options(
-                 joinedload(models.Shipment.warehouse),
-                 joinedload(models.Shipment.mshiptype),
-                 joinedload(models.Shipment.mleadtime),
-                 selectinload(models.Shipment.details)
-             )
+             .options(*load_profiles.SHIPMENT_LIST)
              .filter(models.Shipment.is_on_hold == True))
     
     # Apply filters if provided
@@ -285,12 +503,187 @@ def update_user_fcm_token(db: Session, user: models.SystemUser, new_token: str)
         db.commit()
         db.refresh(user)
     return user
-def get_shipment_for_update(db: Session, shipid: str) -> Optional[models.Shipment]:
+def ensure_expected_version(shipment: models.Shipment, expected_version: Optional[int]):
+    """
+    Client ส่ง row_version ที่เห็นล่าสุดมาด้วย (ไม่บังคับ) ถ้าไม่ตรงกับในฐานข้อมูลแปลว่าตัดสินใจจากข้อมูลเก่า
+    raise StaleDataError เหมือนตอน commit ชนกัน (main.py ตอบ 409)
+    """
+    if expected_version is not None and shipment.row_version != expected_version:
+        raise StaleDataError(f"Shipment {shipment.shipid} is at row_version {shipment.row_version}, expected {expected_version}")
+def claim_shipment(
+    db: Session,
+    shipid: str,
+    vencode: str,
+    grade: str,
+    carlicense: str,
+    carnote: Optional[str],
+    username: str,
+    expected_version: Optional[int] = None
+) -> bool:
+    """
+    Vendor รับงาน (02 ของเกรดตัวเอง หรือ BC ที่ยังไม่มีใครรับ) ด้วย Conditional UPDATE คำสั่งเดียว
+    - เงื่อนไขการรับงานอยู่ใน WHERE: ถ้ามีคนรับไปก่อน docstat จะไม่ใช่ 02/BC แล้ว -> rowcount = 0
+    - คนที่แพ้ไม่ต้องอ่านแถวแบบ Lock และไม่ได้ขอเลข Change Sequence (ไม่แย่ง Lock แถว Counter)
+    - คนที่ชนะจึงค่อยขอ row_version ใหม่ในคำสั่งที่สอง
+    คืน True ถ้ารับงานได้ (ยังไม่ commit ผู้เรียกต้อง commit/rollback เอง)
+    """
+    conditions = [
+        models.Shipment.shipid == shipid,
+        or_(
+            and_(models.Shipment.docstat == '02', models.Shipment.current_grade_to_assign == grade),
+            models.Shipment.docstat == 'BC'
+        )
+    ]
+    if expected_version is not None:
+        conditions.append(models.Shipment.row_version == expected_version)
+
+    claimed = (db.query(models.Shipment)
+                 .filter(*conditions)
+                 .update({
+                     "docstat": '03', # Vendor ยืนยันแล้ว
+                     "vencode": vencode,
+                     "confirmed_by_grade": grade,
+                     "carlicense": carlicense,
+                     "carnote": carnote,
+                     "current_grade_to_assign": None,
+                     "assigned_at": None,
+                     "chuser": username,
+                     "chdate": datetime.now(timezone.utc),
+                 }, synchronize_session=False))
+    if claimed != 1:
+        return False
+    (db.query(models.Shipment)
+       .filter(models.Shipment.shipid == shipid)
+       .update({"row_version": versioning.next_change_version(db)}, synchronize_session=False))
+    return True
+def _car_busy_days(apmdate: datetime, leadtime) -> Tuple[date, date]:
+    """ช่วงวันที่รถถูกใช้ (รวมวันแรกและวันสุดท้าย) คำนวณแบบเดียวกับ assign_job_to_car"""
+    start = apmdate.date()
+    return start, max(start, start + timedelta(days=int(leadtime) - 1))
+
+def confirm_shipments_batch(
+    db: Session,
+    items: List[shipment_schemas.ConfirmShipment],
+    vencode: str,
+    grade: str,
+    username: str
+) -> Tuple[List[dict], List[Tuple[models.Shipment, dict]]]:
     """
-    ดึงข้อมูล Shipment พร้อมกับ Lock แถวข้อมูลนั้นใน Transaction
-    เพื่อป้องกัน Race Condition
+    Vendor รับหลายงานใน Transaction เดียว (POST /shipments/confirm-batch) ด้วย Query แบบชุด:
+    1. Lock Shipment ทั้งชุดด้วย SELECT ... FOR UPDATE คำสั่งเดียว (เรียงตาม shipid กัน Deadlock)
+       แล้ว Lock รถทั้งชุดแบบเดียวกัน (เรียงตาม carlicense) ก่อนอ่านงานที่รถรับไว้แล้ว (03, 04)
+       Request อื่นที่จองรถคันเดียวกันจึงต้องรอจน commit ไม่จองช่วงวันที่ซ้อนกันได้
+       จากนั้นโหลด Lead Time / จังหวัด / งานที่รถรับไว้แล้ว อย่างละหนึ่ง Query
+    2. ตรวจทีละรายการ: งานยังรับได้ (เงื่อนไขเดียวกับ claim_shipment), row_version,
+       รถมีอยู่จริง, ข้อมูลครบสำหรับคำนวณวันว่าง และรถไม่ถูกจองซ้อนช่วงวันที่ (ทั้งกับงานเดิมและงานในชุดเดียวกัน)
+    3. UPDATE Shipment ที่ผ่านทั้งหมด และ UPDATE รถทั้งหมดอย่างละคำสั่งเดียว (ค่าต่อแถวด้วย CASE) แล้ว commit
+    รายการที่ไม่ผ่านไม่ทำให้ทั้งชุดล้มเหลว คืน (ผลรายรายการตามลำดับที่ส่งมา, [(Shipment หลัง commit, snapshot ก่อนแก้)])
     """
-    return db.query(models.Shipment).filter(models.Shipment.shipid == shipid).with_for_update().first()
+    shipids = list(dict.fromkeys(item.shipid for item in items))
+    shipments = {
+        shipment.shipid: shipment
+        for shipment in (db.query(models.Shipment)
+                           .options(*load_profiles.SHIPMENT_WRITE)
+                           .filter(models.Shipment.shipid.in_(shipids))
+                           .order_by(models.Shipment.shipid)
+                           .with_for_update()
+                           .all())
+    }
+    carlicenses = {item.carlicense for item in items}
+    cars = {
+        car.carlicense: car
+        for car in (db.query(models.MCar)
+                      .filter(models.MCar.carlicense.in_(carlicenses))
+                      .order_by(models.MCar.carlicense)
+                      .with_for_update()
+                      .all())
+    }
+    routes = {shipment.route for shipment in shipments.values() if shipment.route}
+    leadtimes = dict(db.query(models.MLeadTime.route, models.MLeadTime.leadtime).filter(models.MLeadTime.route.in_(routes)))
+    province_ids = {shipment.province for shipment in shipments.values() if shipment.province is not None}
+    provinces = {province for (province,) in db.query(models.MProvince.province).filter(models.MProvince.province.in_(province_ids))}
+
+    # ช่วงวันที่ของแต่ละงานในชุดที่คำนวณได้ ใช้จำกัดช่วงของงานเดิมที่ต้องโหลดมาเทียบ
+    spans = [_car_busy_days(shipment.apmdate, leadtimes[shipment.route]) for shipment in shipments.values()
+             if shipment.apmdate and leadtimes.get(shipment.route)]
+    busy = defaultdict(list) # carlicense -> [(วันแรก, วันสุดท้าย)]
+    if spans and cars:
+        longest = db.query(func.max(models.MLeadTime.leadtime)).scalar() or 1
+        window_start = datetime.combine(min(start for start, _ in spans) - timedelta(days=int(longest)), time.min)
+        window_end = datetime.combine(max(end for _, end in spans) + timedelta(days=1), time.min)
+        booked = (db.query(models.Shipment.carlicense, models.Shipment.apmdate, models.MLeadTime.leadtime)
+                    .join(models.MLeadTime, models.Shipment.route == models.MLeadTime.route)
+                    .filter(models.Shipment.carlicense.in_(list(cars)),
+                            models.Shipment.docstat.in_(('03', '04')),
+                            models.Shipment.apmdate >= window_start,
+                            models.Shipment.apmdate < window_end))
+        for carlicense, apmdate, leadtime in booked:
+            busy[carlicense].append(_car_busy_days(apmdate, leadtime))
+
+    results, accepted, seen = [], [], set()
+    for item in items:
+        shipment = shipments.get(item.shipid)
+        status, detail = "confirmed", None
+        if item.shipid in seen:
+            status, detail = "duplicate", "Shipment appears more than once in this batch."
+        elif shipment is None:
+            status, detail = "not_found", "Shipment not found."
+        elif not ((shipment.docstat == '02' and shipment.current_grade_to_assign == grade) or shipment.docstat == 'BC'):
+            status, detail = "not_available", "Job is no longer available or not assigned to you."
+        elif item.row_version is not None and shipment.row_version != item.row_version:
+            status, detail = "stale", f"Shipment is at row_version {shipment.row_version}, expected {item.row_version}."
+        elif item.carlicense not in cars:
+            status, detail = "car_not_found", f"Car with license {item.carlicense} not found."
+        elif not (shipment.apmdate and shipment.province in provinces and leadtimes.get(shipment.route)):
+            status, detail = "missing_data", "Shipment is missing required data for availability calculation."
+        else:
+            start, end = _car_busy_days(shipment.apmdate, leadtimes[shipment.route])
+            if any(start <= other_end and other_start <= end for other_start, other_end in busy[item.carlicense]):
+                status, detail = "car_conflict", f"Car {item.carlicense} is already booked between {start.isoformat()} and {end.isoformat()}."
+            else:
+                busy[item.carlicense].append((start, end))
+                accepted.append((item, shipment, end))
+        seen.add(item.shipid)
+        results.append({"shipid": item.shipid, "status": status, "detail": detail, "row_version": None})
+
+    if not accepted:
+        db.rollback()
+        return results, []
+
+    before = {shipment.shipid: realtime.snapshot(shipment) for _, shipment, _ in accepted}
+    accepted_ids = list(before)
+    available_at = {}
+    for item, _, end in accepted:
+        available_at[item.carlicense] = max(end, available_at.get(item.carlicense, end))
+    (db.query(models.Shipment)
+       .filter(models.Shipment.shipid.in_(accepted_ids))
+       .update({
+           "docstat": '03', # Vendor ยืนยันแล้ว
+           "vencode": vencode,
+           "confirmed_by_grade": grade,
+           "carlicense": case({item.shipid: item.carlicense for item, _, _ in accepted}, value=models.Shipment.shipid),
+           "carnote": case({item.shipid: item.carnote for item, _, _ in accepted}, value=models.Shipment.shipid),
+           "current_grade_to_assign": None,
+           "assigned_at": None,
+           "chuser": username,
+           "chdate": datetime.now(timezone.utc),
+           "row_version": versioning.next_change_version(db),
+       }, synchronize_session=False))
+    (db.query(models.MCar)
+       .filter(models.MCar.carlicense.in_(list(available_at)))
+       .update({
+           "stat": models.StandardStatEnum.inactive, # เปลี่ยนสถานะเป็น "ไม่ใช้งาน" เหมือน assign_job_to_car
+           "will_be_available_at": case(available_at, value=models.MCar.carlicense),
+       }, synchronize_session=False))
+    db.commit()
+
+    confirmed = db.query(models.Shipment).options(*load_profiles.SHIPMENT_WRITE).filter(models.Shipment.shipid.in_(accepted_ids)).all()
+    versions = {shipment.shipid: shipment.row_version for shipment in confirmed}
+    for result in results:
+        if result["status"] == "confirmed":
+            result["row_version"] = versions.get(result["shipid"])
+    print(f"INFO: Vendor {vencode} confirmed {len(confirmed)} of {len(items)} shipments in one batch.")
+    return results, [(shipment, before[shipment.shipid]) for shipment in confirmed]
 # แทนที่ฟังก์ชันเดิมใน app/db/crud.py ด้วยอันนี้
 # เพิ่มฟังก์ชันนี้ใน app/db/crud.py
 
@@ -313,31 +706,36 @@ def assign_all_ready_shipments_to_round(db: Session, round_id: int, crdate: date
             models.Shipment.booking_round_id.is_(None),
             models.Shipment.is_on_hold == False,
             models.Shipment.shippoint == shippoint,
-            # --- ใช้ func.date() เพื่อเปรียบเทียบเฉพาะส่วนวันที่ของ crdate ---
-            func.date(models.Shipment.crdate) == crdate 
+            # --- เทียบเฉพาะส่วนวันที่ของ crdate ด้วยช่วงครึ่งเปิด (ใช้ Index shippoint + crdate ได้) ---
+            models.Shipment.crdate >= datetime.combine(crdate, time.min),
+            models.Shipment.crdate < datetime.combine(crdate, time.min) + timedelta(days=1)
         )
         .all()
     )
 
     if not shipments_to_assign:
         print(f"INFO: No unassigned shipments found for crdate={crdate} at shippoint={shippoint} to assign to round {round_id}.")
-        return booking_round
+        return get_booking_round_by_id(db, round_id)
     
     shipment_ids_to_update = [s.shipid for s in shipments_to_assign]
 
     # 3. ทำการ Update Shipments ทั้งหมดใน List ให้มี booking_round_id ที่ถูกต้อง
     (db.query(models.Shipment)
        .filter(models.Shipment.shipid.in_(shipment_ids_to_update))
-       .update({"booking_round_id": round_id, "docstat": '01'}, synchronize_session=False)) # '01' = รอจัดสรร
+       .update({"booking_round_id": round_id, "docstat": '01', "row_version": versioning.next_change_version(db)}, synchronize_session=False)) # '01' = รอจัดสรร
 
     # 4. (Optional) Unhold งานที่เหลือ
     # ถ้าต้องการให้งานที่เคย Hold ไว้ กลับมาพร้อมสำหรับรอบหน้า ก็ใส่ Logic นี้
+    unheld_ids = [shipid for (shipid,) in db.query(models.Shipment.shipid).filter(models.Shipment.is_on_hold == True, models.Shipment.shippoint == shippoint)]
     (db.query(models.Shipment)
        .filter(models.Shipment.is_on_hold == True, models.Shipment.shippoint == shippoint)
-       .update({"is_on_hold": False, "docstat": models.Shipment.docstat_before_hold}, synchronize_session=False))
+       .update({"is_on_hold": False, "docstat": models.Shipment.docstat_before_hold, "row_version": versioning.next_change_version(db)}, synchronize_session=False))
 
     db.commit()
-    db.refresh(booking_round) # Refresh เพื่อให้ booking_round.shipments มีข้อมูลล่าสุด
+    booking_round = get_booking_round_by_id(db, round_id) # โหลดใหม่เพื่อให้ booking_round.shipments มีข้อมูลล่าสุด
+    realtime.publish_bulk_change("round_assigned", shipids=shipment_ids_to_update + unheld_ids, round_id=round_id)
+    event_log.append(event_log.bulk_rows("round_assigned", shipment_ids_to_update, docstat_to='01', booking_round_id=round_id))
+    event_log.append(event_log.bulk_rows("unheld", unheld_ids))
     
     return booking_round
 def allocate_shipments_in_round(db: Session, round_id: int):
@@ -346,7 +744,7 @@ def allocate_shipments_in_round(db: Session, round_id: int):
     แล้วจึงพิจารณาโควต้าของแต่ละเกรด
     """
     # 1. ดึงข้อมูลรอบและ Shipments (เหมือนเดิม)
-    booking_round = db.query(models.BookingRound).filter(models.BookingRound.id == round_id).first()
+    booking_round = db.query(models.BookingRound).options(*load_profiles.ROUND_WRITE).filter(models.BookingRound.id == round_id).first()
     if not booking_round:
         raise ValueError(f"Booking round {round_id} not found.")
 
@@ -387,8 +785,12 @@ def allocate_shipments_in_round(db: Session, round_id: int):
 
     # 4. *** [หัวใจของ Logic ใหม่] *** วนลูปตาม Shipment แต่ละชิ้น
     unassigned_shipments = []
+    realtime_events = [] # สร้าง Event ก่อน commit แล้วส่งหลัง commit สำเร็จ
+    event_rows = []
+    notifications = []
 
     for shipment in shipments_to_allocate:
+        before = realtime.snapshot(shipment)
         # 4.1 ค้นหา "ผู้สมัคร" (Candidate Vendors) ทั้งหมดสำหรับ Shipment นี้
         candidate_vendors = []
         for v_data in vendor_data_map.values():
@@ -442,20 +844,17 @@ def allocate_shipments_in_round(db: Session, round_id: int):
 
             vendor_user = get_user_by_vendor_code(db, target_vendor.vencode)
             if vendor_user and vendor_user.fcm_token:
-                try:
-                    firebase_service.send_fcm_notification(
-                        token=vendor_user.fcm_token,
-                        title="มีงานใหม่สำหรับคุณ!",
-                        body=f"Shipment ID: {shipment.shipid} รอการยืนยัน",
-                        data={
-                            "shipment_id": str(shipment.shipid),
-                            "round_id": str(round_id),
-                            "type": "new_assignment"
-                        }
-                    )
-                except Exception as e:
-                    print(f"WARNING: Failed to send notification to vendor {target_vendor.vencode}: {e}")
-                    # Continue with allocation even if notification fails
+                # เข้าคิวหลัง commit เท่านั้น: ถ้า Transaction ถูก Rollback/Retry (Deadlock) จะไม่ส่งซ้ำหรือส่งงานที่ไม่ได้บันทึก
+                notifications.append((target_vendor.vencode, dict(
+                    token=vendor_user.fcm_token,
+                    title="มีงานใหม่สำหรับคุณ!",
+                    body=f"Shipment ID: {shipment.shipid} รอการยืนยัน",
+                    data={
+                        "shipment_id": str(shipment.shipid),
+                        "round_id": str(round_id),
+                        "type": "new_assignment"
+                    }
+                )))
         else:
             # ไม่มี Vendor คนไหนใน List ที่โควต้าว่างเลย
             print(f"WARNING: All suitable vendors have full quota for shipment {shipment.shipid}. Moving to hold.")
@@ -465,10 +864,21 @@ def allocate_shipments_in_round(db: Session, round_id: int):
             shipment.chuser = "SYSTEM_ALLOCATOR"
             shipment.chdate = datetime.now(timezone.utc)
             unassigned_shipments.append(shipment)
+        realtime_events.append(realtime.shipment_event(shipment, before))
+        event_rows.append(event_log.build_row("offered" if target_vendor else "allocation_held", shipment, before))
 
     # 6. Commit การเปลี่ยนแปลงทั้งหมด
     try:
         db.commit()
+        for event in realtime_events:
+            realtime.publish(event)
+        event_log.append(event_rows)
+        for vencode, notification in notifications:
+            try:
+                firebase_service.queue_fcm_notification(**notification)
+            except Exception as e:
+                print(f"WARNING: Failed to send notification to vendor {vencode}: {e}")
+                # Continue with allocation even if notification fails
         print(f"SUCCESS: Allocation for round {round_id} completed successfully.")
         print(f"Allocation summary: {dict(allocated_counts)}")
         if unassigned_shipments:
@@ -477,18 +887,17 @@ def allocate_shipments_in_round(db: Session, round_id: int):
         db.rollback()
         print(f"CRITICAL: Failed to commit allocation for round {round_id}. Error: {e}")
         raise e
-def get_all_vendor_profiles(db: Session) -> List[models.MVendor]:
+def get_all_vendor_profiles(db: Session, cursor: Optional[str] = None, limit: Optional[int] = None) -> pagination.Page:
     """
-    ดึงข้อมูลโปรไฟล์ของ Vendor ทั้งหมด (สำหรับ Admin/Dispatcher)
+    ดึงข้อมูลโปรไฟล์ของ Vendor ทั้งหมด (สำหรับ Admin/Dispatcher) ทีละหน้า
     พร้อมกับ Eager Load ข้อมูลรถของแต่ละ Vendor มาด้วย
     """
-    return (db.query(models.MVendor)
+    query = (db.query(models.MVendor)
               .options(
                   selectinload(models.MVendor.cars),
                   selectinload(models.MVendor.user_account)
-              )
-              .order_by(models.MVendor.grade, models.MVendor.venname) # เรียงตามเกรด และตามชื่อ
-              .all())
+              ))
+    return _paginate(query, VENDOR_KEYS, cursor, limit) # เรียงตามเกรด และตามชื่อ
 def get_all_vendors(db: Session) -> List[models.SystemUser]:
     """ดึง user ที่มี role เป็น vendor ทั้งหมด"""
     return db.query(models.SystemUser).filter(models.SystemUser.role == models.UserRoleEnum.vendor, models.SystemUser.is_active == True).all()
@@ -500,20 +909,20 @@ def get_users_by_grade(db: Session, grade: str) -> List[models.SystemUser]:
               .join(models.MVendor, models.SystemUser.vencode_ref == models.MVendor.vencode)
               .filter(models.MVendor.grade == grade, models.SystemUser.is_active == True)
               .all())
-def get_rounds_pending_confirmation(db: Session) -> List[models.BookingRound]:
+def get_rounds_pending_confirmation(db: Session, cursor: Optional[str] = None, limit: Optional[int] = None,
+                                    fieldset: Optional[frozenset] = None) -> pagination.Page:
     """
     ดึงข้อมูลรอบทั้งหมดที่มี Shipment อย่างน้อยหนึ่งรายการ
     อยู่ในสถานะรอการยืนยันจาก Dispatcher (docstat = '03')
     """
-    return (
+    query = (
         db.query(models.BookingRound)
         .join(models.Shipment) # Join กับ Shipment
         .filter(models.Shipment.docstat == '03') # กรองเฉพาะที่มี Shipment สถานะ '03'
-        .options(selectinload(models.BookingRound.shipments)) # โหลด Shipments มาด้วย
+        .options(*load_profiles.round_list(fieldset)) # โหลด Shipments มาด้วย (ยกเว้น Sparse Fieldset ที่ไม่ได้ include=shipments)
         .distinct() # ป้องกันการได้รอบซ้ำ
-        .order_by(models.BookingRound.round_date, models.BookingRound.round_time)
-        .all()
     )
+    return _paginate(query, ROUND_DATE_KEYS, cursor, limit)
 
 
 def confirm_all_shipments_in_round(db: Session, round_id: int, current_user_id: str) -> models.BookingRound:
@@ -523,17 +932,20 @@ def confirm_all_shipments_in_round(db: Session, round_id: int, current_user_id:
     - เรียกใช้ Logic การอัปเดตสถานะรถสำหรับแต่ละ Shipment
     """
     # ใช้ with_for_update() เพื่อ Lock ทั้งรอบและ Shipments ที่เกี่ยวข้อง
-    booking_round = db.query(models.BookingRound).filter(models.BookingRound.id == round_id).with_for_update().first()
+    booking_round = db.query(models.BookingRound).options(*load_profiles.ROUND_WRITE).filter(models.BookingRound.id == round_id).with_for_update().first()
     if not booking_round:
         raise ValueError(f"Booking round with ID {round_id} not found.")
 
     shipments_to_confirm = [s for s in booking_round.shipments if s.docstat == '03']
     if not shipments_to_confirm:
         print(f"INFO: No shipments in round {round_id} are pending confirmation.")
-        return booking_round # ไม่มีอะไรให้ทำ
+        return get_booking_round_by_id(db, round_id) # ไม่มีอะไรให้ทำ
     
     updated_cars = []
+    realtime_events = []
+    event_rows = []
     for shipment in shipments_to_confirm:
+        before = realtime.snapshot(shipment)
         # --- เรียกใช้ฟังก์ชันที่เรามีอยู่แล้ว ---
         updated_car = assign_job_to_car(db, shipment=shipment)
         if not updated_car:
@@ -546,17 +958,22 @@ def confirm_all_shipments_in_round(db: Session, round_id: int, current_user_id:
         shipment.docstat = '04' # Dispatcher Assigned
         shipment.chuser = current_user_id
         shipment.chdate = datetime.now(timezone.utc)
+        realtime_events.append(realtime.shipment_event(shipment, before))
+        event_rows.append(event_log.build_row("dispatcher_confirmed", shipment, before))
     
     # Commit transaction ทีเดียว
     db.commit()
-    db.refresh(booking_round)
+    booking_round = get_booking_round_by_id(db, round_id)
+    for event in realtime_events:
+        realtime.publish(event)
+    event_log.append(event_rows)
     
     # ส่ง Notification กลับไปหา Vendor ว่างานถูกยืนยันแล้ว
     for shipment in shipments_to_confirm:
         vendor_user = get_user_by_vencode(db, shipment.vencode)
         if vendor_user and vendor_user.fcm_token:
             try:
-                firebase_service.send_fcm_notification(
+                firebase_service.queue_fcm_notification(
                     token=vendor_user.fcm_token,
                     title="งานของคุณได้รับการยืนยันแล้ว!",
                     body=f"Shipment ID: {shipment.shipid} ถูกยืนยันโดย Dispatcher",
@@ -579,7 +996,7 @@ def get_ongoing_shipments(db: Session, vencode: Optional[str] = None) -> List[mo
     in_progress_statuses = ['03', '04']
     
     query = (db.query(models.Shipment)
-               .options(selectinload(models.Shipment.details))
+               .options(*load_profiles.SHIPMENT_LIST)
                .filter(models.Shipment.docstat.in_(in_progress_statuses)))
     
     # เพิ่มเงื่อนไขการกรอง vencode ถ้ามีการส่งค่าเข้ามา
@@ -602,7 +1019,7 @@ def get_past_shipments(db: Session, vencode: Optional[str] = None, filters: dict
     final_statuses = ['06', 'RJ', '05'] 
     
     query = (db.query(models.Shipment)
-               .options(selectinload(models.Shipment.details)) # Eager load details
+               .options(*load_profiles.SHIPMENT_LIST)
                .filter(models.Shipment.docstat.in_(final_statuses)))
     
     # --- Logic เดิม ---
@@ -627,6 +1044,40 @@ def get_past_shipments(db: Session, vencode: Optional[str] = None, filters: dict
         query = query.filter(models.Shipment.apmdate < end_date)
 
     return query.order_by(models.Shipment.chdate.desc()).limit(200).all()
+# --- Shipment Event Log ---
+def get_shipment_timeline(db: Session, shipid: str) -> List[models.ShipmentEvent]:
+    """ประวัติทั้งหมดของ Shipment เดียว เรียงตามเวลา (ใช้ Index shipid + created_at)"""
+    return (db.query(models.ShipmentEvent)
+              .filter(models.ShipmentEvent.shipid == shipid)
+              .order_by(models.ShipmentEvent.created_at, models.ShipmentEvent.id)
+              .all())
+
+def get_shipment_events(db: Session, start: datetime, end: datetime, filters: dict = None, limit: int = 1000) -> List[models.ShipmentEvent]:
+    """
+    ดึง Events ในช่วงเวลา [start, end) สำหรับงาน Analytics/Audit (ใช้ Index created_at)
+    """
+    if filters is None:
+        filters = {}
+
+    query = (db.query(models.ShipmentEvent)
+               .filter(models.ShipmentEvent.created_at >= start, models.ShipmentEvent.created_at < end))
+
+    if filters.get("event_type"):
+        query = query.filter(models.ShipmentEvent.event_type == filters["event_type"])
+    if filters.get("vencode"):
+        query = query.filter(models.ShipmentEvent.vencode == filters["vencode"])
+
+    return query.order_by(models.ShipmentEvent.created_at, models.ShipmentEvent.id).limit(limit).all()
+
+# --- Idempotency Keys ---
+def delete_expired_idempotency_keys(db: Session) -> int:
+    """ลบ Idempotency-Key ที่หมดอายุแล้ว (เรียกจาก Worker)"""
+    deleted = (db.query(models.IdempotencyKey)
+                 .filter(models.IdempotencyKey.expires_at <= datetime.now(timezone.utc))
+                 .delete(synchronize_session=False))
+    db.commit()
+    return deleted
+
 def get_all_dispatchers(db: Session) -> List[models.SystemUser]:
     """
     ดึง Dispatchers และ Admins ทั้งหมด (เพื่อส่ง Notification)
@@ -688,11 +1139,13 @@ def save_day_rounds(db: Session, request: booking_round_schemas.SaveDayRoundsReq
 
     # 2. ลบรอบเก่าที่ไม่มีอยู่ใน Request ใหม่
     # (วิธีนี้ง่ายที่สุด คือลบทั้งหมดแล้วสร้างใหม่)
+    unassigned_ids = []
     for old_round in existing_rounds:
         # ก่อนลบ ต้อง un-assign shipments ก่อน
+        unassigned_ids += [shipid for (shipid,) in db.query(models.Shipment.shipid).filter(models.Shipment.booking_round_id == old_round.id)]
         (db.query(models.Shipment)
            .filter(models.Shipment.booking_round_id == old_round.id)
-           .update({"booking_round_id": None}, synchronize_session=False))
+           .update({"booking_round_id": None, "row_version": versioning.next_change_version(db)}, synchronize_session=False))
         db.delete(old_round)
     
     db.flush() # Execute delete commands
@@ -719,6 +1172,8 @@ def save_day_rounds(db: Session, request: booking_round_schemas.SaveDayRoundsReq
         new_rounds.append(db_round)
     
     db.commit()
+    realtime.publish_bulk_change("rounds_saved", shipids=unassigned_ids, actor=creator_id)
+    event_log.append(event_log.bulk_rows("round_removed", unassigned_ids, actor=creator_id))
     
     # ไม่จำเป็นต้อง refresh object เพราะเราจะ query ใหม่จาก frontend
     # แต่ถ้าต้องการคืนค่ากลับไป ก็ต้อง query ใหม่อีกครั้ง
@@ -1,18 +1,137 @@
 # app/db/database.py
-from sqlalchemy import create_engine
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import Request
+from jose import JWTError, jwt
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from ..core.config import settings # Import settings
+from . import pool_metrics
 
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+def create_pooled_engine(url: str, name: str, pool_size: int = None, max_overflow: int = None, is_async: bool = False):
+    """
+    สร้าง Engine ด้วยค่า Pool จาก Settings และผูกตัวนับ pool_metrics ไว้ในชื่อ name
+    pre_ping + recycle กัน Connection ที่ MySQL ตัดทิ้งไปแล้ว (wait_timeout) หลุดมาถึง Request
+    """
+    options = dict(
+        pool_size=settings.DB_POOL_SIZE if pool_size is None else pool_size,
+        max_overflow=settings.DB_MAX_OVERFLOW if max_overflow is None else max_overflow,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+    if is_async:
+        new_engine = create_async_engine(url, poolclass=pool_metrics.InstrumentedAsyncQueuePool, **options)
+        pool_metrics.instrument(new_engine.sync_engine, name)
+    else:
+        new_engine = create_engine(url, poolclass=pool_metrics.InstrumentedQueuePool, **options)
+        pool_metrics.instrument(new_engine, name)
+    return new_engine
+
+engine = create_pooled_engine(SQLALCHEMY_DATABASE_URL, "api")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Engine แบบ Async (aiomysql) สำหรับ Endpoint ที่เป็น async def
+# expire_on_commit=False: Object ที่ได้มายังอ่านค่าได้หลัง commit โดยไม่ต้อง Query ใหม่ (Lazy Load ใน Async ทำไม่ได้)
+async_engine = create_pooled_engine(settings.ASYNC_DATABASE_URL, "api-async", is_async=True)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# --- Read Replica ---
+# Endpoint ที่อ่านอย่างเดียว (รายการ/ประวัติ) ใช้ get_read_db / get_async_read_db แทน get_db / get_async_db
+# ถ้าไม่ได้ตั้ง DB_REPLICA_HOST จะชี้ไปที่ Primary (Engine เดียวกัน) จึงทำงานเหมือนเดิมทุกอย่าง
+class ReadOnlySession(Session):
+    """Session ของฝั่งอ่าน: ห้าม flush เพื่อกันไม่ให้มีการเขียนลง Replica โดยไม่ตั้งใจ"""
+
+@event.listens_for(ReadOnlySession, "before_flush")
+def _reject_flush(session, flush_context, instances):
+    if session.new or session.dirty or session.deleted:
+        raise RuntimeError("Read-only session cannot write; use get_db / get_async_db for write endpoints")
+
+replica_engine = create_pooled_engine(settings.DATABASE_REPLICA_URL, "replica") if settings.DATABASE_REPLICA_URL else engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine, class_=ReadOnlySession)
+
+async_replica_engine = (create_pooled_engine(settings.ASYNC_DATABASE_REPLICA_URL, "replica-async", is_async=True)
+                        if settings.ASYNC_DATABASE_REPLICA_URL else async_engine)
+AsyncReadSessionLocal = async_sessionmaker(bind=async_replica_engine, class_=AsyncSession, sync_session_class=ReadOnlySession,
+                                           autoflush=False, expire_on_commit=False)
+
+# Read-your-writes: หลังผู้ใช้เขียนข้อมูลสำเร็จ main.py จะส่ง Token อายุ REPLICA_STICKY_SECONDS กลับไป
+# ทั้งใน Cookie (Browser ส่งกลับเอง) และ Header X-Read-After (Client อื่นต้องส่งกลับเองใน Header เดียวกัน)
+# Request อ่านที่แนบ Token ของผู้ใช้คนเดียวกันมาจะไปที่ Primary ไม่เห็นข้อมูลเก่าจาก Replica ที่ยังตามไม่ทัน
+# สถานะอยู่ฝั่ง Client จึงใช้ได้ทุก Worker/Process โดยไม่ต้องมีที่เก็บกลาง
+# Token เซ็นด้วย SECRET_KEY และไม่มี claim "sub" จึงใช้แทน Access Token ไม่ได้
+READ_AFTER_HEADER = "X-Read-After"
+READ_AFTER_COOKIE = "read_after"
+
+def _bearer_username(authorization: Optional[str]) -> Optional[str]:
+    """username (sub) จาก Authorization: Bearer <JWT> ถ้าถอดไม่ได้คืน None (ไม่ใช่หน้าที่ของที่นี่ที่จะตอบ 401)"""
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        return jwt.decode(authorization[7:], settings.SECRET_KEY, algorithms=[settings.ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
+def recent_write_token(authorization: Optional[str]) -> Optional[str]:
+    """Token ที่ส่งกลับหลังเขียนสำเร็จ (None = ไม่ต้องส่ง: ไม่รู้ว่าเป็นผู้ใช้คนไหน หรือปิด Sticky ไว้)"""
+    username = _bearer_username(authorization)
+    if not username or settings.REPLICA_STICKY_SECONDS <= 0:
+        return None
+    expire = datetime.now(timezone.utc) + timedelta(seconds=settings.REPLICA_STICKY_SECONDS)
+    return jwt.encode({"read_after": username, "exp": expire}, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+
+def _is_sticky(request: Request) -> bool:
+    token = request.headers.get(READ_AFTER_HEADER) or request.cookies.get(READ_AFTER_COOKIE)
+    if not token:
+        return False
+    try:
+        username = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]).get("read_after") # หมดอายุ -> JWTError
+    except JWTError:
+        return False
+    return username is not None and username == _bearer_username(request.headers.get("authorization"))
+
+def read_session_factory(request: Request):
+    """เลือก Session Factory สำหรับ Request อ่าน: Replica ปกติ, Primary ถ้าผู้ใช้เพิ่งเขียน"""
+    return SessionLocal if _is_sticky(request) else ReadSessionLocal
+
+def async_read_session_factory(request: Request):
+    return AsyncSessionLocal if _is_sticky(request) else AsyncReadSessionLocal
+
+def use_worker_pool():
+    """
+    เรียกตอนเริ่ม run_worker.py: ให้ SessionLocal ของ Process นั้นใช้ Pool แยกขนาดเล็ก (WORKER_DB_*)
+    Engine ของ API ยังไม่เคยเปิด Connection (create_engine ไม่ต่อ DB จนกว่าจะใช้) จึงไม่เสียอะไร
+    """
+    global engine
+    engine = create_pooled_engine(SQLALCHEMY_DATABASE_URL, "worker",
+                                  pool_size=settings.WORKER_DB_POOL_SIZE, max_overflow=settings.WORKER_DB_MAX_OVERFLOW)
+    SessionLocal.configure(bind=engine)
+    return engine
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_read_db(request: Request):
+    db = read_session_factory(request)()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db(request: Request):
+    async with async_read_session_factory(request)() as db:
+        yield db
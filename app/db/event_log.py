@@ -0,0 +1,125 @@
+# app/db/event_log.py
+# เขียนประวัติ Shipment (ตาราง shipment_events) แบบ Buffer
+# - จุดที่เปลี่ยนสถานะเรียก record()/append() หลัง commit สำเร็จ (จะได้ไม่บันทึกสิ่งที่ถูก Rollback)
+# - แถวจะถูกพักไว้ในหน่วยความจำ แล้ว Flush เป็น Multi-row INSERT เดียว
+#   เมื่อครบ EVENT_LOG_FLUSH_SIZE แถว หรือทุก EVENT_LOG_FLUSH_INTERVAL_SECONDS วินาที
+import threading
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+
+from ..core.config import settings
+from . import database, models
+
+# กันหน่วยความจำโตไม่สิ้นสุดถ้า DB ล่มนาน ๆ (แถวเก่าสุดจะถูกทิ้ง)
+MAX_BUFFERED_ROWS = 50000
+
+def build_row(event_type: str, shipment, before: Optional[dict] = None, actor: Optional[str] = None, **detail) -> dict:
+    """
+    สร้างแถว Event จาก Shipment (เรียกก่อน commit ได้ ค่าจะถูกเก็บเป็น dict ทันที)
+    before: ผลจาก realtime.snapshot() ก่อนแก้ไข (ใช้หา docstat_from)
+    """
+    return {
+        "shipid": shipment.shipid,
+        "event_type": event_type,
+        "docstat_from": before.get("docstat") if before else None,
+        "docstat_to": shipment.docstat,
+        "vencode": detail.pop("vencode", None) or shipment.vencode,
+        "grade": detail.pop("grade", None) or shipment.current_grade_to_assign or shipment.confirmed_by_grade,
+        "booking_round_id": shipment.booking_round_id,
+        "actor": actor or shipment.chuser,
+        "detail": detail or None,
+        "created_at": datetime.now(timezone.utc),
+    }
+
+def bulk_rows(event_type: str, shipids: List[str], actor: Optional[str] = None, docstat_to: Optional[str] = None,
+              booking_round_id: Optional[int] = None, **detail) -> List[dict]:
+    """แถว Event สำหรับ Bulk UPDATE ที่รู้แค่ shipid"""
+    now = datetime.now(timezone.utc)
+    return [{
+        "shipid": shipid,
+        "event_type": event_type,
+        "docstat_from": None,
+        "docstat_to": docstat_to,
+        "vencode": None,
+        "grade": None,
+        "booking_round_id": booking_round_id,
+        "actor": actor,
+        "detail": detail or None,
+        "created_at": now,
+    } for shipid in shipids]
+
+class ShipmentEventBuffer:
+    def __init__(self, flush_size: int, flush_interval: float):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._rows: List[dict] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="shipment-event-log", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def append(self, rows):
+        if isinstance(rows, dict):
+            rows = [rows]
+        if not rows:
+            return
+        with self._lock:
+            self._rows.extend(rows)
+            if len(self._rows) > MAX_BUFFERED_ROWS:
+                dropped = len(self._rows) - MAX_BUFFERED_ROWS
+                del self._rows[:dropped]
+                print(f"WARNING: Shipment event buffer full, dropped {dropped} oldest events.")
+            should_flush = len(self._rows) >= self.flush_size
+            self._ensure_thread()
+        if should_flush:
+            self._wakeup.set()
+
+    def flush(self):
+        """เขียนแถวที่ค้างอยู่ทั้งหมดด้วย INSERT เดียว (Driver จะรวมเป็น Multi-row VALUES)"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return
+            db = database.SessionLocal()
+            try:
+                # ใช้ Core Table (ไม่ใช่ ORM Bulk Insert) เพื่อให้ได้ executemany ก้อนเดียวเสมอ
+                db.execute(insert(models.ShipmentEvent.__table__), rows)
+                db.commit()
+            except OperationalError as e:
+                db.rollback()
+                print(f"ERROR: Failed to flush {len(rows)} shipment events, will retry: {e}")
+                with self._lock:
+                    # DB ใช้งานไม่ได้ชั่วคราว: ใส่กลับไว้หน้าคิว แล้วลองใหม่รอบถัดไป
+                    self._rows[:0] = rows[-MAX_BUFFERED_ROWS:]
+            except Exception as e:
+                db.rollback()
+                print(f"ERROR: Dropped {len(rows)} shipment events that could not be written: {e}")
+            finally:
+                db.close()
+
+buffer = ShipmentEventBuffer(settings.EVENT_LOG_FLUSH_SIZE, settings.EVENT_LOG_FLUSH_INTERVAL_SECONDS)
+
+def append(rows):
+    buffer.append(rows)
+
+def record(event_type: str, shipment, before: Optional[dict] = None, actor: Optional[str] = None, **detail):
+    """บันทึก Event ของ Shipment หนึ่งรายการ (เรียกหลัง commit)"""
+    buffer.append(build_row(event_type, shipment, before=before, actor=actor, **detail))
+
+def flush():
+    buffer.flush()
@@ -0,0 +1,74 @@
+# app/db/load_profiles.py
+# ชุด Loader Options ของ Shipment แยกตามการใช้งาน
+# Relationship ของ Shipment ตั้งเป็น lazy="raise" ไว้ (ดู models.py) ทุก Query ต้องเลือก Profile เอง
+# ถ้าลืมโหลดแล้ว Schema ไปแตะ Relationship จะได้ Error ทันที แทนที่จะเกิด N+1 แบบเงียบ ๆ
+#
+#   SHIPMENT_LIST   - รายการหลายแถว: ทุกอย่างที่ shipment_schemas.Shipment ใช้ (details แยก Query แบบ selectin)
+#                     (Endpoint รายการ Shipment ของ async_crud ใช้ Projection ใน projections.py แทน)
+#   SHIPMENT_DETAIL - แถวเดียว: เหมือน LIST แต่ JOIN details มาใน Query เดียว
+#   SHIPMENT_RELOAD - แถวเดียวหลังเขียน (crud.reload_shipment): DETAIL + rejections สำหรับ realtime ก่อนตอบกลับ
+#   SHIPMENT_WRITE  - Action ที่แก้สถานะ: โหลดเฉพาะ rejections (ใช้ทำ realtime snapshot) ไม่ JOIN ตาราง Master
+#   SHIPMENT_WORKER - Worker/Batch: เหมือน WRITE
+#   ROUND_DETAIL    - BookingRound ที่ตอบกลับพร้อม shipments (แต่ละ Shipment ใช้ SHIPMENT_LIST)
+#   ROUND_WRITE     - BookingRound ที่จะแก้ shipments ภายใน (แต่ละ Shipment ใช้ SHIPMENT_WRITE)
+#   round_list()    - รายการ BookingRound ตาม Sparse Fieldset (?fields=&include=shipments) ไม่ขอ = ROUND_DETAIL
+from typing import Optional
+
+from sqlalchemy.orm import joinedload, load_only, selectinload
+
+from . import models
+
+def _vendor():
+    # Schema ใช้แค่ vencode/venname/grade ไม่ต้องพา MVendor.cars (lazy="joined") มาด้วย
+    return joinedload(models.Shipment.mvendor).raiseload("*")
+
+SHIPMENT_LIST = (
+    joinedload(models.Shipment.mshiptype),
+    joinedload(models.Shipment.mprovince),
+    joinedload(models.Shipment.mleadtime),
+    _vendor(),
+    selectinload(models.Shipment.details),
+)
+
+SHIPMENT_DETAIL = (
+    joinedload(models.Shipment.mshiptype),
+    joinedload(models.Shipment.mprovince),
+    joinedload(models.Shipment.mleadtime),
+    _vendor(),
+    joinedload(models.Shipment.details),
+)
+
+SHIPMENT_RELOAD = SHIPMENT_DETAIL + (
+    selectinload(models.Shipment.rejections),
+)
+
+SHIPMENT_WRITE = (
+    selectinload(models.Shipment.rejections),
+)
+
+SHIPMENT_WORKER = SHIPMENT_WRITE
+
+ROUND_DETAIL = (
+    selectinload(models.BookingRound.shipments).options(*SHIPMENT_LIST),
+)
+
+ROUND_WRITE = (
+    selectinload(models.BookingRound.shipments).options(*SHIPMENT_WRITE),
+)
+
+# คอลัมน์ที่ต้องโหลดเสมอ: Primary Key และคีย์ของ Keyset ใน crud (ROUND_TIME_KEYS / ROUND_DATE_KEYS)
+ROUND_ALWAYS_LOADED = ("id", "round_date", "round_time")
+
+def round_list(fieldset: Optional[frozenset] = None) -> tuple:
+    """
+    Options ของรายการ BookingRound: โหลดเฉพาะคอลัมน์ที่ขอ (load_only)
+    และโหลด shipments (ส่วนที่หนักที่สุด) เฉพาะเมื่อ include=shipments
+    """
+    if fieldset is None:
+        return ROUND_DETAIL
+    columns = [getattr(models.BookingRound, column.key) for column in models.BookingRound.__table__.columns
+               if column.key in fieldset or column.key in ROUND_ALWAYS_LOADED]
+    options = (load_only(*columns),)
+    if "shipments" in fieldset:
+        options += ROUND_DETAIL
+    return options
@@ -0,0 +1,133 @@
+# app/db/migrations.py
+# Schema Migrations แบบมีเลข Version (MySQL)
+# - แต่ละรายการคือ (version, คำอธิบาย, [คำสั่ง SQL])
+# - Version ที่รันแล้วจะถูกบันทึกในตาราง schema_migrations และจะไม่ถูกรันซ้ำ
+# - เพิ่ม Migration ใหม่ต่อท้ายเสมอ ห้ามแก้ไขรายการที่ถูกรันไปแล้ว
+# รันด้วย: python run_migrations.py
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+MIGRATIONS = [
+    (1, "shipment.row_version + shipment_change_seq (delta-sync)", [
+        "ALTER TABLE shipment ADD COLUMN row_version BIGINT NOT NULL DEFAULT 0",
+        "CREATE INDEX ix_shipment_row_version ON shipment (row_version)",
+        """CREATE TABLE shipment_change_seq (
+            id INT NOT NULL PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        )""",
+        "INSERT INTO shipment_change_seq (id, version) VALUES (1, 0)",
+    ]),
+    (2, "shipment_events append-only log", [
+        """CREATE TABLE shipment_events (
+            id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            shipid VARCHAR(10) NOT NULL,
+            event_type VARCHAR(30) NOT NULL,
+            docstat_from VARCHAR(2) NULL,
+            docstat_to VARCHAR(2) NULL,
+            vencode VARCHAR(10) NULL,
+            grade VARCHAR(1) NULL,
+            booking_round_id INT NULL,
+            actor VARCHAR(100) NULL,
+            detail JSON NULL,
+            created_at DATETIME NOT NULL,
+            INDEX ix_shipment_events_created_at (created_at),
+            INDEX ix_shipment_events_shipid_created_at (shipid, created_at)
+        )""",
+    ]),
+    (3, "idempotency_keys for shipment actions", [
+        """CREATE TABLE idempotency_keys (
+            username VARCHAR(100) NOT NULL,
+            idempotency_key VARCHAR(100) NOT NULL,
+            endpoint VARCHAR(50) NOT NULL,
+            fingerprint VARCHAR(64) NOT NULL,
+            status_code INT NULL,
+            response_body JSON NULL,
+            created_at DATETIME NOT NULL,
+            expires_at DATETIME NOT NULL,
+            PRIMARY KEY (username, idempotency_key),
+            INDEX ix_idempotency_keys_expires_at (expires_at)
+        )""",
+    ]),
+    (4, "composite indexes for hot shipment queries", [
+        "CREATE INDEX ix_shipment_docstat_assigned_at ON shipment (docstat, assigned_at)",
+        "CREATE INDEX ix_shipment_unassigned ON shipment (booking_round_id, is_on_hold, shippoint, apmdate)",
+        "CREATE INDEX ix_shipment_shippoint_crdate ON shipment (shippoint, crdate)",
+        "CREATE INDEX ix_shipment_vencode_docstat ON shipment (vencode, docstat, apmdate)",
+        "CREATE INDEX ix_shipment_docstat_chdate ON shipment (docstat, chdate)",
+        "CREATE INDEX ix_shipment_apmdate ON shipment (apmdate)",
+    ]),
+    (5, "shipment_rejection table (replaces shipment.rejected_by_vencodes JSON)", [
+        """CREATE TABLE shipment_rejection (
+            shipid VARCHAR(10) NOT NULL,
+            vencode VARCHAR(10) NOT NULL,
+            rejected_at DATETIME NOT NULL,
+            PRIMARY KEY (shipid, vencode),
+            INDEX ix_shipment_rejection_vencode (vencode, rejected_at),
+            CONSTRAINT fk_shipment_rejection_shipid FOREIGN KEY (shipid) REFERENCES shipment (shipid)
+        )""",
+        # ย้ายข้อมูลจาก JSON Array เดิม (ต้องใช้ MySQL 8+ สำหรับ JSON_TABLE)
+        # คอลัมน์ rejected_by_vencodes ยังเก็บไว้ก่อนเผื่อ Rollback แต่แอปไม่อ่าน/เขียนแล้ว
+        """INSERT IGNORE INTO shipment_rejection (shipid, vencode, rejected_at)
+        SELECT s.shipid, j.vencode, COALESCE(s.chdate, s.assigned_at, NOW())
+        FROM shipment s,
+             JSON_TABLE(s.rejected_by_vencodes, '$[*]' COLUMNS (vencode VARCHAR(10) PATH '$')) AS j
+        WHERE s.rejected_by_vencodes IS NOT NULL AND j.vencode IS NOT NULL""",
+    ]),
+    (6, "FULLTEXT ngram indexes for shipment search (shipid, customer_name, doid, cusname)", [
+        # Parser ngram ตัดทุก ngram_token_size ตัวอักษร (ค่าเริ่มต้น 2) ค้นภาษาไทยที่ไม่มีช่องว่างระหว่างคำ และค้น Substring ของรหัสได้
+        # ปิด Stopword ของ Session ก่อนสร้าง Index: ngram จะทิ้ง Token ที่มี Stopword (เช่น "a", "i") ทำให้ค้นรหัสอย่าง "A1" ไม่เจอ
+        # FULLTEXT Index แรกของตาราง InnoDB จะ Rebuild ทั้งตาราง (เพิ่ม FTS_DOC_ID) ควรรันนอกเวลาทำงาน
+        "SET SESSION innodb_ft_enable_stopword = OFF",
+        "CREATE FULLTEXT INDEX ft_shipment_search ON shipment (shipid, customer_name) WITH PARSER ngram",
+        "CREATE FULLTEXT INDEX ft_doh_search ON doh (doid, cusname) WITH PARSER ngram",
+    ]),
+    (7, "shipment_change_log (AUTO_INCREMENT change sequence, replaces shipment_change_seq)", [
+        """CREATE TABLE shipment_change_log (
+            version BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            allocated_at DATETIME(6) NOT NULL,
+            INDEX ix_shipment_change_log_allocated_at (allocated_at)
+        )""",
+        # ต่อเลขจากตัวนับเดิม (AUTO_INCREMENT จะเริ่มที่ค่าสูงสุด + 1) row_version ที่มีอยู่จึงยังน้อยกว่าเลขใหม่ทั้งหมด
+        # ตาราง shipment_change_seq เก็บไว้ก่อนเผื่อ Rollback แต่แอปไม่อ่าน/เขียนแล้ว
+        """INSERT INTO shipment_change_log (version, allocated_at)
+        SELECT version, UTC_TIMESTAMP(6) - INTERVAL 1 DAY FROM shipment_change_seq WHERE id = 1 AND version > 0""",
+    ]),
+    (8, "idempotency_keys.locked_until (lease for in-progress requests)", [
+        "ALTER TABLE idempotency_keys ADD COLUMN locked_until DATETIME NULL",
+    ]),
+]
+
+def _ensure_migrations_table(conn):
+    conn.execute(text(
+        """CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT NOT NULL PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )"""
+    ))
+
+def get_applied_versions(engine: Engine) -> set:
+    with engine.begin() as conn:
+        _ensure_migrations_table(conn)
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+def run_migrations(engine: Engine) -> list:
+    """รัน Migration ที่ยังไม่เคยรัน ตามลำดับ Version คืนรายการ Version ที่รันในครั้งนี้"""
+    applied = get_applied_versions(engine)
+    newly_applied = []
+    for version, description, statements in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied:
+            continue
+        print(f"INFO: Applying migration {version}: {description}")
+        # หมายเหตุ: DDL ของ MySQL commit อัตโนมัติ ถ้าล้มกลางทางต้องแก้ไขด้วยมือก่อนรันใหม่
+        with engine.begin() as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+                {"version": version, "description": description}
+            )
+        newly_applied.append(version)
+    if not newly_applied:
+        print("INFO: Database schema is up to date.")
+    return newly_applied
@@ -3,7 +3,7 @@
 from datetime import date, datetime
 from typing import List
 from sqlalchemy import (
-    JSON, Boolean, Column, ForeignKey, Integer, String, DateTime, Date, Time,
+    JSON, BigInteger, Boolean, Column, ForeignKey, Index, Integer, String, DateTime, Date, Time,
     Enum as SAEnum, func, DECIMAL
 )
 from sqlalchemy.orm import relationship, Mapped, mapped_column # Use Mapped for modern type-annotated style
@@ -113,6 +113,11 @@ class DOH(Base):
     # Relationship กลับไปยัง Shipment
     shipment: Mapped["Shipment"] = relationship(back_populates="details")
 
+    # FULLTEXT (ngram) สำหรับ GET /shipments/search (สร้างจริงด้วย Migration v6)
+    __table_args__ = (
+        Index("ft_doh_search", "doid", "cusname", mysql_prefix="FULLTEXT", mysql_with_parser="ngram"),
+    )
+
 class BookingRound(Base):
     __tablename__ = "booking_round"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
@@ -128,7 +133,7 @@ class BookingRound(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
 
     # Relationship to Shipments in this round
-    shipments: Mapped[list["Shipment"]] = relationship(back_populates="booking_round", lazy="selectin")
+    shipments: Mapped[list["Shipment"]] = relationship(back_populates="booking_round", lazy="raise") # ใช้ load_profiles.ROUND_*
 class MLeadTime(Base):
     __tablename__ = "mleadtime"
     route: Mapped[str] = mapped_column(String(6), primary_key=True)
@@ -179,28 +184,126 @@ class Shipment(Base):
     current_grade_to_assign: Mapped[str] = mapped_column(String(1), nullable=True)
     confirmed_by_grade: Mapped[str] = mapped_column(String(1), nullable=True)
     assigned_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
-    rejected_by_vencodes: Mapped[list] = mapped_column(JSON, nullable=True)
     is_on_hold: Mapped[bool] = mapped_column(Boolean, default=False, server_default="0")
     docstat_before_hold: Mapped[str] = mapped_column(String(2), nullable=True)
+    # เลข Change Sequence ล่าสุดที่แก้ไขแถวนี้ (ดู app/db/versioning.py) ใช้ทำ Delta-sync
+    row_version: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0", index=True)
+
+    # Composite Indexes ตาม Access Path ที่ใช้บ่อย (สร้างจริงด้วย Migration v4)
+    __table_args__ = (
+        Index("ix_shipment_docstat_assigned_at", "docstat", "assigned_at"),                        # Worker: งานที่หมดเวลาตอบรับ
+        Index("ix_shipment_unassigned", "booking_round_id", "is_on_hold", "shippoint", "apmdate"), # /unassigned
+        Index("ix_shipment_shippoint_crdate", "shippoint", "crdate"),                              # assign-all
+        Index("ix_shipment_vencode_docstat", "vencode", "docstat", "apmdate"),                     # /my-orders, /my-history ของ Vendor
+        Index("ix_shipment_docstat_chdate", "docstat", "chdate"),                                  # /my-history (เรียงตาม chdate)
+        Index("ix_shipment_apmdate", "apmdate"),                                                   # รายการที่เรียงตาม apmdate
+        # FULLTEXT (ngram) สำหรับ GET /shipments/search (Migration v6)
+        Index("ft_shipment_search", "shipid", "customer_name", mysql_prefix="FULLTEXT", mysql_with_parser="ngram"),
+    )
+    # Optimistic Locking: UPDATE ผ่าน ORM จะมี WHERE row_version = <ค่าที่อ่านมา>
+    # ถ้ามีคนอื่นแก้แถวนี้ไปก่อน (row_version เปลี่ยน) จะได้ StaleDataError แทนการเขียนทับเงียบ ๆ
+    # ค่าใหม่ตั้งโดย versioning._stamp_shipment_row_versions (จึงปิด generator ของ SQLAlchemy)
+    __mapper_args__ = {"version_id_col": row_version, "version_id_generator": False}
     # Relationships to get descriptive data
-    mvendor: Mapped["MVendor"] = relationship(lazy="joined")
+    # ทั้งหมดเป็น lazy="raise": แต่ละ Query เลือกโหลดเองผ่าน app/db/load_profiles.py
+    mvendor: Mapped["MVendor"] = relationship(lazy="raise")
 
     warehouse: Mapped["MWarehouse"] = relationship(
     "MWarehouse", # ระบุชื่อคลาสเป้าหมาย
     primaryjoin="Shipment.shippoint == MWarehouse.warehouse_code", # ระบุเงื่อนไขการ JOIN อย่างชัดเจน
-    lazy="joined"
+    lazy="raise"
 )
     mleadtime : Mapped["MLeadTime"] = relationship(
         "MLeadTime",
         primaryjoin="Shipment.route == MLeadTime.route",
-        lazy="joined"
+        lazy="raise"
     )
-    mprovince: Mapped["MProvince"] = relationship(lazy="joined")
-    mshiptype: Mapped["MShipType"] = relationship(lazy="joined")
-    mcar: Mapped["MCar"] = relationship()
-    booking_round: Mapped["BookingRound"] = relationship(back_populates="shipments")
+    mprovince: Mapped["MProvince"] = relationship(lazy="raise")
+    mshiptype: Mapped["MShipType"] = relationship(lazy="raise")
+    mcar: Mapped["MCar"] = relationship(lazy="raise")
+    booking_round: Mapped["BookingRound"] = relationship(back_populates="shipments", lazy="raise")
     details: Mapped[List["DOH"]] = relationship(
         back_populates="shipment",
         cascade="all, delete-orphan",
-        lazy="selectin" 
+        lazy="raise"
+    )
+    # Vendor ที่ปฏิเสธ/ปล่อยงานนี้หมดเวลา (แทนคอลัมน์ JSON rejected_by_vencodes เดิม)
+    rejections: Mapped[List["ShipmentRejection"]] = relationship(
+        back_populates="shipment",
+        cascade="all, delete-orphan",
+        order_by="ShipmentRejection.rejected_at",
+        lazy="raise" # ต้องขอผ่าน load_profiles (SHIPMENT_WRITE / SHIPMENT_WORKER) กัน N+1 ตอนวนหลายแถว
     )
+
+    @property
+    def rejected_by_vencodes(self) -> List[str]:
+        return [rejection.vencode for rejection in self.rejections]
+
+class ShipmentRejection(Base):
+    """
+    Vendor ที่ไม่รับงาน (ปฏิเสธเอง หรือปล่อยให้หมดเวลา) หนึ่งแถวต่อ (shipid, vencode)
+    PK (shipid, vencode) ใช้ทำ Anti-join ของรายการงานเปิด (BC) ใน get_shipments_for_vendor
+    """
+    __tablename__ = "shipment_rejection"
+    shipid: Mapped[str] = mapped_column(String(10), ForeignKey("shipment.shipid", name="fk_shipment_rejection_shipid"), primary_key=True)
+    vencode: Mapped[str] = mapped_column(String(10), primary_key=True)
+    rejected_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    shipment: Mapped["Shipment"] = relationship(back_populates="rejections")
+
+    __table_args__ = (
+        Index("ix_shipment_rejection_vencode", "vencode", "rejected_at"),
+    )
+
+class ShipmentChangeLog(Base):
+    """
+    เลข Change Sequence ของตาราง shipment: หนึ่งแถวต่อหนึ่ง Transaction ที่แก้ Shipment (ดู app/db/versioning.py)
+    version เป็น AUTO_INCREMENT จึงขอเลขได้โดยไม่ต้อง Lock แถวใดค้างไว้จน commit
+    (แทน shipment_change_seq ตั้งแต่ Migration v7)
+    """
+    __tablename__ = "shipment_change_log"
+    version: Mapped[int] = mapped_column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    allocated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_shipment_change_log_allocated_at", "allocated_at"),
+    )
+
+class ShipmentEvent(Base):
+    """
+    ประวัติการเปลี่ยนสถานะของ Shipment แบบ Append-only (ไม่มีการ UPDATE/DELETE)
+    เขียนผ่าน app/db/event_log.py ซึ่งรวมหลายแถวเป็น INSERT เดียว
+    """
+    __tablename__ = "shipment_events"
+    id: Mapped[int] = mapped_column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    shipid: Mapped[str] = mapped_column(String(10), nullable=False) # ไม่ใส่ FK เพื่อให้ INSERT เบาและไม่ Lock ตาราง shipment
+    event_type: Mapped[str] = mapped_column(String(30), nullable=False)
+    docstat_from: Mapped[str] = mapped_column(String(2), nullable=True)
+    docstat_to: Mapped[str] = mapped_column(String(2), nullable=True)
+    vencode: Mapped[str] = mapped_column(String(10), nullable=True) # Vendor ที่เกี่ยวข้อง (ถูกเสนองาน/รับงาน/ปฏิเสธ)
+    grade: Mapped[str] = mapped_column(String(1), nullable=True)
+    booking_round_id: Mapped[int] = mapped_column(Integer, nullable=True)
+    actor: Mapped[str] = mapped_column(String(100), nullable=True)
+    detail: Mapped[dict] = mapped_column(JSON(none_as_null=True), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_shipment_events_created_at", "created_at"),
+        Index("ix_shipment_events_shipid_created_at", "shipid", "created_at"),
+    )
+
+class IdempotencyKey(Base):
+    """
+    เก็บผลลัพธ์ของ Action ที่ส่ง Header Idempotency-Key มา เพื่อตอบซ้ำเมื่อ Client Retry
+    status_code เป็น NULL ระหว่างที่ Request แรกยังทำงานไม่เสร็จ (ถือคีย์ได้ถึง locked_until)
+    """
+    __tablename__ = "idempotency_keys"
+    username: Mapped[str] = mapped_column(String(100), primary_key=True)
+    idempotency_key: Mapped[str] = mapped_column(String(100), primary_key=True)
+    endpoint: Mapped[str] = mapped_column(String(50), nullable=False)
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False) # sha256 ของ endpoint + body
+    status_code: Mapped[int] = mapped_column(Integer, nullable=True)
+    response_body: Mapped[dict] = mapped_column(JSON, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+    locked_until: Mapped[datetime] = mapped_column(DateTime, nullable=True) # Lease ของ Request ที่กำลังทำงาน (NULL เมื่อเก็บผลแล้ว)
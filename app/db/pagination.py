@@ -0,0 +1,112 @@
+# app/db/pagination.py
+# Keyset Pagination (Cursor) สำหรับ Endpoint ที่คืนรายการ
+# แทนที่ OFFSET ด้วยเงื่อนไข "อยู่ถัดจากแถวสุดท้ายของหน้าก่อน" ตามคีย์ที่ใช้เรียง (+ Primary Key กันค่าซ้ำ)
+# จึงอ่านเฉพาะ limit + 1 แถวจาก Index ทุกหน้า ไม่ว่าตารางจะโตแค่ไหน
+#
+# Cursor เป็น base64url ของ JSON [ค่าคีย์แต่ละตัวของแถวสุดท้าย] (Client ห้ามแกะ/สร้างเอง ให้ส่งกลับมาตามที่ได้)
+# ใช้ได้ทั้ง Query (Session) และ select() (AsyncSession) เพราะใช้แค่ where/order_by/limit
+#
+# เรื่อง NULL: MySQL เรียง NULL ไว้ก่อนสุดเมื่อ ASC และท้ายสุดเมื่อ DESC (SQLite ก็เหมือนกัน)
+# เงื่อนไข "ถัดไป" ด้านล่างเขียนตามลำดับนั้น คอลัมน์ที่ Nullable (เช่น apmdate, chdate) จึงแบ่งหน้าได้ถูกต้อง
+import base64
+import json
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, false, or_, true
+
+from ..core.config import settings
+
+# (คอลัมน์, ชื่อ Attribute บน Object) เรียงจากคีย์หลักไปคีย์รอง ตัวสุดท้ายต้อง Unique และไม่เป็น NULL
+KeyColumns = Sequence[Tuple[Any, str]]
+
+class InvalidCursor(ValueError):
+    """Cursor ที่ Client ส่งมาอ่านไม่ได้ (main.py แปลงเป็น HTTP 400)"""
+
+@dataclass
+class Page:
+    items: List[Any]
+    limit: int
+    next_cursor: Optional[str]
+    has_more: bool
+
+# --- Cursor ---
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    if isinstance(value, time):
+        return {"t": value.isoformat()}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.fromisoformat(value["dt"])
+        if "d" in value:
+            return date.fromisoformat(value["d"])
+        if "t" in value:
+            return time.fromisoformat(value["t"])
+        raise ValueError("unknown cursor value")
+    return value
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """แปลง Cursor กลับเป็นค่าคีย์ ถ้าผิดรูปแบบ (หรือจำนวนคีย์ไม่ตรงกับ Endpoint) จะ raise InvalidCursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = [_decode_value(v) for v in json.loads(raw)]
+    except (ValueError, TypeError):
+        values = None
+    if not values or len(values) != size:
+        raise InvalidCursor("Invalid cursor")
+    return values
+
+# --- Query ---
+def _after(column, value, descending: bool):
+    """เงื่อนไขของแถวที่มาหลัง value ในคอลัมน์เดียว (ตามลำดับ NULL ของ MySQL)"""
+    if descending:
+        # DESC: ค่ามาก -> น้อย แล้วตามด้วย NULL
+        return false() if value is None else or_(column < value, column.is_(None))
+    # ASC: NULL ก่อน แล้วค่าน้อย -> มาก
+    return column.is_not(None) if value is None else column > value
+
+def _equal(column, value):
+    return column.is_(None) if value is None else column == value
+
+def keyset(query, keys: KeyColumns, cursor: Optional[str], limit: int, descending: bool = False):
+    """
+    ใส่ ORDER BY ตาม keys, เงื่อนไขต่อจาก cursor และ LIMIT limit + 1 (แถวเกินใช้บอก has_more)
+    ORDER BY เดิมของ query จะถูกแทนที่
+    """
+    columns = [column for column, _ in keys]
+    query = query.order_by(None).order_by(*[c.desc() if descending else c.asc() for c in columns])
+    if cursor:
+        values = decode_cursor(cursor, len(columns))
+        branches = []
+        for i, column in enumerate(columns):
+            prefix = [_equal(columns[j], values[j]) for j in range(i)]
+            branches.append(and_(true(), *prefix, _after(column, values[i], descending)))
+        query = query.where(or_(*branches))
+    return query.limit(limit + 1)
+
+def page(rows: Sequence[Any], keys: KeyColumns, limit: int) -> Page:
+    """ตัดแถวเกิน (limit + 1) ออก แล้วสร้าง Cursor จากแถวสุดท้ายของหน้า"""
+    rows = list(rows)
+    has_more = len(rows) > limit
+    items = rows[:limit]
+    next_cursor = None
+    if has_more and items:
+        next_cursor = encode_cursor([getattr(items[-1], attr) for _, attr in keys])
+    return Page(items=items, limit=limit, next_cursor=next_cursor, has_more=has_more)
+
+def clamp_limit(limit: Optional[int]) -> int:
+    """ไม่ส่ง limit = PAGE_SIZE_DEFAULT เสมอ (ทุก Endpoint รายการอ่านไม่เกินหนึ่งหน้าต่อ Request) และไม่เกิน PAGE_SIZE_MAX"""
+    if not limit:
+        return settings.PAGE_SIZE_DEFAULT
+    return max(1, min(limit, settings.PAGE_SIZE_MAX))
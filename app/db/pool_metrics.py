@@ -0,0 +1,99 @@
+# app/db/pool_metrics.py
+# ตัวนับสถิติของ Connection Pool จาก Pool Events ใช้ปรับ DB_POOL_SIZE / DB_MAX_OVERFLOW จากข้อมูลจริง
+#   checkouts / checkins    - ยืม/คืน Connection
+#   connects                - เปิด Connection ใหม่กับ MySQL (ถ้าสูงต่อเนื่อง = Pool เล็กไป หรือ recycle ถี่ไป)
+#   invalidations           - Connection เสีย/ถูกทิ้ง (เช่น pre-ping เจอ Connection ที่ MySQL ตัดไปแล้วหลัง wait_timeout)
+#   timeouts                - รอ Connection เกิน DB_POOL_TIMEOUT
+#   wait_*                  - เวลาที่รอยืม Connection จาก Pool (วัดจาก InstrumentedQueuePool)
+# ค่าในนี้เป็นของ Process ปัจจุบันเท่านั้น (API แต่ละ Worker / run_worker แยกกัน)
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+_lock = threading.Lock()
+_stats: dict = {}
+_engines: dict = {}
+
+def _new_stats() -> dict:
+    return {
+        "checkouts": 0, "checkins": 0, "connects": 0,
+        "invalidations": 0, "soft_invalidations": 0, "timeouts": 0,
+        "wait_count": 0, "wait_total_ms": 0.0, "wait_max_ms": 0.0,
+    }
+
+def _incr(name: str, key: str):
+    with _lock:
+        _stats[name][key] += 1
+
+def _record_wait(name: str, seconds: float, timed_out: bool):
+    ms = seconds * 1000
+    with _lock:
+        stats = _stats[name]
+        stats["wait_count"] += 1
+        stats["wait_total_ms"] += ms
+        stats["wait_max_ms"] = max(stats["wait_max_ms"], ms)
+        if timed_out:
+            stats["timeouts"] += 1
+
+class _TimedGetMixin:
+    """จับเวลาที่ใช้ยืม Connection (รวมเวลาที่ต้องรอเมื่อ Pool เต็ม) ไม่มี Pool Event ให้ใช้ตรงนี้จึง Override _do_get"""
+    metrics_name = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            timed_out = True
+            raise
+        finally:
+            if self.metrics_name:
+                _record_wait(self.metrics_name, time.perf_counter() - start, timed_out)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics_name = self.metrics_name
+        return pool
+
+class InstrumentedQueuePool(_TimedGetMixin, QueuePool):
+    pass
+
+class InstrumentedAsyncQueuePool(_TimedGetMixin, AsyncAdaptedQueuePool):
+    pass
+
+def instrument(engine, name: str):
+    """ผูก Pool Events ของ engine (ส่ง sync_engine ถ้าเป็น AsyncEngine) เข้ากับชื่อ name"""
+    with _lock:
+        _stats.setdefault(name, _new_stats())
+    engine.pool.metrics_name = name
+    _engines[name] = engine
+    event.listen(engine, "checkout", lambda *args: _incr(name, "checkouts"))
+    event.listen(engine, "checkin", lambda *args: _incr(name, "checkins"))
+    event.listen(engine, "connect", lambda *args: _incr(name, "connects"))
+    event.listen(engine, "invalidate", lambda *args: _incr(name, "invalidations"))
+    event.listen(engine, "soft_invalidate", lambda *args: _incr(name, "soft_invalidations"))
+    return engine
+
+def snapshot() -> dict:
+    """สถิติสะสม + สถานะปัจจุบันของแต่ละ Pool (size, checked_out, overflow)"""
+    result = {}
+    with _lock:
+        stats = {name: dict(values) for name, values in _stats.items()}
+    for name, values in stats.items():
+        pool = _engines[name].pool
+        values["wait_avg_ms"] = round(values["wait_total_ms"] / values["wait_count"], 3) if values["wait_count"] else 0.0
+        values["wait_total_ms"] = round(values["wait_total_ms"], 3)
+        values["wait_max_ms"] = round(values["wait_max_ms"], 3)
+        if hasattr(pool, "checkedout"):
+            values.update({
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+            })
+        result[name] = values
+    return result
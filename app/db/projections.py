@@ -0,0 +1,114 @@
+# app/db/projections.py
+# Projection แบบ Core สำหรับ Endpoint รายการ Shipment ที่อ่านอย่างเดียว (ไม่สร้าง ORM Object / Identity Map / Collection)
+#   1. select เฉพาะคอลัมน์ที่ shipment_schemas.Shipment ใช้ + คอลัมน์ของตาราง Master (LEFT JOIN) ในแถวเดียวกัน
+#   2. DOH ของทั้งหน้าดึงด้วย Query เดียว (WHERE shipid IN ...) แล้วจัดกลุ่มตาม shipid
+#   3. ประกอบเป็น dict ที่มีโครงสร้างเดียวกับ Schema ส่งต่อให้ app/core/serialization.py ได้ทันที
+# คอลัมน์คำนวณจาก Field ของ Schema: เพิ่ม Field ใน Schema แล้ว Projection จะดึงคอลัมน์นั้นมาเอง
+# Sparse Fieldset (app/core/fieldsets.py): for_fieldset() ตัดคอลัมน์ที่ไม่ขอ, ไม่ JOIN Master และไม่ดึง DOH ที่ไม่ได้ include
+from collections import defaultdict
+from typing import List, Optional, Sequence
+
+from sqlalchemy import select
+
+from . import models
+from ..schemas import shipment_detail_schemas, shipment_schemas
+
+# จำนวน shipid สูงสุดต่อ Query ของ DOH (หน้าปกติ <= PAGE_SIZE_MAX จึงเป็น Query เดียว)
+DETAIL_BATCH_SIZE = 1000
+
+def _columns(model, schema) -> list:
+    keys = {field.alias or name for name, field in schema.model_fields.items()}
+    return [column for column in model.__table__.columns if column.key in keys]
+
+# (ชื่อ Relationship, Model, เงื่อนไข JOIN, Schema) ตรงกับ Relationship ที่ load_profiles.SHIPMENT_LIST โหลด
+_MASTERS = (
+    ("mshiptype", models.MShipType, models.Shipment.cartype == models.MShipType.cartype, shipment_schemas.ShipTypeSchema),
+    ("mprovince", models.MProvince, models.Shipment.province == models.MProvince.province, shipment_schemas.MProvince),
+    ("mleadtime", models.MLeadTime, models.Shipment.route == models.MLeadTime.route, shipment_schemas.MLeadTimeSchema),
+    ("mvendor", models.MVendor, models.Shipment.vencode == models.MVendor.vencode, shipment_schemas.MVendorSchema),
+)
+
+SHIPMENT_COLUMNS = _columns(models.Shipment, shipment_schemas.Shipment)
+DETAIL_COLUMNS = _columns(models.DOH, shipment_detail_schemas.ShipmentDetail)
+DETAIL_KEYS = [column.key for column in DETAIL_COLUMNS]
+_DETAIL_SHIPID = DETAIL_KEYS.index("shipid")
+
+# คอลัมน์ที่ Select เสมอแม้ Client ไม่ได้ขอ: shipid (จับคู่ DOH) และคีย์ของ Keyset ใน async_crud (apmdate, chdate)
+# ค่าที่ไม่ได้ขอจะถูกตัดออกตอน Serialize
+ALWAYS_SELECTED = frozenset({"shipid", "apmdate", "chdate"})
+
+class ShipmentProjection:
+    """
+    select() + การประกอบ dict ของชุด Field หนึ่ง (fieldset=None = ทุก Field เหมือน shipment_schemas.Shipment)
+    คอลัมน์ของ Master ตั้งชื่อเป็น "<relationship>__<column>" และพา Primary Key มาด้วย
+    ไว้แยก "ไม่มีแถวที่ JOIN ได้" (-> None เหมือน Relationship ที่ว่าง) ออกจากแถวที่ทุกคอลัมน์เป็น NULL
+    assemble() อ่านค่าตามตำแหน่งในแถว (ลำดับเดียวกับ select()) ไม่ต้องค้นด้วยชื่อทีละคอลัมน์
+    """
+    def __init__(self, fieldset: Optional[frozenset] = None):
+        def wanted(key: str) -> bool:
+            return fieldset is None or key in fieldset
+
+        self.columns = [column for column in SHIPMENT_COLUMNS if wanted(column.key) or column.key in ALWAYS_SELECTED]
+        self.keys = [column.key for column in self.columns]
+        self.masters = [master for master in _MASTERS if wanted(master[0])]
+        self.details = wanted("details")
+
+        self._master_columns = []
+        self._nested = [] # (ชื่อ Relationship, ตำแหน่งของ Primary Key, [Key ใน dict], slice ของคอลัมน์)
+        for relation, model, _, schema in self.masters:
+            columns = _columns(model, schema)
+            start = len(self.columns) + len(self._master_columns)
+            self._master_columns += [column.label(f"{relation}__{column.key}") for column in columns]
+            self._master_columns.append(model.__table__.primary_key.columns.values()[0].label(f"{relation}__pk"))
+            self._nested.append((relation, start + len(columns), [column.key for column in columns],
+                                 slice(start, start + len(columns))))
+
+    def select(self):
+        """select() ของคอลัมน์ Shipment + Master ที่ Response ใช้ (ใส่ where/order_by ต่อได้เหมือน select(models.Shipment))"""
+        stmt = select(*self.columns, *self._master_columns).select_from(models.Shipment)
+        for _, model, onclause, _ in self.masters:
+            stmt = stmt.outerjoin(model, onclause)
+        return stmt
+
+    def detail_batches(self, rows) -> List[list]:
+        """shipid ของแถวที่ต้องดึง DOH แบ่งเป็นชุดละ DETAIL_BATCH_SIZE (ไม่ได้ include details = ไม่ต้องดึง)"""
+        if not self.details:
+            return []
+        shipids = [row.shipid for row in rows]
+        return [shipids[i:i + DETAIL_BATCH_SIZE] for i in range(0, len(shipids), DETAIL_BATCH_SIZE)]
+
+    def assemble(self, rows, detail_rows) -> List[dict]:
+        """แถวจาก select() + แถวจาก details_stmt() -> dict ตามโครงสร้าง shipment_schemas.Shipment"""
+        details = defaultdict(list)
+        for detail in detail_rows:
+            details[detail[_DETAIL_SHIPID]].append(dict(zip(DETAIL_KEYS, detail)))
+        items = []
+        for row in rows:
+            item = dict(zip(self.keys, row))
+            for relation, pk_index, keys, columns in self._nested:
+                item[relation] = None if row[pk_index] is None else dict(zip(keys, row[columns]))
+            if self.details:
+                item["details"] = details.get(item["shipid"], [])
+            items.append(item)
+        return items
+
+def details_stmt(shipids: Sequence[str]):
+    return (select(*DETAIL_COLUMNS)
+              .where(models.DOH.shipid.in_(shipids))
+              .order_by(models.DOH.shipid, models.DOH.doid))
+
+FULL = ShipmentProjection()
+
+# Projection ของแต่ละ Fieldset สร้างครั้งแรกแล้ว Cache ไว้ (จำกัดจำนวนกัน Client ส่งชุด Field แปลก ๆ มาไม่รู้จบ)
+_MAX_CACHED = 256
+_by_fieldset = {}
+
+def for_fieldset(fieldset: Optional[frozenset]) -> ShipmentProjection:
+    if fieldset is None:
+        return FULL
+    projection = _by_fieldset.get(fieldset)
+    if projection is None:
+        projection = ShipmentProjection(fieldset)
+        if len(_by_fieldset) < _MAX_CACHED:
+            _by_fieldset[fieldset] = projection
+    return projection
@@ -0,0 +1,73 @@
+# app/db/transactions.py
+# Retry ทั้ง Transaction เมื่อ MySQL ตอบ Deadlock (1213) หรือ Lock wait timeout (1205)
+# ทั้งสอง Error นี้ MySQL Rollback ให้แล้วและ "ลองใหม่ได้" ถ้าทำงานทั้ง Transaction ซ้ำตั้งแต่ต้น
+# จึงใช้กับ Unit of Work ที่ commit เองในตัว และมี Side Effect (Realtime/FCM/Event Log) หลัง commit เท่านั้น
+import random
+import threading
+import time
+from collections import Counter
+from typing import Callable, TypeVar
+
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+
+T = TypeVar("T")
+
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_LOCK_DEADLOCK = 1213
+RETRYABLE_ERROR_CODES = (ER_LOCK_WAIT_TIMEOUT, ER_LOCK_DEADLOCK)
+
+_lock = threading.Lock()
+_retries: Counter = Counter()   # (ชื่อ Unit of Work, รหัส Error) -> จำนวนครั้งที่ Retry
+_exhausted: Counter = Counter() # ชื่อ Unit of Work -> จำนวนครั้งที่ Retry จนหมดแล้วยังไม่ผ่าน
+
+def error_code(exc: BaseException):
+    """รหัส Error ของ MySQL (PyMySQL/aiomysql เก็บไว้ใน args[0]) หรือ None"""
+    orig = getattr(exc, "orig", None)
+    args = getattr(orig, "args", None)
+    return args[0] if args and isinstance(args[0], int) else None
+
+def is_retryable(exc: BaseException) -> bool:
+    return isinstance(exc, DBAPIError) and error_code(exc) in RETRYABLE_ERROR_CODES
+
+def _backoff_seconds(attempt: int) -> float:
+    # Exponential backoff แบบ Full Jitter: สุ่มใน [0, min(max, base * 2^(attempt-1))]
+    ceiling = min(settings.TX_RETRY_MAX_DELAY_MS, settings.TX_RETRY_BASE_DELAY_MS * (2 ** (attempt - 1)))
+    return random.uniform(0, ceiling) / 1000
+
+def run_with_retry(db: Session, work: Callable[[], T], name: str) -> T:
+    """
+    เรียก work() (ซึ่งต้อง commit เองข้างใน) ถ้าเจอ 1213/1205 จะ rollback แล้วเรียกใหม่ทั้งหมด
+    สูงสุด TX_RETRY_ATTEMPTS ครั้ง Error อื่น หรือครั้งสุดท้ายที่ยังไม่ผ่าน จะถูก raise ต่อตามเดิม
+    """
+    attempts = max(1, settings.TX_RETRY_ATTEMPTS)
+    for attempt in range(1, attempts + 1):
+        try:
+            return work()
+        except DBAPIError as e:
+            if not is_retryable(e):
+                raise
+            db.rollback()
+            code = error_code(e)
+            if attempt == attempts:
+                with _lock:
+                    _exhausted[name] += 1
+                print(f"ERROR: {name} failed with MySQL error {code} after {attempts} attempts")
+                raise
+            with _lock:
+                _retries[(name, code)] += 1
+            delay = _backoff_seconds(attempt)
+            print(f"WARNING: {name} hit MySQL error {code}, retrying in {delay * 1000:.0f}ms (attempt {attempt + 1}/{attempts})")
+            time.sleep(delay)
+
+def snapshot() -> dict:
+    """จำนวน Retry สะสมของ Process นี้ แยกตาม Unit of Work และรหัส Error"""
+    with _lock:
+        result = {}
+        for (name, code), count in _retries.items():
+            result.setdefault(name, {"retries": {}, "exhausted": 0})["retries"][str(code)] = count
+        for name, count in _exhausted.items():
+            result.setdefault(name, {"retries": {}, "exhausted": 0})["exhausted"] = count
+        return result
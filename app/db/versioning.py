@@ -0,0 +1,76 @@
+# app/db/versioning.py
+# Change Sequence ของตาราง shipment สำหรับ Delta-sync (GET /api/v1/shipments/changes)
+# - ทุก Transaction ที่แก้ไข Shipment จะได้เลขใหม่ 1 เลข = แถวใหม่ใน shipment_change_log (AUTO_INCREMENT)
+# - การขอเลขทำใน Transaction สั้นของตัวเองบน Connection แยก แล้ว commit ทันที
+#   จึงไม่มี Lock ค้างอยู่จนกว่า Transaction หลักจะ commit (เดิมแถว Counter เดียวทำให้ทุกการเขียนต่อคิวกัน และเกิด Deadlock)
+# - เลขจึงเรียงตามลำดับการขอ ไม่ใช่ลำดับการ commit: High-water mark ที่ส่งให้ Client
+#   คือเลขสูงสุดที่ขอไปแล้วนานกว่า DELTA_SYNC_LAG_SECONDS (Transaction ที่ค้างนานกว่านั้นถือว่าผิดปกติ)
+# - row_version ยังเป็น version_id_col ของ Shipment (Optimistic Locking) ด้วย
+#   Bulk UPDATE ต้องใส่ row_version ใหม่เสมอ ไม่เช่นนั้น ORM Writer ที่ถือค่าเก่าอยู่จะเขียนทับโดยไม่รู้ตัว
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, event, func, select
+from sqlalchemy.orm import Session
+
+from . import models
+from ..core.config import settings
+
+_SESSION_KEY = "shipment_change_version"
+
+_log_table = models.ShipmentChangeLog.__table__
+
+def next_change_version(db: Session) -> int:
+    """
+    คืนเลข Change Sequence ของ Transaction ปัจจุบัน (ขอใหม่ครั้งแรก แล้วใช้ซ้ำจนกว่าจะ commit/rollback)
+    ใช้กับ Bulk UPDATE: .update({..., "row_version": next_change_version(db)})
+    """
+    version = db.info.get(_SESSION_KEY)
+    if version is not None:
+        return version
+
+    stmt = _log_table.insert().values(allocated_at=datetime.now(timezone.utc))
+    bind = db.get_bind()
+    if bind.dialect.name == "sqlite":
+        # SQLite Lock ทั้งไฟล์: Connection แยกจะรอ Transaction หลักของเราเอง จึงเขียนใน Transaction เดียวกัน
+        version = db.execute(stmt).inserted_primary_key[0]
+    else:
+        with bind.connect() as conn:
+            version = conn.execute(stmt).inserted_primary_key[0]
+            conn.commit()
+    db.info[_SESSION_KEY] = version
+    return version
+
+def stable_change_version(db: Session) -> int:
+    """
+    High-water mark ของ Delta-sync: เลขสูงสุดที่ขอไปแล้วนานกว่า DELTA_SYNC_LAG_SECONDS
+    Transaction ที่ได้เลขน้อยกว่านี้ถือว่า commit (หรือ rollback) ไปแล้ว Client จึงอ่านถึงเลขนี้ได้โดยไม่พลาดแถว
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.DELTA_SYNC_LAG_SECONDS)
+    version = db.execute(select(func.max(_log_table.c.version)).where(_log_table.c.allocated_at <= cutoff)).scalar()
+    return version or 0
+
+def purge_change_log(db: Session) -> int:
+    """ลบแถวของ shipment_change_log ที่เก่ากว่า CHANGE_LOG_RETENTION_HOURS (เก็บแถวล่าสุดไว้เสมอ ให้ AUTO_INCREMENT ไม่ย้อนหลังตอน Restart)"""
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=settings.CHANGE_LOG_RETENTION_HOURS)
+    latest = db.execute(select(func.max(_log_table.c.version))).scalar()
+    if latest is None:
+        return 0
+    result = db.execute(
+        delete(_log_table).where(_log_table.c.allocated_at < cutoff, _log_table.c.version < latest)
+    )
+    db.commit()
+    return result.rowcount
+
+@event.listens_for(Session, "before_flush")
+def _stamp_shipment_row_versions(session: Session, flush_context, instances):
+    # Shipment ที่ถูกสร้าง/แก้ไขผ่าน ORM จะได้ row_version ใหม่อัตโนมัติ
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, models.Shipment):
+            continue
+        if obj in session.new or session.is_modified(obj, include_collections=False):
+            obj.row_version = next_change_version(session)
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _reset_change_version(session: Session):
+    session.info.pop(_SESSION_KEY, None)
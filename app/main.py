@@ -1,26 +1,40 @@
 # app/main.py
-from fastapi import FastAPI
+import math
+
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm.exc import StaleDataError
 from fastapi.concurrency import asynccontextmanager
-from .core import firebase_service
+from .core import firebase_service, realtime, serialization
+from .core.config import settings
 from fastapi.middleware.cors import CORSMiddleware # เพิ่ม CORS Middleware
 from .routers import auth_router, user_router
+from .db import database
 from .db.database import Base, engine # ถ้าจะให้ SQLAlchemy สร้างตาราง
+from .db import event_log, pagination, transactions
 from .routers import (
     auth_router,
     user_router,
     shipment_router, # <<--- ตรวจสอบว่า Import มาถูกต้อง
     master_data_router,
-    booking_round_router
+    booking_round_router,
+    realtime_router,
+    metrics_router
 )
 
-app = FastAPI(title="Truck Booking API - Login")
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup event
-    await firebase_service.initialize_firebase()  # เรียกใช้ฟังก์ชันเชื่อมต่อกับ Firebase ในช่วง startup
+    firebase_service.initialize_firebase()  # เรียกใช้ฟังก์ชันเชื่อมต่อกับ Firebase ในช่วง startup
+    await realtime.broker.start_fanout_listener()  # รับ Event จาก Process อื่น (worker / uvicorn workers)
     yield  # ให้ FastAPI รันส่วนอื่น ๆ ของแอป
-    # Shutdown event (หากต้องการ)
-    await firebase_service.close_firebase() 
+    realtime.broker.stop_fanout_listener()
+    # Shutdown event: ส่ง Notification ที่ยังค้างอยู่ในคิวรวมข้อความให้หมดก่อนปิด
+    firebase_service.flush_pending_notifications()
+    event_log.flush() # เขียน Shipment Events ที่ยังค้างใน Buffer
+
+app = FastAPI(title="Truck Booking API - Login", lifespan=lifespan, default_response_class=serialization.ORJSONResponse)
 # --- CORS Middleware ---
 # อนุญาตให้ Flutter Web App (หรือ Client อื่นๆ) เรียก API นี้ได้
 # ใน Development อาจจะใช้ origins = ["*"]
@@ -36,15 +50,49 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],   # อนุญาตทุก Method
     allow_headers=["*"],   # อนุญาตทุก Header
+    expose_headers=["X-Page-Limit", "X-Has-More", "X-Next-Cursor", "X-Read-After"], # ให้ Flutter Web อ่าน Header การแบ่งหน้า / Read-your-writes ได้
 )
 # --- End CORS Middleware ---
 
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    # Request ที่เขียนข้อมูลสำเร็จ -> การอ่านของผู้ใช้คนนี้ช่วงสั้น ๆ ให้ไปที่ Primary (ดู database.get_read_db)
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        token = database.recent_write_token(request.headers.get("authorization"))
+        if token:
+            response.headers[database.READ_AFTER_HEADER] = token
+            response.set_cookie(database.READ_AFTER_COOKIE, token, max_age=math.ceil(settings.REPLICA_STICKY_SECONDS),
+                                httponly=True, samesite="lax")
+    return response
+
+@app.exception_handler(StaleDataError)
+async def stale_data_handler(request: Request, exc: StaleDataError):
+    # Optimistic Locking: Shipment ถูกแก้โดย Request/Worker อื่นระหว่างที่เรากำลังแก้ (row_version ไม่ตรง)
+    return JSONResponse(status_code=status.HTTP_409_CONFLICT,
+                        content={"detail": "Shipment was modified by another request. Reload and try again."})
+
+@app.exception_handler(OperationalError)
+async def operational_error_handler(request: Request, exc: OperationalError):
+    # Deadlock / Lock wait timeout ที่ transactions.run_with_retry ลองครบแล้วยังไม่ผ่าน: ให้ Client ลองใหม่ภายหลัง
+    if transactions.is_retryable(exc):
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"},
+                            content={"detail": "Database is busy. Please try again."})
+    raise exc
+
+@app.exception_handler(pagination.InvalidCursor)
+async def invalid_cursor_handler(request: Request, exc: pagination.InvalidCursor):
+    # cursor ที่ Client ส่งมาแกะไม่ได้ (แก้เอง/คนละ Endpoint)
+    return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"detail": str(exc)})
+
 app.include_router(auth_router.router, prefix="/auth")
 app.include_router(user_router.router, prefix="/users")
 app.include_router(shipment_router.router, prefix="/api/v1/shipments")
 app.include_router(master_data_router.router, prefix="/api/v1/master")
 app.include_router(booking_round_router.router, prefix="/api/v1/booking-rounds")
 app.include_router(user_router.router, prefix="/api/v1/users", tags=["Users & Profiles"])
+app.include_router(realtime_router.router, prefix="/ws")
+app.include_router(metrics_router.router, prefix="/api/v1/metrics")
 @app.get("/")
 async def root():
     return {"message": "Welcome to Truck Booking API! Use /auth/login to login."}
\ No newline at end of file
@@ -1,14 +1,15 @@
 # app/routers/auth_router.py
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 
 from ..schemas import token_schemas
 from ..core import security
-from ..db import crud, models # Import models ด้วยถ้าจะ Type Hint user
-from ..db.database import get_db
+from ..db import async_crud, models # Import models ด้วยถ้าจะ Type Hint user
+from ..db.database import get_async_db
 
 router = APIRouter(
     tags=["Authentication"]
@@ -17,11 +18,12 @@ router = APIRouter(
 @router.post("/login", response_model=token_schemas.Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db_session: Session = Depends(get_db)
+    db_session: AsyncSession = Depends(get_async_db)
 ):
-    user = crud.get_user_by_username(db_session, username=form_data.username) # <<--- ใช้ get_user_by_username
+    user = await async_crud.get_user_by_username(db_session, username=form_data.username) # <<--- ใช้ get_user_by_username
 
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    # bcrypt ใช้ CPU หลายสิบ ms จึงย้ายไปทำใน Threadpool ไม่ให้ Block Event Loop
+    if not user or not await run_in_threadpool(security.verify_password, form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password", # เปลี่ยนข้อความ Error
@@ -1,49 +1,101 @@
 # app/routers/booking_round_router.py
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional, Union
 from datetime import date
 
-from app.db import crud, models
+from app.db import crud, models, transactions
 
 from .. import db, schemas
-from ..core import security
+from ..core import fieldsets, http_cache, security, serialization
+from .shipment_router import CURSOR_QUERY, FIELDS_QUERY, INCLUDE_QUERY, LIMIT_QUERY, set_page_headers
 
 router = APIRouter(
     tags=["Booking Rounds"],
+    route_class=serialization.NegotiatingRoute, # รองรับ Accept: application/msgpack
     # ถ้าทุก Endpoint ในนี้ต้องการ Auth ให้ใส่ Dependency ที่นี่
     # dependencies=[Depends(security.get_current_active_user)]
 )
 
-@router.get("", response_model=List[schemas.booking_round_schemas.BookingRound])
-async def get_booking_rounds_by_date(
+def round_fieldset(fields: Optional[str] = FIELDS_QUERY, include: Optional[str] = INCLUDE_QUERY) -> Optional[frozenset]:
+    """Dependency: ?fields=&include=shipments -> ชุด Key ของ BookingRound ที่จะตอบ (None = ทุก Field รวม shipments)"""
+    try:
+        return fieldsets.parse(schemas.booking_round_schemas.BookingRound, fields, include, required=("id",))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+# ?view=summary: ตัวเลขสรุปต่อรอบ (จำนวนต่อ docstat, ปริมาตรรวม, จำนวน Vendor) แทนรายการ Shipment
+# หน้าจอที่เปิดดูรอบเดียวค่อยโหลด Shipment เต็มจาก GET /{round_id}
+VIEW_QUERY = Query("full", pattern="^(full|summary)$", description="full = รอบพร้อม Shipment ทั้งหมด, summary = ตัวเลขสรุปต่อรอบ")
+# คอลัมน์ของรอบที่โหลดในโหมด summary (ทุก Field ยกเว้น shipments)
+ROUND_SUMMARY_FIELDSET = (frozenset(schemas.booking_round_schemas.BookingRound.model_fields)
+                          - fieldsets.relations(schemas.booking_round_schemas.BookingRound))
+ROUND_LIST_RESPONSE = Union[List[schemas.booking_round_schemas.BookingRound], List[schemas.booking_round_schemas.BookingRoundSummary]]
+
+def round_view_fieldset(view: str, fieldset: Optional[frozenset]) -> Optional[frozenset]:
+    """ชุด Field ที่ต้องโหลดของ view นั้น (summary ใช้ร่วมกับ fields/include ไม่ได้)"""
+    if view != "summary":
+        return fieldset
+    if fieldset is not None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="view=summary cannot be combined with fields/include")
+    return ROUND_SUMMARY_FIELDSET
+
+def round_list_response(db_session: Session, response: Response, page, view: str, fieldset: Optional[frozenset]) -> Response:
+    rounds = set_page_headers(response, page)
+    if view == "summary":
+        return serialization.list_response(serialization.BOOKING_ROUND_SUMMARY_LIST,
+                                           crud.summarize_booking_rounds(db_session, rounds), response)
+    return serialization.list_response(serialization.BOOKING_ROUND_LIST.subset(fieldset), rounds, response)
+
+@router.get("", response_model=ROUND_LIST_RESPONSE)
+def get_booking_rounds_by_date(
+    request: Request,
+    response: Response,
     # ใช้ Query() เพื่อรับค่าจาก Query Parameters พร้อม Validation
     round_date: date = Query(..., description="Date in YYYY-MM-DD format"),
     warehouse_code: str = Query(..., description="Warehouse code (e.g., WH7, SW)"),
-    db_session: Session = Depends(db.database.get_db),
-    # current_user: models.SystemUser = Depends(security.get_current_active_user) # ถ้าต้องการ Auth
+    cursor: Optional[str] = CURSOR_QUERY,
+    limit: Optional[int] = LIMIT_QUERY,
+    view: str = VIEW_QUERY,
+    fieldset: Optional[frozenset] = Depends(round_fieldset),
+    db_session: Session = Depends(db.database.get_read_db),
+    # current_user: models.SystemUser = Depends(security.get_current_active_user_read) # ถ้าต้องการ Auth
 ):
     """
     ดึงข้อมูลรอบการจองทั้งหมดสำหรับวันที่และคลังสินค้าที่ระบุ
+    มี ETag: If-None-Match ที่ตรงได้ 304 โดยไม่ Query (Cache ล้างเมื่อมี Event การเปลี่ยนแปลงจาก realtime)
     """
-    return db.crud.get_booking_rounds_by_date(db_session, round_date=round_date, warehouse_code=warehouse_code)
-@router.get("/pending-confirmation", response_model=List[schemas.booking_round_schemas.BookingRound], summary="Get rounds waiting for dispatcher confirmation")
+    load_fieldset = round_view_fieldset(view, fieldset)
+    def build():
+        page = db.crud.get_booking_rounds_by_date(db_session, round_date=round_date, warehouse_code=warehouse_code, cursor=cursor, limit=limit,
+                                               fieldset=load_fieldset)
+        return round_list_response(db_session, response, page, view, fieldset)
+
+    key = ("by-date", round_date, warehouse_code, cursor, limit, view, fieldset)
+    return http_cache.BOOKING_ROUNDS.respond(request, key, build)
+@router.get("/pending-confirmation", response_model=ROUND_LIST_RESPONSE, summary="Get rounds waiting for dispatcher confirmation")
 def get_rounds_pending_dispatcher_confirmation(
-    db_session: Session = Depends(db.database.get_db),
-    current_user: models.SystemUser = Depends(security.get_current_active_user)
+    response: Response,
+    cursor: Optional[str] = CURSOR_QUERY,
+    limit: Optional[int] = LIMIT_QUERY,
+    view: str = VIEW_QUERY,
+    fieldset: Optional[frozenset] = Depends(round_fieldset),
+    db_session: Session = Depends(db.database.get_read_db),
+    current_user: models.SystemUser = Depends(security.get_current_active_user_read)
 ):
     """
     ดึงข้อมูลรอบทั้งหมดที่มี Shipment อยู่ในสถานะ '03' (Vendor Confirmed)
     """
     if current_user.role not in [models.UserRoleEnum.dispatcher, models.UserRoleEnum.admin]:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return crud.get_rounds_pending_confirmation(db_session)
+    page = crud.get_rounds_pending_confirmation(db_session, cursor=cursor, limit=limit, fieldset=round_view_fieldset(view, fieldset))
+    return round_list_response(db_session, response, page, view, fieldset)
 
 @router.get("/{round_id}", response_model=schemas.booking_round_schemas.BookingRound)
 def get_single_booking_round(
     round_id: int,
-    db_session: Session = Depends(db.database.get_db),
-    # current_user: models.SystemUser = Depends(security.get_current_active_user) # ถ้าต้องการ Auth
+    db_session: Session = Depends(db.database.get_read_db),
+    # current_user: models.SystemUser = Depends(security.get_current_active_user_read) # ถ้าต้องการ Auth
 ):
     """
     ดึงข้อมูลรอบการจองเดียวตาม ID พร้อมกับ Shipments ทั้งหมดในรอบนั้น
@@ -56,9 +108,9 @@ def get_single_booking_round(
         )
     return db_round
 @router.post("", response_model=schemas.booking_round_schemas.BookingRound, status_code=status.HTTP_201_CREATED)
-async def create_new_booking_round(
+def create_new_booking_round(
     round_in: schemas.booking_round_schemas.BookingRoundCreate,
-    current_user: db.models.SystemUser = Depends(security.get_current_active_user), # การสร้างรอบต้องใช้ Auth
+    current_user: db.models.SystemUser = Depends(security.get_current_active_user_sync), # การสร้างรอบต้องใช้ Auth
     db_session: Session = Depends(db.database.get_db)
 ):
     """
@@ -68,11 +120,15 @@ async def create_new_booking_round(
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
     # TODO: เพิ่ม Validation เช่น ไม่สามารถสร้างรอบซ้ำในวันและเวลาเดียวกันได้
-    return db.crud.create_booking_round(db=db_session, round_in=round_in, creator_id=current_user.username)
+    return transactions.run_with_retry(
+        db_session,
+        lambda: db.crud.create_booking_round(db=db_session, round_in=round_in, creator_id=current_user.username),
+        "create_booking_round"
+    )
 @router.post("/save-for-day", status_code=status.HTTP_200_OK)
-async def save_rounds_for_day(
+def save_rounds_for_day(
     request_body: schemas.booking_round_schemas.SaveDayRoundsRequest,
-    current_user: models.SystemUser = Depends(security.get_current_active_user),
+    current_user: models.SystemUser = Depends(security.get_current_active_user_sync),
     db_session: Session = Depends(db.database.get_db)
 ):
     """
@@ -82,9 +138,15 @@ async def save_rounds_for_day(
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
     try:
-        crud.save_day_rounds(db=db_session, request=request_body, creator_id=current_user.username)
+        transactions.run_with_retry(
+            db_session,
+            lambda: crud.save_day_rounds(db=db_session, request=request_body, creator_id=current_user.username),
+            "save_day_rounds"
+        )
         return {"message": "Booking rounds for the day have been saved successfully."}
     except Exception as e:
+        if transactions.is_retryable(e):
+            raise # ลองใหม่ครบแล้วยังติด Deadlock / Lock wait timeout: ให้ operational_error_handler ตอบ 503 + Retry-After
         raise HTTPException(status_code=500, detail=f"Failed to save rounds: {e}")
 @router.post("/{round_id}/assign-all", response_model=schemas.booking_round_schemas.BookingRound, summary="Assign all ready shipments to this round")
 def assign_all_to_round(
@@ -93,7 +155,7 @@ def assign_all_to_round(
     crdate: date = Query(..., description="The appointment date of the shipments to assign"),
     shippoint: str = Query(..., description="The shippoint of the shipments to assign"),
     db_session: Session = Depends(db.database.get_db),
-    current_user: models.SystemUser = Depends(security.get_current_active_user)
+    current_user: models.SystemUser = Depends(security.get_current_active_user_sync)
 ):
     """
     นำ Shipments ทั้งหมดที่พร้อม (Unassigned & Not on Hold)
@@ -103,23 +165,25 @@ def assign_all_to_round(
         raise HTTPException(status_code=403, detail="Not authorized")
 
     try:
-        updated_round = crud.assign_all_ready_shipments_to_round(
+        updated_round = transactions.run_with_retry(db_session, lambda: crud.assign_all_ready_shipments_to_round(
             db=db_session, 
             round_id=round_id, 
             crdate=crdate,
             shippoint=shippoint
-        )
+        ), "assign_all_ready_shipments_to_round")
         return updated_round
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
+        if transactions.is_retryable(e):
+            raise # ลองใหม่ครบแล้วยังติด Deadlock / Lock wait timeout: ให้ operational_error_handler ตอบ 503 + Retry-After
         raise HTTPException(status_code=500, detail=f"An internal error occurred: {e}")
 
 @router.post("/{round_id}/allocate", status_code=status.HTTP_200_OK, summary="Start allocation process for a booking round")
 def start_allocation_for_round(
     round_id: int,
     db_session: Session = Depends(db.database.get_db),
-    current_user: models.SystemUser = Depends(security.get_current_active_user)
+    current_user: models.SystemUser = Depends(security.get_current_active_user_sync)
 ):
     """
     เริ่มกระบวนการจัดสรรและจ่ายงานทั้งหมดในรอบที่ระบุ (สำหรับ Dispatcher)
@@ -131,7 +195,8 @@ def start_allocation_for_round(
 
     try:
         # 2. เรียกใช้ฟังก์ชัน CRUD หลักที่เราเคยสร้างไว้
-        crud.allocate_shipments_in_round(db=db_session, round_id=round_id)
+        # Deadlock / Lock wait timeout จะถูกลองใหม่ทั้งรอบ (ดู app/db/transactions.py)
+        transactions.run_with_retry(db_session, lambda: crud.allocate_shipments_in_round(db=db_session, round_id=round_id), "allocate")
         
         # 3. คืนค่า Response สำเร็จ
         return {"message": f"Allocation process for round {round_id} has been started successfully."}
@@ -140,6 +205,8 @@ def start_allocation_for_round(
         # ดักจับ Error ที่เรา raise ไว้ใน CRUD (เช่น Round not found)
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
+        if transactions.is_retryable(e):
+            raise # ลองใหม่ครบแล้วยังติด Deadlock / Lock wait timeout: ให้ operational_error_handler ตอบ 503 + Retry-After
         # ดักจับ Error อื่นๆ ที่ไม่คาดคิด
         print(f"CRITICAL: Allocation for round {round_id} failed: {e}")
         import traceback
@@ -151,7 +218,7 @@ def start_allocation_for_round(
 def confirm_round_assignments(
     round_id: int,
     db_session: Session = Depends(db.database.get_db),
-    current_user: models.SystemUser = Depends(security.get_current_active_user)
+    current_user: models.SystemUser = Depends(security.get_current_active_user_sync)
 ):
     """
     ยืนยันการจ่ายงานทั้งหมดในรอบนี้
@@ -162,14 +229,16 @@ def confirm_round_assignments(
         raise HTTPException(status_code=403, detail="Not authorized")
     
     try:
-        updated_round = crud.confirm_all_shipments_in_round(
+        updated_round = transactions.run_with_retry(db_session, lambda: crud.confirm_all_shipments_in_round(
             db=db_session, 
             round_id=round_id, 
             current_user_id=current_user.username
-        )
+        ), "confirm_all_shipments_in_round")
         return updated_round
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
+        if transactions.is_retryable(e):
+            raise # ลองใหม่ครบแล้วยังติด Deadlock / Lock wait timeout: ให้ operational_error_handler ตอบ 503 + Retry-After
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1,8 +1,9 @@
 # app/routers/master_data_router.py
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from sqlalchemy.orm import Session
 from typing import List
 
+from ..core import http_cache, serialization
 from ..db import crud, database
 # VVVVVV แก้ไขการ Import ที่นี่ VVVVVV
 from ..schemas import master_data_schemas, warehouse_schemas
@@ -11,21 +12,25 @@ from app import db
 from app import schemas # Import Submodules ที่ต้องการใช้
 
 router = APIRouter(
-    tags=["Master Data"]
+    tags=["Master Data"],
+    route_class=serialization.NegotiatingRoute # รองรับ Accept: application/msgpack
 )
 
+# Master Data ตอบผ่าน http_cache.MASTER_DATA: มี ETag / Cache-Control และ If-None-Match ที่ตรงได้ 304 โดยไม่ Query
 @router.get("/warehouses", response_model=List[warehouse_schemas.Warehouse]) # <<--- อ้างอิงผ่าน Submodule ที่ Import มา
-async def get_all_warehouses(db_session: Session = Depends(database.get_db)):
-    return crud.get_warehouses(db_session)
+def get_all_warehouses(request: Request, db_session: Session = Depends(database.get_read_db)):
+    return http_cache.MASTER_DATA.respond(request, "warehouses", lambda: serialization.list_response(
+        serialization.WAREHOUSE_LIST, crud.get_warehouses(db_session)))
 
 # ตัวอย่างสำหรับ Route อื่นในไฟล์เดียวกัน
 @router.get("/doc-statuses", response_model=List[master_data_schemas.ControlCode])
-async def get_document_statuses(db_session: Session = Depends(database.get_db)):
-    return crud.get_control_codes_by_key(db_session, key='DOCST')
+def get_document_statuses(request: Request, db_session: Session = Depends(database.get_read_db)):
+    return http_cache.MASTER_DATA.respond(request, "doc-statuses", lambda: serialization.list_response(
+        serialization.CONTROL_CODE_LIST, crud.get_control_codes_by_key(db_session, key='DOCST')))
 @router.get("/booking-rounds", response_model=List[schemas.master_data_schemas.MasterBookingRound])
-async def get_master_rounds(db_session: Session = Depends(db.database.get_db)):
+def get_master_rounds(request: Request, db_session: Session = Depends(db.database.get_read_db)):
     """
     ดึงข้อมูล Master สำหรับรอบเวลาทั้งหมดที่ Active อยู่
     """
-    return db.crud.get_master_booking_rounds(db_session)
-
+    return http_cache.MASTER_DATA.respond(request, "booking-rounds", lambda: serialization.list_response(
+        serialization.MASTER_BOOKING_ROUND_LIST, db.crud.get_master_booking_rounds(db_session)))
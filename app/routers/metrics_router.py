@@ -0,0 +1,32 @@
+# app/routers/metrics_router.py
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from ..core.security import get_current_active_user
+from ..db import models, pool_metrics, transactions
+
+router = APIRouter(
+    tags=["Metrics"]
+)
+
+@router.get("/db-pool", summary="Connection pool statistics of this API process")
+def read_db_pool_metrics(current_user: models.SystemUser = Depends(get_current_active_user)):
+    """
+    สถิติ Connection Pool ของ Process นี้ (สะสมตั้งแต่ Start) สำหรับ Admin ใช้ปรับ DB_POOL_SIZE / DB_MAX_OVERFLOW
+    - wait_max_ms สูง หรือ timeouts > 0: Pool เล็กเกินไป
+    - invalidations เพิ่มเรื่อย ๆ: Connection ถูก MySQL ตัด (ตรวจ DB_POOL_RECYCLE เทียบ wait_timeout)
+    """
+    if current_user.role != models.UserRoleEnum.admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return pool_metrics.snapshot()
+
+
+@router.get("/db-retries", summary="Deadlock / lock wait timeout retries of this API process")
+def read_db_retry_metrics(current_user: models.SystemUser = Depends(get_current_active_user)):
+    """
+    จำนวนครั้งที่ Transaction ถูกลองใหม่เพราะ Deadlock (1213) / Lock wait timeout (1205) แยกตาม Endpoint/งาน
+    - retries: ลองใหม่แล้วผ่าน (หรือยังลองต่อ) ตามรหัส Error
+    - exhausted: ลองครบ TX_RETRY_ATTEMPTS แล้วยังไม่ผ่าน (Client ได้ Error)
+    """
+    if current_user.role != models.UserRoleEnum.admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return transactions.snapshot()
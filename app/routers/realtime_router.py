@@ -0,0 +1,80 @@
+# app/routers/realtime_router.py
+import asyncio
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+
+from ..core import realtime, security
+from ..db import models
+from ..db.database import SessionLocal
+
+router = APIRouter(
+    tags=["Realtime"]
+)
+
+HEARTBEAT_SECONDS = 30
+
+def _resolve_subscriber(token: str) -> Optional[dict]:
+    """ตรวจ Token แล้วคืนข้อมูลที่ใช้กรอง Event (role, grade, vencode)"""
+    db = SessionLocal()
+    try:
+        user = security.get_user_from_token(db, token)
+    except HTTPException:
+        return None
+    finally:
+        db.close()
+    grade = user.vendor_details.grade if user.vendor_details else None
+    return {"role": user.role, "grade": grade, "vencode": user.vencode_ref}
+
+@router.websocket("/shipments")
+async def shipment_updates(
+    websocket: WebSocket,
+    token: Optional[str] = Query(None, description="JWT (Browser/Flutter ส่ง Header ตอน Upgrade ไม่ได้)")
+):
+    """
+    ส่ง Event การเปลี่ยนสถานะ Shipment แบบ Real-time แทนการ Poll
+    - Dispatcher/Admin: ได้ทุก Event
+    - Vendor: เฉพาะงานที่เข้ามาหรือออกจากรายการของตัวเอง (ตาม grade/vencode)
+    """
+    if not token:
+        auth_header = websocket.headers.get("authorization", "")
+        if auth_header.lower().startswith("bearer "):
+            token = auth_header[7:]
+    subscriber = await run_in_threadpool(_resolve_subscriber, token) if token else None
+    if subscriber is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    if subscriber["role"] == models.UserRoleEnum.vendor and not subscriber["vencode"]:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    subscription = realtime.broker.subscribe(**subscriber)
+
+    async def _drain_client():
+        # อ่านข้อความจาก Client ทิ้ง เพื่อให้รู้ตัวเมื่อ Client ตัดการเชื่อมต่อ
+        try:
+            while True:
+                await websocket.receive_text()
+        except (WebSocketDisconnect, RuntimeError):
+            return
+
+    receiver = asyncio.create_task(_drain_client())
+    try:
+        while True:
+            getter = asyncio.create_task(subscription.queue.get())
+            done, _ = await asyncio.wait({getter, receiver}, timeout=HEARTBEAT_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                getter.cancel()
+                break
+            if getter in done:
+                await websocket.send_json(getter.result())
+            else:
+                getter.cancel()
+                await websocket.send_json({"type": "ping"})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        receiver.cancel()
+        realtime.broker.unsubscribe(subscription)
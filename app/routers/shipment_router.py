@@ -1,20 +1,28 @@
 # app/routers/shipment_router.py
-from fastapi import APIRouter, Depends, HTTPException, Query, status, Request
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 from sqlalchemy import func, null
 from typing import List, Optional
-from datetime import date, datetime, timezone
+from datetime import date, datetime, timedelta, timezone
 
-from ..schemas import shipment_schemas
-from ..db import crud, models
-from ..core.security import get_current_active_user
-from ..core import firebase_service
-from ..db.database import get_db
+from ..schemas import shipment_schemas, shipment_event_schemas
+from ..db import async_crud, crud, event_log, load_profiles, models, pagination, transactions
+from ..core.config import settings
+from ..core.security import (
+    get_current_active_user_async_read, get_current_active_user_read, get_current_active_user_sync,
+)
+from ..core import fieldsets, firebase_service, idempotency, realtime, serialization
+from ..db.database import async_read_session_factory, get_async_read_db, get_db, get_read_db
 
 router = APIRouter(
     tags=["Shipments"],
-    dependencies=[Depends(get_current_active_user)] # ป้องกันทุก Route ใน Router นี้ด้วย Authentication
+    route_class=serialization.NegotiatingRoute, # รองรับ Accept: application/msgpack
+    # ทุก Route ต้องมี Dependency ของ Auth เอง (เลือกตาม Session ที่ใช้ ดู app/core/security.py)
+    # ไม่ใส่ระดับ Router เพราะจะยืม Connection แยกอีกหนึ่งอันต่อ Request
 )
 
 # ลำดับการ Assign งานให้เกรดต่างๆ (สามารถย้ายไป Config ได้)
@@ -24,9 +32,57 @@ GRADE_ASSIGNMENT_ORDER = ['A', 'B', 'C', 'D']
 def get_dispatcher_and_admin_roles():
     return [models.UserRoleEnum.dispatcher, models.UserRoleEnum.admin]
 
+# Query Parameters ของ Endpoint ที่แบ่งหน้า (ใช้ร่วมกับ user_router / booking_round_router)
+CURSOR_QUERY = Query(None, description="next_cursor จากหน้าก่อน (ไม่ส่ง = หน้าแรก)")
+LIMIT_QUERY = Query(None, ge=1, le=settings.PAGE_SIZE_MAX, description="จำนวนรายการต่อหน้า (ไม่ส่ง = PAGE_SIZE_DEFAULT หน้าถัดไปดูจาก X-Has-More / X-Next-Cursor)")
+
+# Sparse Fieldset (app/core/fieldsets.py) ของ Endpoint รายการ Shipment / Booking Round
+FIELDS_QUERY = Query(None, description="Field ที่ต้องการ คั่นด้วย , เช่น shipid,docstat,apmdate (ไม่ส่ง = ทุก Field)")
+INCLUDE_QUERY = Query(None, description="Object/รายการซ้อนที่ต้องการ คั่นด้วย , เช่น details,mvendor")
+
+def shipment_fieldset(fields: Optional[str] = FIELDS_QUERY, include: Optional[str] = INCLUDE_QUERY) -> Optional[frozenset]:
+    """Dependency: ?fields=&include= -> ชุด Key ของ shipment_schemas.Shipment ที่จะตอบ (None = ทุก Field)"""
+    try:
+        return fieldsets.parse(shipment_schemas.Shipment, fields, include, required=("shipid",))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+def set_page_headers(response: Response, page: pagination.Page) -> list:
+    """
+    ส่งข้อมูลการแบ่งหน้าทาง Header (X-Page-Limit, X-Has-More, X-Next-Cursor)
+    Body ยังเป็น List เหมือนเดิม Client เดิมจึงไม่ต้องแก้
+    """
+    response.headers["X-Page-Limit"] = str(page.limit)
+    response.headers["X-Has-More"] = "true" if page.has_more else "false"
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return page.items
+
+def past_shipment_filters(request: Request, current_user: models.SystemUser):
+    """
+    (vencode, filters) ของประวัติงาน (/my-history, /export)
+    - Vendor: เฉพาะงานของตัวเอง
+    - Admin/Dispatcher: ทุก Vendor และ Filter ได้จาก Query Params (shipid, route, apmdate_from, apmdate_to)
+    """
+    if current_user.role == models.UserRoleEnum.vendor:
+        if not current_user.vencode_ref:
+            raise HTTPException(status_code=403, detail="Vendor has no vencode assigned")
+        return current_user.vencode_ref, {}
+    if current_user.role in get_dispatcher_and_admin_roles():
+        filters = {
+            "shipid": request.query_params.get("shipid"),
+            "route": request.query_params.get("route"),
+            "apmdate_from": request.query_params.get("apmdate_from"),
+            "apmdate_to": request.query_params.get("apmdate_to"),
+        }
+        # กรองเอาเฉพาะ filter ที่มีค่า
+        return None, {k: v for k, v in filters.items() if v}
+    return None, {}
+
 # Pydantic Model สำหรับ Body ของ Hold Action (ใช้เฉพาะในไฟล์นี้)
 class HoldActionBody(BaseModel):
     hold: bool
+    row_version: Optional[int] = None # row_version ที่ Client เห็นล่าสุด (ไม่บังคับ)
 
 # ===================================================================
 # Specific GET Routes (ต้องอยู่ก่อน Dynamic Routes เช่น /{shipid})
@@ -34,21 +90,31 @@ class HoldActionBody(BaseModel):
 
 @router.get("/unassigned", response_model=List[shipment_schemas.Shipment])
 async def read_unassigned_shipments(
+    response: Response,
     crdate: date = Query(..., description="create date to filter (YYYY-MM-DD)"),
     shippoint: str = Query(..., description="Shippoint/Warehouse code to filter"),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = CURSOR_QUERY,
+    limit: Optional[int] = LIMIT_QUERY,
+    fieldset: Optional[frozenset] = Depends(shipment_fieldset),
+    current_user: models.SystemUser = Depends(get_current_active_user_async_read),
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     ดึงรายการ Shipments ที่ยังไม่ถูกจัดสรรเข้ารอบ และไม่ได้ถูก Hold
     """
     filters = {"crdate": crdate, "shippoint": shippoint}
-    return crud.get_unassigned_shipments(db, filters=filters)
+    page = await async_crud.get_unassigned_shipments(db, filters=filters, cursor=cursor, limit=limit, fieldset=fieldset)
+    return serialization.list_response(serialization.SHIPMENT_LIST.subset(fieldset), set_page_headers(response, page), response)
 
 @router.get("/held", response_model=List[shipment_schemas.Shipment])
 async def read_held_shipments(
     request: Request,
-    current_user: models.SystemUser = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    response: Response,
+    cursor: Optional[str] = CURSOR_QUERY,
+    limit: Optional[int] = LIMIT_QUERY,
+    fieldset: Optional[frozenset] = Depends(shipment_fieldset),
+    current_user: models.SystemUser = Depends(get_current_active_user_async_read),
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     ดึงรายการ Shipments ที่ถูก Hold (สำหรับ Dispatcher)
@@ -58,11 +124,13 @@ async def read_held_shipments(
     
     filters = { "shippoint": request.query_params.get("shippoint") }
     active_filters = {k: v for k, v in filters.items() if v is not None}
-    return crud.get_held_shipments(db, filters=active_filters)
+    page = await async_crud.get_held_shipments(db, filters=active_filters, cursor=cursor, limit=limit, fieldset=fieldset)
+    return serialization.list_response(serialization.SHIPMENT_LIST.subset(fieldset), set_page_headers(response, page), response)
 @router.get("/my-orders", response_model=List[shipment_schemas.Shipment], summary="Get ongoing orders for user's role")
 async def get_my_ongoing_orders(
-    current_user: models.SystemUser = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    fieldset: Optional[frozenset] = Depends(shipment_fieldset),
+    current_user: models.SystemUser = Depends(get_current_active_user_async_read),
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     - Vendor: ดึงงานที่กำลังทำของตัวเอง
@@ -76,37 +144,125 @@ async def get_my_ongoing_orders(
             raise HTTPException(status_code=403, detail="Vendor has no vencode assigned")
         vencode_to_filter = current_user.vencode_ref
 
-    return crud.get_ongoing_shipments(db, vencode=vencode_to_filter)
+    shipments = await async_crud.get_ongoing_shipments(db, vencode=vencode_to_filter, fieldset=fieldset)
+    return serialization.list_response(serialization.SHIPMENT_LIST.subset(fieldset), shipments)
 @router.get("/my-history", response_model=List[shipment_schemas.Shipment], summary="Get past orders for user's role")
 async def get_my_past_orders(
     request: Request, # <-- เพิ่ม request
-    current_user: models.SystemUser = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    response: Response,
+    cursor: Optional[str] = CURSOR_QUERY,
+    limit: Optional[int] = LIMIT_QUERY,
+    fieldset: Optional[frozenset] = Depends(shipment_fieldset),
+    current_user: models.SystemUser = Depends(get_current_active_user_async_read),
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     - Vendor: ดึงประวัติงานของตัวเอง
     - Admin/Dispatcher: ดึงประวัติงานทั้งหมดของทุก Vendor และ Filter ได้
     """
+    vencode_to_filter, filters = past_shipment_filters(request, current_user)
+    page = await async_crud.get_past_shipments(db, vencode=vencode_to_filter, filters=filters, cursor=cursor, limit=limit, fieldset=fieldset)
+    return serialization.list_response(serialization.SHIPMENT_LIST.subset(fieldset), set_page_headers(response, page), response)
+@router.get("/search", response_model=List[shipment_schemas.Shipment], summary="Search shipments by shipid, customer or delivery order")
+async def search_shipments(
+    response: Response,
+    q: str = Query(..., min_length=2, max_length=100, description="shipid, ชื่อลูกค้า, เลข DO หรือชื่อลูกค้าใน DO (บางส่วนก็ได้) ทุกคำต้องยาวอย่างน้อย 2 ตัวอักษร ไม่เช่นนั้นได้ 400"),
+    cursor: Optional[str] = CURSOR_QUERY,
+    limit: Optional[int] = LIMIT_QUERY,
+    fieldset: Optional[frozenset] = Depends(shipment_fieldset),
+    current_user: models.SystemUser = Depends(get_current_active_user_async_read),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    ค้นหา Shipment ทุกสถานะด้วย FULLTEXT Index (ดู async_crud.search_shipments_stmt) เรียงตาม apmdate ล่าสุดก่อน
+    - Vendor: เฉพาะงานของตัวเอง
+    - Admin/Dispatcher: ทุกงาน
+    """
     vencode_to_filter = None
-    filters = {}
-
     if current_user.role == models.UserRoleEnum.vendor:
         if not current_user.vencode_ref:
             raise HTTPException(status_code=403, detail="Vendor has no vencode assigned")
         vencode_to_filter = current_user.vencode_ref
-    
-    # ถ้าเป็น Admin/Dispatcher ให้ดึง Filter จาก query params
-    elif current_user.role in get_dispatcher_and_admin_roles():
-        filters = {
-            "shipid": request.query_params.get("shipid"),
-            "route": request.query_params.get("route"),
-            "apmdate_from": request.query_params.get("apmdate_from"),
-            "apmdate_to": request.query_params.get("apmdate_to"),
-        }
-        # กรองเอาเฉพาะ filter ที่มีค่า
-        filters = {k: v for k, v in filters.items() if v}
-        
-    return crud.get_past_shipments(db, vencode=vencode_to_filter, filters=filters)
+    elif current_user.role not in get_dispatcher_and_admin_roles():
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    try:
+        page = await async_crud.search_shipments(db, q, vencode=vencode_to_filter, cursor=cursor, limit=limit, fieldset=fieldset)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return serialization.list_response(serialization.SHIPMENT_LIST.subset(fieldset), set_page_headers(response, page), response)
+@router.get("/export", summary="Stream past orders as NDJSON or CSV")
+async def export_past_orders(
+    request: Request,
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$", description="ndjson หรือ csv"),
+    current_user: models.SystemUser = Depends(get_current_active_user_async_read)
+):
+    """
+    ส่งออกประวัติงานทั้งหมด (Filter และสิทธิ์เดียวกับ /my-history) โดยไม่แบ่งหน้า
+    ทยอยส่งทีละ EXPORT_BATCH_SIZE แถวจาก Server-side Cursor: เริ่มส่งข้อมูลได้ทันทีและใช้หน่วยความจำคงที่
+    """
+    vencode_to_filter, filters = past_shipment_filters(request, current_user)
+    encoder = serialization.SHIPMENT_EXPORT[export_format]
+    # เปิด Session เองใน Generator: Session จาก Dependency (yield) ถูกปิดก่อน StreamingResponse ส่ง Body เสร็จ
+    session_factory = async_read_session_factory(request)
+
+    async def body():
+        yield encoder.header()
+        async with session_factory() as db:
+            async for rows in async_crud.stream_past_shipments(db, vencode=vencode_to_filter, filters=filters,
+                                                               batch_size=settings.EXPORT_BATCH_SIZE):
+                yield encoder.encode(rows)
+
+    filename = f"shipments-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{export_format}"
+    return StreamingResponse(body(), media_type=encoder.media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+@router.get("/changes", response_model=shipment_schemas.ShipmentChanges, summary="Delta-sync: shipments changed since a version")
+def read_shipment_changes(
+    since: int = Query(0, ge=0, description="high_water_mark จากการเรียกครั้งก่อน (0 = ดึงทั้งหมด)"),
+    cursor: Optional[str] = CURSOR_QUERY,
+    limit: Optional[int] = LIMIT_QUERY,
+    current_user: models.SystemUser = Depends(get_current_active_user_sync),
+    db: Session = Depends(get_db)
+):
+    """
+    คืนเฉพาะ Shipments ที่เปลี่ยนแปลงหลัง since พร้อม high_water_mark ใหม่ (ทีละหน้า ดู has_more / next_cursor)
+    - Vendor: งานที่เคยอยู่ในรายการของตนแล้วหลุดออกไป (ถูกคนอื่นรับ/ถูกปฏิเสธ) จะมาเป็น tombstones
+    """
+    if current_user.role in get_dispatcher_and_admin_roles():
+        page, changes, tombstones, high_water_mark = crud.get_shipment_changes(db, since=since, cursor=cursor, limit=limit)
+    elif current_user.role == models.UserRoleEnum.vendor and current_user.vendor_details and current_user.vendor_details.grade:
+        page, changes, tombstones, high_water_mark = crud.get_shipment_changes(
+            db,
+            since=since,
+            grade=current_user.vendor_details.grade,
+            vencode=current_user.vencode_ref,
+            cursor=cursor,
+            limit=limit
+        )
+    else:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    return {"since": since, "high_water_mark": high_water_mark, "changes": changes, "tombstones": tombstones,
+            "has_more": page.has_more, "next_cursor": page.next_cursor}
+@router.get("/events", response_model=List[shipment_event_schemas.ShipmentEvent], summary="Scan shipment events in a time range")
+def read_shipment_events(
+    start: datetime = Query(..., description="เริ่ม (รวม) เช่น 2025-07-01T00:00:00"),
+    end: Optional[datetime] = Query(None, description="สิ้นสุด (ไม่รวม) ค่าเริ่มต้น = start + 1 วัน"),
+    event_type: Optional[str] = Query(None),
+    vencode: Optional[str] = Query(None),
+    limit: int = Query(1000, ge=1, le=10000),
+    current_user: models.SystemUser = Depends(get_current_active_user_read),
+    db: Session = Depends(get_read_db)
+):
+    """
+    ดึงประวัติการเปลี่ยนสถานะของทุก Shipment ในช่วงเวลา (สำหรับ Dispatcher/Admin)
+    """
+    if current_user.role not in get_dispatcher_and_admin_roles():
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    if end is None:
+        end = start + timedelta(days=1)
+    filters = {"event_type": event_type, "vencode": vencode}
+    return crud.get_shipment_events(db, start=start, end=end, filters=filters, limit=limit)
 # ===================================================================
 # General GET and Dynamic GET Routes
 # ===================================================================
@@ -114,8 +270,12 @@ async def get_my_past_orders(
 @router.get("/", response_model=List[shipment_schemas.Shipment])
 async def read_shipments(
     request: Request,
-    current_user: models.SystemUser = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    response: Response,
+    cursor: Optional[str] = CURSOR_QUERY,
+    limit: Optional[int] = LIMIT_QUERY,
+    fieldset: Optional[frozenset] = Depends(shipment_fieldset),
+    current_user: models.SystemUser = Depends(get_current_active_user_async_read),
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     ดึงรายการ Shipments
@@ -131,37 +291,56 @@ async def read_shipments(
             "is_on_hold": request.query_params.get("is_on_hold"),
         }
         active_filters = {k: v for k, v in filters.items() if v is not None}
-        return crud.get_shipments(db, filters=active_filters)
+        page = await async_crud.get_shipments(db, filters=active_filters, cursor=cursor, limit=limit, fieldset=fieldset)
+        return serialization.list_response(serialization.SHIPMENT_LIST.subset(fieldset), set_page_headers(response, page), response)
     elif current_user.role == models.UserRoleEnum.vendor and current_user.vendor_details and current_user.vendor_details.grade:
-        return crud.get_shipments_for_vendor(
+        page = await async_crud.get_shipments_for_vendor(
             db, 
             grade=current_user.vendor_details.grade ,
-            vencode=current_user.vencode_ref
+            vencode=current_user.vencode_ref,
+            cursor=cursor,
+            limit=limit,
+            fieldset=fieldset
             )
+        return serialization.list_response(serialization.SHIPMENT_LIST.subset(fieldset), set_page_headers(response, page), response)
     else:
         return []
 
 @router.get("/{shipid}", response_model=shipment_schemas.Shipment)
 async def read_single_shipment(
     shipid: str,
-    db: Session = Depends(get_db)
+    current_user: models.SystemUser = Depends(get_current_active_user_async_read),
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     ดึงข้อมูล Shipment เดียวตาม shipid
     """
-    db_shipment = crud.get_shipment_by_id(db, shipid=shipid)
+    db_shipment = await async_crud.get_shipment_by_id(db, shipid=shipid)
     if not db_shipment:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Shipment with ID '{shipid}' not found")
     return db_shipment
 
+@router.get("/{shipid}/events", response_model=List[shipment_event_schemas.ShipmentEvent], summary="Timeline of a shipment")
+def read_shipment_timeline(
+    shipid: str,
+    current_user: models.SystemUser = Depends(get_current_active_user_read),
+    db: Session = Depends(get_read_db)
+):
+    """
+    ประวัติของ Shipment: ถูกเสนอให้ใคร เมื่อไร, ใครปฏิเสธ/รับงาน (สำหรับ Dispatcher/Admin)
+    """
+    if current_user.role not in get_dispatcher_and_admin_roles():
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return crud.get_shipment_timeline(db, shipid=shipid)
+
 # ===================================================================
 # POST Routes (Actions)
 # ===================================================================
 
 @router.post("/", response_model=shipment_schemas.Shipment, status_code=status.HTTP_201_CREATED)
-async def create_new_shipment(
+def create_new_shipment(
     shipment_in: shipment_schemas.ShipmentCreate,
-    current_user: models.SystemUser = Depends(get_current_active_user),
+    current_user: models.SystemUser = Depends(get_current_active_user_sync),
     db: Session = Depends(get_db)
 ):
     """
@@ -170,54 +349,66 @@ async def create_new_shipment(
     if current_user.role not in get_dispatcher_and_admin_roles():
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions to create a shipment")
 
-    existing_shipment = crud.get_shipment_by_id(db, shipid=shipment_in.shipid)
+    existing_shipment = crud.get_shipment_by_id(db, shipid=shipment_in.shipid, options=load_profiles.SHIPMENT_WRITE)
     if existing_shipment:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Shipment with ID '{shipment_in.shipid}' already exists.")
 
     return crud.create_shipment(db=db, shipment=shipment_in, creator_user_id=current_user.username)
 
 @router.post("/request-booking", response_model=shipment_schemas.Shipment, summary="Send shipment to the first vendor grade")
-async def request_booking(
+def request_booking(
     action: shipment_schemas.ShipmentAction,
-    current_user: models.SystemUser = Depends(get_current_active_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=100),
+    current_user: models.SystemUser = Depends(get_current_active_user_sync),
     db: Session = Depends(get_db)
 ):
     """
     ส่ง Shipment ไปให้ Vendor เกรดแรกพิจารณา (สำหรับ Dispatcher)
     """
+    return idempotency.run_idempotent(
+        db, idempotency_key, current_user.username, "request-booking", action,
+        lambda: _request_booking(action, current_user, db), shipment_schemas.Shipment
+    )
+
+def _request_booking(action: shipment_schemas.ShipmentAction, current_user: models.SystemUser, db: Session):
     if current_user.role not in get_dispatcher_and_admin_roles():
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only dispatchers can request booking")
 
-    db_shipment = crud.get_shipment_by_id(db, shipid=action.shipid)
+    db_shipment = crud.get_shipment_by_id(db, shipid=action.shipid, options=load_profiles.SHIPMENT_WRITE)
     if not db_shipment:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Shipment not found")
+    crud.ensure_expected_version(db_shipment, action.row_version)
 
     if db_shipment.docstat not in [ '06', 'RJ']: #  06=ยกเลิก, RJ=ถูกปฏิเสธทั้งหมด
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Shipment with status '{db_shipment.docstat}' cannot be booked.")
 
     first_grade_in_order = GRADE_ASSIGNMENT_ORDER[0]
+    before = realtime.snapshot(db_shipment)
     db_shipment.docstat = '02' # 'รอ Vendor ยืนยัน'
     db_shipment.current_grade_to_assign = first_grade_in_order
     db_shipment.assigned_at = datetime.now(timezone.utc)
     db_shipment.chuser = current_user.username
     db_shipment.chdate = datetime.now(timezone.utc)
     db.commit()
-    db.refresh(db_shipment)
+    db_shipment = crud.reload_shipment(db, db_shipment.shipid)
+    realtime.publish_shipment_change(db_shipment, before)
+    event_log.record("offered", db_shipment, before, actor=current_user.username)
 
     # Trigger Notification to Grade A vendors
     vendors_to_notify = crud.get_users_by_grade(db, grade=first_grade_in_order)
     for vendor in vendors_to_notify:
         if vendor.fcm_token:
-            firebase_service.send_fcm_notification(
+            firebase_service.queue_fcm_notification(
                 token=vendor.fcm_token,
                 title="มีงานใหม่สำหรับคุณ!",
-                body=f"Shipment ID: {db_shipment.shipid} รอการยืนยัน"
+                body=f"Shipment ID: {db_shipment.shipid} รอการยืนยัน",
+                shipment_id=db_shipment.shipid
             )
     return db_shipment
 @router.post("/{round_id}/allocate", status_code=status.HTTP_200_OK, summary="Start allocation process for a booking round")
 def start_allocation_for_round(
     round_id: int,
-    current_user: models.SystemUser = Depends(get_current_active_user),
+    current_user: models.SystemUser = Depends(get_current_active_user_sync),
     db_session: Session = Depends(get_db)
 ):
     """
@@ -228,63 +419,66 @@ def start_allocation_for_round(
 
     try:
         # เรียกใช้ Logic หลักของเรา
-        crud.allocate_shipments_in_round(db=db_session, round_id=round_id)
+        transactions.run_with_retry(db_session, lambda: crud.allocate_shipments_in_round(db=db_session, round_id=round_id), "allocate")
         return {"message": f"Allocation process for round {round_id} has been started."}
     except Exception as e:
+        if transactions.is_retryable(e):
+            raise # ลองใหม่ครบแล้วยังติด Deadlock / Lock wait timeout: ให้ operational_error_handler ตอบ 503 + Retry-After
         # ควรมี Logging ที่ดีกว่านี้ใน Production
         print(f"CRITICAL: Allocation for round {round_id} failed: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to allocate shipments: {e}")
 # ในไฟล์ app/routers/shipment_router.py
 
 @router.post("/confirm", response_model=shipment_schemas.Shipment, summary="Vendor confirms a booking")
-async def confirm_shipment(
+def confirm_shipment(
     action: shipment_schemas.ConfirmShipment,
-    current_user: models.SystemUser = Depends(get_current_active_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=100),
+    current_user: models.SystemUser = Depends(get_current_active_user_sync),
     db: Session = Depends(get_db)
 ):
     """
     ยืนยันการรับงาน (สำหรับ Vendor)
     รองรับทั้งงานปกติ (02) และงานเปิด (BC)
-    ใช้ Transaction Lock เพื่อป้องกัน Race Condition
+    รับงานด้วย Conditional UPDATE คำสั่งเดียว (First-come-first-served) ใครยืนยันงานเดียวกันทีหลังจะได้ 409 ทันที
     """
+    return idempotency.run_idempotent(
+        db, idempotency_key, current_user.username, "confirm", action,
+        lambda: _confirm_shipment(action, current_user, db), shipment_schemas.Shipment
+    )
+
+def _confirm_shipment(action: shipment_schemas.ConfirmShipment, current_user: models.SystemUser, db: Session):
     if not (current_user.role == models.UserRoleEnum.vendor and current_user.vencode_ref and current_user.vendor_details):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only vendors can confirm shipments")
-    
+    grade = current_user.vendor_details.grade
+    not_available = HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Job is no longer available or not assigned to you.")
+
+    # อ่านแบบไม่ Lock: ใช้ทำ realtime snapshot และตัดคนที่มาช้ากว่าคนที่ commit ไปแล้วออกทันที
+    db_shipment = crud.get_shipment_by_id(db, shipid=action.shipid, options=load_profiles.SHIPMENT_WRITE)
+    if not db_shipment:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Shipment not found")
+    # 1. งานถูกส่งให้เกรดเราโดยตรง  2. เป็นงานเปิด (Broadcast) และยังไม่มีใครรับ
+    if not ((db_shipment.docstat == '02' and db_shipment.current_grade_to_assign == grade) or db_shipment.docstat == 'BC'):
+        raise not_available
+    before = realtime.snapshot(db_shipment)
+
     # --- เริ่ม Transaction ---
     try:
-        # ดึงข้อมูล Shipment พร้อม Lock แถว
-        db_shipment = crud.get_shipment_for_update(db, shipid=action.shipid)
-
-        if not db_shipment:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Shipment not found")
-
-        # ตรวจสอบเงื่อนไขการรับงาน
-        can_confirm = False
-        # 1. งานถูกส่งให้เกรดเราโดยตรง
-        if db_shipment.docstat == '02' and db_shipment.current_grade_to_assign == current_user.vendor_details.grade:
-            can_confirm = True
-        # 2. เป็นงานเปิด (Broadcast) และยังไม่มีใครรับ
-        elif db_shipment.docstat == 'BC':
-            can_confirm = True
-
-        if not can_confirm:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Job is no longer available or not assigned to you.")
-
-        # ตรวจสอบรถ (Logic เดิม)
-
-        # --- อัปเดตข้อมูล Shipment ---
-        db_shipment.docstat = '03'  # Vendor ยืนยันแล้ว
-        db_shipment.vencode = current_user.vencode_ref
-        db_shipment.confirmed_by_grade = current_user.vendor_details.grade
-        db_shipment.carlicense = action.carlicense
-        db_shipment.carnote = action.carnote
-        db_shipment.current_grade_to_assign = None # ล้างค่า grade ที่เคย assign
-        db_shipment.assigned_at = None # ล้างเวลา
-        db_shipment.chuser = current_user.username
-        db_shipment.chdate = datetime.now(timezone.utc)
-        
+        # ตัดสินผู้ชนะด้วย Conditional UPDATE (ดู crud.claim_shipment) คนที่แพ้ rollback ทันทีโดยไม่ได้ถือ Lock ใดๆ
+        if not crud.claim_shipment(
+            db,
+            shipid=action.shipid,
+            vencode=current_user.vencode_ref,
+            grade=grade,
+            carlicense=action.carlicense,
+            carnote=action.carnote,
+            username=current_user.username,
+            expected_version=action.row_version
+        ):
+            raise not_available
+
         # สร้าง Car Assignment (ถ้ามี)
         # crud.create_car_assignment(db, shipment=db_shipment)
+        db_shipment = crud.reload_shipment(db, action.shipid, options=load_profiles.SHIPMENT_WRITE)
         updated_car = crud.assign_job_to_car(db, shipment=db_shipment)
 
         if not updated_car:
@@ -292,56 +486,126 @@ async def confirm_shipment(
             # เราต้อง rollback transaction ทั้งหมด
             raise HTTPException(status_code=500, detail="Failed to update car availability. Check server logs or required shipment data.")
         db.commit()
-        db.refresh(db_shipment)
+        db_shipment = crud.reload_shipment(db, db_shipment.shipid)
 
     except Exception as e:
         db.rollback()
         if isinstance(e, HTTPException):
             raise e
+        if isinstance(e, StaleDataError):
+            raise not_available
+        if transactions.is_retryable(e):
+            raise e # Deadlock / Lock wait timeout: ให้ run_idempotent ลองใหม่ทั้ง Transaction
         # ถ้าเป็น Error อื่นๆ
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An internal error occurred: {str(e)}")
     
     # --- สิ้นสุด Transaction ---
+    realtime.publish_shipment_change(db_shipment, before)
+    event_log.record("confirmed", db_shipment, before, actor=current_user.username, carlicense=action.carlicense)
 
     # Trigger notification to dispatchers (Logic เดิม)
     dispatchers = crud.get_all_dispatchers(db)
     for dispatcher in dispatchers:
         if dispatcher.fcm_token:
-            firebase_service.send_fcm_notification(
+            firebase_service.queue_fcm_notification(
                 token=dispatcher.fcm_token,
                 title=f"Vendor ยืนยันงานแล้ว (Grade {current_user.vendor_details.grade})",
-                body=f"Shipment '{db_shipment.shipid}' ถูกยืนยันโดย {current_user.display_name}"
+                body=f"Shipment '{db_shipment.shipid}' ถูกยืนยันโดย {current_user.display_name}",
+                shipment_id=db_shipment.shipid
             )
             
     return db_shipment
+@router.post("/confirm-batch", response_model=shipment_schemas.ConfirmBatchResult, summary="Vendor confirms several bookings at once")
+def confirm_shipment_batch(
+    batch: shipment_schemas.ConfirmShipmentBatch,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=100),
+    current_user: models.SystemUser = Depends(get_current_active_user_sync),
+    db: Session = Depends(get_db)
+):
+    """
+    ยืนยันการรับหลายงานในครั้งเดียว (สำหรับ Vendor) แทนการเรียก /confirm ทีละงาน
+    ทั้งชุดอยู่ใน Transaction เดียว (ดู crud.confirm_shipments_batch) รายการที่รับไม่ได้ไม่ทำให้รายการอื่นล้มเหลว
+    ผลลัพธ์แยกรายรายการ และแจ้ง Dispatcher เป็นข้อความสรุปข้อความเดียวต่อคน
+    """
+    if len(batch.items) > settings.CONFIRM_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"A batch may contain at most {settings.CONFIRM_BATCH_MAX_ITEMS} items.")
+    return idempotency.run_idempotent(
+        db, idempotency_key, current_user.username, "confirm-batch", batch,
+        lambda: _confirm_shipment_batch(batch, current_user, db), shipment_schemas.ConfirmBatchResult
+    )
+
+def _confirm_shipment_batch(batch: shipment_schemas.ConfirmShipmentBatch, current_user: models.SystemUser, db: Session):
+    if not (current_user.role == models.UserRoleEnum.vendor and current_user.vencode_ref and current_user.vendor_details):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only vendors can confirm shipments")
+    grade = current_user.vendor_details.grade
+
+    try:
+        results, confirmed = crud.confirm_shipments_batch(
+            db, batch.items, vencode=current_user.vencode_ref, grade=grade, username=current_user.username
+        )
+    except Exception as e:
+        db.rollback()
+        if transactions.is_retryable(e):
+            raise e # Deadlock / Lock wait timeout: ให้ run_idempotent ลองใหม่ทั้ง Transaction
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An internal error occurred: {str(e)}")
+
+    for db_shipment, before in confirmed:
+        realtime.publish_shipment_change(db_shipment, before)
+    event_log.append([event_log.build_row("confirmed", db_shipment, before, actor=current_user.username, carlicense=db_shipment.carlicense)
+                      for db_shipment, before in confirmed])
+
+    if confirmed:
+        shipids = [db_shipment.shipid for db_shipment, _ in confirmed]
+        listed = ", ".join(shipids[:5]) + (f" และอีก {len(shipids) - 5} งาน" if len(shipids) > 5 else "")
+        for dispatcher in crud.get_all_dispatchers(db):
+            if dispatcher.fcm_token:
+                firebase_service.queue_fcm_notification(
+                    token=dispatcher.fcm_token,
+                    title=f"Vendor ยืนยันงานแล้ว {len(shipids)} งาน (Grade {grade})",
+                    body=f"{current_user.display_name} ยืนยัน Shipment {listed}",
+                    data={"shipment_ids": ",".join(shipids)}
+                )
+
+    return {
+        "confirmed": len(confirmed),
+        "failed": len(results) - len(confirmed),
+        "results": results,
+    }
 @router.post("/reject", response_model=shipment_schemas.Shipment, summary="Vendor rejects a booking and broadcasts it")
-async def reject_shipment(
+def reject_shipment(
     action: shipment_schemas.RejectShipment,
-    current_user: models.SystemUser = Depends(get_current_active_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=100),
+    current_user: models.SystemUser = Depends(get_current_active_user_sync),
     db: Session = Depends(get_db)
 ):
     """
     ปฏิเสธงาน  และเปลี่ยนสถานะเป็น Broadcast ให้ทุกคน
     """
+    return idempotency.run_idempotent(
+        db, idempotency_key, current_user.username, "reject", action,
+        lambda: _reject_shipment(action, current_user, db), shipment_schemas.Shipment
+    )
+
+def _reject_shipment(action: shipment_schemas.RejectShipment, current_user: models.SystemUser, db: Session):
     if not (current_user.role == models.UserRoleEnum.vendor and current_user.vendor_details and current_user.vendor_details.grade):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only vendors can reject shipments")
 
-    db_shipment = crud.get_shipment_by_id(db, shipid=action.shipid)
+    db_shipment = crud.get_shipment_by_id(db, shipid=action.shipid, options=load_profiles.SHIPMENT_WRITE)
     
     # ตรวจสอบว่างานนี้สามารถถูกปฏิเสธโดย user คนนี้ได้หรือไม่
     if not db_shipment or db_shipment.docstat != '02' or db_shipment.current_grade_to_assign != current_user.vendor_details.grade:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Shipment cannot be rejected by you at this moment.")
+    crud.ensure_expected_version(db_shipment, action.row_version)
 
     print(f"INFO: Shipment {action.shipid} rejected by {current_user.username}. Broadcasting...")
-    existing_rejected_list = db_shipment.rejected_by_vencodes or []
+    before = realtime.snapshot(db_shipment)
 
-    # 2. เพิ่ม vencode ของ user ปัจจุบันเข้าไป (ถ้ายังไม่มี)
+    # 2. บันทึก vencode ของ user ปัจจุบันลง shipment_rejection (ถ้ายังไม่มี)
     current_vencode = current_user.vencode_ref
-    if current_vencode not in existing_rejected_list:
-        existing_rejected_list.append(current_vencode)
+    crud.add_shipment_rejection(db, db_shipment, current_vencode)
 
     # --- เปลี่ยน Logic เป็น Broadcast ---
-    db_shipment.rejected_by_vencodes = existing_rejected_list 
     db_shipment.docstat = 'BC'
     db_shipment.current_grade_to_assign = None # ไม่มีเกรดที่เจาะจงแล้ว
     db_shipment.assigned_at = datetime.now(timezone.utc)
@@ -349,7 +613,15 @@ async def reject_shipment(
     db_shipment.chdate = datetime.now(timezone.utc)
     
     db.commit()
-    db.refresh(db_shipment)
+    db_shipment = crud.reload_shipment(db, db_shipment.shipid)
+    realtime.publish_shipment_change(db_shipment, before)
+    event_log.record(
+        "rejected", db_shipment, before,
+        actor=current_user.username,
+        vencode=current_vencode,
+        grade=current_user.vendor_details.grade,
+        reason=action.rejection_reason
+    )
 
     # --- ส่ง Notification ไปหา Vendor ทุกคน (ยกเว้นคนที่เพิ่งปฏิเสธ) ---
     all_vendors = crud.get_all_vendors(db)
@@ -359,10 +631,11 @@ async def reject_shipment(
             continue
         
         if vendor.fcm_token:
-            firebase_service.send_fcm_notification(
+            firebase_service.queue_fcm_notification(
                 token=vendor.fcm_token, 
                 title="[งานเปิด] มีงานใหม่ให้เลือก!", 
-                body=f"Shipment ID: {db_shipment.shipid} เปิดให้รับงานแบบ First-Come, First-Served"
+                body=f"Shipment ID: {db_shipment.shipid} เปิดให้รับงานแบบ First-Come, First-Served",
+                shipment_id=db_shipment.shipid
             )
             
     return db_shipment
@@ -370,7 +643,7 @@ async def reject_shipment(
 def hold_shipment_for_next_round(
     shipid: str,
     action: HoldActionBody,
-    current_user: models.SystemUser = Depends(get_current_active_user),
+    current_user: models.SystemUser = Depends(get_current_active_user_sync),
     db: Session = Depends(get_db)
 ):
     """
@@ -379,37 +652,81 @@ def hold_shipment_for_next_round(
     if current_user.role not in get_dispatcher_and_admin_roles():
         raise HTTPException(status_code=403, detail="Not authorized")
         
-    updated_shipment = crud.toggle_shipment_hold_status(
+    updated_shipment = transactions.run_with_retry(db, lambda: crud.toggle_shipment_hold_status(
         db=db, 
         shipid=shipid, 
         hold=action.hold, 
-        current_user_id=current_user.username
-    )
+        current_user_id=current_user.username,
+        expected_version=action.row_version
+    ), "hold")
 
     if not updated_shipment:
         raise HTTPException(status_code=404, detail="Shipment not found or cannot be held at this moment.")
         
     return updated_shipment
 
+@router.post("/bulk", response_model=shipment_schemas.BulkShipmentResult, summary="Hold, unhold or move many shipments between rounds at once")
+def bulk_update_shipments(
+    action: shipment_schemas.BulkShipmentAction,
+    current_user: models.SystemUser = Depends(get_current_active_user_sync),
+    db: Session = Depends(get_db)
+):
+    """
+    แก้หลายงานพร้อมกันใน Transaction เดียว (สำหรับ Dispatcher)
+    - hold / unhold: เฉพาะงานที่ยังไม่เข้ารอบ
+    - move: ย้ายงานที่ยังรอจัดสรร (01) เข้ารอบ round_id
+    - remove_from_round: เอางานที่ยังรอจัดสรร (01) ออกจากรอบ
+    งานที่แก้ไม่ได้ไม่ทำให้ทั้งชุดล้มเหลว จะอยู่ใน skipped พร้อมเหตุผล
+    """
+    if current_user.role not in get_dispatcher_and_admin_roles():
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if action.action == "move" and action.round_id is None:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="round_id is required for action 'move'.")
+    if len(action.shipids) > settings.PAGE_SIZE_MAX:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"At most {settings.PAGE_SIZE_MAX} shipments can be updated at once.")
+
+    try:
+        updated, skipped = transactions.run_with_retry(db, lambda: crud.bulk_update_shipments(
+            db,
+            shipids=action.shipids,
+            action=action.action,
+            current_user_id=current_user.username,
+            round_id=action.round_id
+        ), "bulk_" + action.action)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    return {"action": action.action, "affected": len(updated), "skipped": skipped, "shipments": updated}
+
 @router.post("/manual-assign", response_model=shipment_schemas.Shipment, summary="Dispatcher manually assigns a vendor")
-async def manual_assign_vendor(
+def manual_assign_vendor(
     action: shipment_schemas.ManualAssign,
-    current_user: models.SystemUser = Depends(get_current_active_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=100),
+    current_user: models.SystemUser = Depends(get_current_active_user_sync),
     db: Session = Depends(get_db)
 ):
     """จัดเลือกขนส่งเอง (สำหรับ Dispatcher) ให้กับงานที่ Unresponsive หรือถูกปฏิเสธทั้งหมด"""
+    return idempotency.run_idempotent(
+        db, idempotency_key, current_user.username, "manual-assign", action,
+        lambda: _manual_assign_vendor(action, current_user, db), shipment_schemas.Shipment
+    )
+
+def _manual_assign_vendor(action: shipment_schemas.ManualAssign, current_user: models.SystemUser, db: Session):
     if current_user.role not in get_dispatcher_and_admin_roles():
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
-    db_shipment = crud.get_shipment_by_id(db, shipid=action.shipid)
+    db_shipment = crud.get_shipment_by_id(db, shipid=action.shipid, options=load_profiles.SHIPMENT_WRITE)
     if not db_shipment:
         raise HTTPException(status_code=404, detail="Shipment not found")
+    crud.ensure_expected_version(db_shipment, action.row_version)
     if db_shipment.docstat not in ['RJ', '01']:
         raise HTTPException(status_code=400, detail="Shipment is not in a state for manual assignment")
 
     vendor_to_assign = crud.get_user_by_vencode(db, vencode=action.vencode)
     if not vendor_to_assign or not vendor_to_assign.vendor_details:
         raise HTTPException(status_code=404, detail=f"Vendor with code '{action.vencode}' not found")
+    before = realtime.snapshot(db_shipment)
     db_shipment.vencode = action.vencode
     db_shipment.vendor_name = vendor_to_assign.display_name
     db_shipment.docstat = '02'
@@ -418,12 +735,15 @@ async def manual_assign_vendor(
     db_shipment.chuser = current_user.username
     db_shipment.chdate = datetime.now(timezone.utc)
     db.commit()
-    db.refresh(db_shipment)
+    db_shipment = crud.reload_shipment(db, db_shipment.shipid)
+    realtime.publish_shipment_change(db_shipment, before)
+    event_log.record("manually_assigned", db_shipment, before, actor=current_user.username)
 
     if vendor_to_assign.fcm_token:
-        firebase_service.send_fcm_notification(
+        firebase_service.queue_fcm_notification(
             token=vendor_to_assign.fcm_token,
             title="คุณได้รับมอบหมายงาน",
-            body=f"Shipment ID: {db_shipment.shipid} รอการยืนยันจากคุณ"
+            body=f"Shipment ID: {db_shipment.shipid} รอการยืนยันจากคุณ",
+            shipment_id=db_shipment.shipid
         )
     return db_shipment
\ No newline at end of file
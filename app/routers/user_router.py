@@ -1,24 +1,25 @@
 # app/routers/user_router.py
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from grpc import Status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
-from app.routers.shipment_router import get_dispatcher_and_admin_roles # Import List for type hinting
+from app.routers.shipment_router import CURSOR_QUERY, LIMIT_QUERY, get_dispatcher_and_admin_roles, set_page_headers # Import List for type hinting
 
 from ..schemas.user_schemas import User as UserResponseSchema
 from ..schemas.car_schemas import Car as CarSchema # Import CarSchema
-from ..db import models, crud
+from ..db import models, crud, async_crud
 from ..core import security
-from ..db.database import get_db
+from ..db.database import get_async_db, get_db, get_read_db
 from app.schemas import user_schemas, vendor_schemas
 
 router = APIRouter(
     tags=["Users (Authenticated)"] # เปลี่ยน Tag
 )
 @router.get("/me", response_model=UserResponseSchema)
-async def read_users_me(
-    current_user: models.SystemUser = Depends(security.get_current_active_user),
+def read_users_me(
+    current_user: models.SystemUser = Depends(security.get_current_active_user_sync),
     db_session: Session = Depends(get_db) # db_session จะถูกใช้
 ):
     # แปลง SQLAlchemy model (current_user) เป็น Pydantic model (UserResponseSchema)
@@ -53,9 +54,12 @@ async def read_users_me(
 
     return UserResponseSchema(**user_response_data)
 @router.get("/vendors/all", response_model=List[vendor_schemas.VendorProfileWithCars], summary="Get all vendor profiles")
-async def get_all_vendors(
-    current_user: models.SystemUser = Depends(security.get_current_active_user),
-    db: Session = Depends(get_db)
+def get_all_vendors(
+    response: Response,
+    cursor: Optional[str] = CURSOR_QUERY,
+    limit: Optional[int] = LIMIT_QUERY,
+    current_user: models.SystemUser = Depends(security.get_current_active_user_read),
+    db: Session = Depends(get_read_db)
 ):
     """
     สำหรับ Admin/Dispatcher: ดึงข้อมูลโปรไฟล์ของ Vendor ทั้งหมด
@@ -63,15 +67,16 @@ async def get_all_vendors(
     if current_user.role not in get_dispatcher_and_admin_roles(): # ใช้ helper function เดิม
         raise HTTPException(status_code=403, detail="Not enough permissions")
         
-    return crud.get_all_vendor_profiles(db)
+    return set_page_headers(response, crud.get_all_vendor_profiles(db, cursor=cursor, limit=limit))
 @router.post("/update-fcm-token", response_model=user_schemas.User)
 async def update_fcm_token(
     token_data: user_schemas.FCMTokenUpdate,
     current_user: models.SystemUser = Depends(security.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     รับ FCM Token จาก Client และบันทึกลงใน Database ของ User ที่ Login อยู่
     """
     print(f"Updating FCM token for user {current_user.username} to {token_data.fcm_token}")
-    return crud.update_user_fcm_token(db=db, user=current_user, new_token=token_data.fcm_token)
\ No newline at end of file
+    # current_user มาจาก AsyncSession เดียวกัน (FastAPI Cache Dependency get_async_db ต่อ Request)
+    return await async_crud.update_user_fcm_token(db=db, user=current_user, new_token=token_data.fcm_token)
\ No newline at end of file
@@ -1,6 +1,6 @@
 # app/schemas/booking_round_schemas.py
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import date, datetime, time
 from .shipment_schemas import Shipment
 # Schema สำหรับ Master เวลา (จากตาราง mbooking_round)
@@ -36,4 +36,18 @@ class BookingRound(BookingRoundBase):
     shipments: List[Shipment] = []
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# ?view=summary ของรายการรอบ: ข้อมูลรอบ + ตัวเลขสรุปของ Shipment ในรอบ (ไม่มีรายการ Shipment)
+class BookingRoundSummary(BookingRoundBase):
+    id: int
+    status: str
+    allocation_start_time: Optional[datetime] = None
+    allocation_duration_mins: Optional[int] = None
+    shipment_count: int = 0
+    docstat_counts: Dict[str, int] = {} # จำนวน Shipment ต่อ docstat เช่น {"01": 3, "03": 2}
+    shipment_volume_cbm: float = 0.0    # ผลรวม volume_cbm ของ Shipment ในรอบ
+    vendor_count: int = 0               # จำนวน Vendor (vencode) ที่ไม่ซ้ำกันในรอบ
+
+    class Config:
+        from_attributes = True
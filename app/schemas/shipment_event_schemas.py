@@ -0,0 +1,20 @@
+# app/schemas/shipment_event_schemas.py
+from pydantic import BaseModel
+from typing import Optional, Any
+from datetime import datetime
+
+class ShipmentEvent(BaseModel):
+    id: int
+    shipid: str
+    event_type: str
+    docstat_from: Optional[str] = None
+    docstat_to: Optional[str] = None
+    vencode: Optional[str] = None
+    grade: Optional[str] = None
+    booking_round_id: Optional[int] = None
+    actor: Optional[str] = None
+    detail: Optional[Any] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
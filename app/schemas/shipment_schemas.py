@@ -1,11 +1,22 @@
 # app/schemas/shipment_schemas.py
 from pydantic import BaseModel, Field, field_validator
-from typing import Optional, Any, List
+from typing import Optional, Any, List, Literal
 from datetime import date, datetime
 
 from app.schemas import shipment_detail_schemas
 from app.schemas.car_schemas import CarBase
 
+def zero_date_to_none(v: Any) -> Optional[datetime]:
+    if v is None:
+        return None
+    # ตรวจสอบค่าที่เป็น "Zero Date" string จาก MySQL/MariaDB
+    if isinstance(v, str) and v.startswith('0000-00-00'):
+        return None
+    # ตรวจสอบค่าที่เป็น datetime object ที่ไม่ถูกต้อง (ปีน้อยมากๆ)
+    if isinstance(v, datetime) and v.year < 1900:
+        return None
+    return v
+
 # ShipmentBase จะเก็บเฉพาะ Fields ที่จำเป็นสำหรับการ "สร้าง" Shipment.
 class MVendorSchema(BaseModel):
     vencode: str
@@ -67,27 +78,35 @@ class Shipment(ShipmentCreate): # สืบทอด Fields ทั้งหม
     sapstat: Optional[str] = None
     sapupdate: Optional[datetime] = None
     assigned_at: Optional[datetime] = None
+    row_version: Optional[int] = None
     mvendor: Optional[MVendorSchema] = None
     @field_validator('crdate', 'chdate', 'sapupdate', 'apmdate', mode='before')
     @classmethod
     def check_zero_date(cls, v: Any) -> Optional[datetime]:
-        if v is None:
-            return None
-        # ตรวจสอบค่าที่เป็น "Zero Date" string จาก MySQL/MariaDB
-        if isinstance(v, str) and v.startswith('0000-00-00'):
-            return None
-        # ตรวจสอบค่าที่เป็น datetime object ที่ไม่ถูกต้อง (ปีน้อยมากๆ)
-        if isinstance(v, datetime) and v.year < 1900:
-            return None
-        return v
+        return zero_date_to_none(v) # ใช้ร่วมกับ app/core/serialization.py (Fast path ไม่ผ่าน Validator)
 
     class Config:
         from_attributes = True
         populate_by_name = True
 
+# Schemas สำหรับ Delta-sync (GET /changes)
+class ShipmentTombstone(BaseModel):
+    shipid: str
+    row_version: int
+    deleted: bool = True
+
+class ShipmentChanges(BaseModel):
+    since: int
+    high_water_mark: int
+    changes: List[Shipment] = []
+    tombstones: List[ShipmentTombstone] = []
+    has_more: bool = False            # True = ยังมีหน้าถัดไป ให้เรียกซ้ำด้วย since เดิม + cursor
+    next_cursor: Optional[str] = None # ใช้ high_water_mark เป็น since รอบหน้าเมื่อ has_more = False เท่านั้น
+
 # Schemas สำหรับ Actions ต่างๆ
 class ShipmentAction(BaseModel):
     shipid: str
+    row_version: Optional[int] = None # row_version ที่ Client เห็นล่าสุด (ถ้าส่งมาแล้วไม่ตรง -> 409)
 
 class HoldShipment(ShipmentAction):
     hold: bool
@@ -96,6 +115,39 @@ class ConfirmShipment(ShipmentAction):
     carlicense: str = Field(..., max_length=20) # <<--- แก้ไขการสะกดคำที่นี่
     carnote: Optional[str] = Field(None, max_length=255)
 
+# POST /shipments/confirm-batch: Vendor รับหลายงานใน Transaction เดียว
+class ConfirmShipmentBatch(BaseModel):
+    items: List[ConfirmShipment] = Field(..., min_length=1)
+
+class ConfirmBatchItemResult(BaseModel):
+    shipid: str
+    # confirmed | not_found | not_available | stale | duplicate | car_not_found | car_conflict | missing_data
+    status: str
+    detail: Optional[str] = None
+    row_version: Optional[int] = None # row_version ใหม่ของงานที่รับได้
+
+class ConfirmBatchResult(BaseModel):
+    confirmed: int
+    failed: int
+    results: List[ConfirmBatchItemResult]
+
+# POST /shipments/bulk: Dispatcher แก้หลายงานพร้อมกัน
+# hold / unhold (เฉพาะงานที่ยังไม่เข้ารอบ), move (ย้ายงาน 01 เข้ารอบ round_id), remove_from_round (เอางาน 01 ออกจากรอบ)
+class BulkShipmentAction(BaseModel):
+    shipids: List[str] = Field(..., min_length=1)
+    action: Literal["hold", "unhold", "move", "remove_from_round"]
+    round_id: Optional[int] = None # จำเป็นเมื่อ action = move
+
+class BulkSkippedShipment(BaseModel):
+    shipid: str
+    reason: str # not_found | in_round | already_held | not_held | on_hold | not_waiting_round | already_in_round | not_in_round
+
+class BulkShipmentResult(BaseModel):
+    action: str
+    affected: int
+    skipped: List[BulkSkippedShipment] = []
+    shipments: List[Shipment] = [] # งานที่ถูกแก้ (ค่าหลัง commit)
+
 class RejectShipment(ShipmentAction):
     rejection_reason: str
 
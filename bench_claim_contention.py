@@ -0,0 +1,103 @@
+# bench_claim_contention.py
+# วัดการแย่งรับงานเปิด (BC) พร้อมกันหลาย Vendor ผ่าน crud.claim_shipment (Conditional UPDATE) กับฐานข้อมูลใน .env
+# แต่ละรอบ: ตั้ง Shipment เป็น BC -> ปล่อย N Thread (Session ของตัวเอง) ให้ claim + commit พร้อมกัน
+#           -> นับผู้ชนะ (ต้องเท่ากับ 1 ทุกรอบ) และเก็บ Latency ของแต่ละคน
+# รันด้วย: python bench_claim_contention.py --shipid <shipid> [--clients 50] [--rounds 20]
+#          (exit code 1 ถ้ามีรอบที่ผู้ชนะไม่ใช่ 1 คน) จบแล้วคืนค่า Shipment กลับเป็นเหมือนก่อนรัน
+# หมายเหตุ: วัดเฉพาะช่วงตัดสินผู้ชนะ (ไม่รวม assign_job_to_car / Notification ของผู้ชนะ)
+import argparse
+import os
+import sys
+import threading
+import time
+
+# เพิ่ม Path ของโปรเจกต์
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(project_root)
+
+from app.core.config import settings
+from app.db import crud, database, models, versioning
+
+RESTORE_COLUMNS = ["docstat", "vencode", "confirmed_by_grade", "carlicense", "carnote",
+                   "current_grade_to_assign", "assigned_at", "chuser", "chdate"]
+
+def set_shipment(shipid: str, values: dict):
+    db = database.SessionLocal()
+    try:
+        values = dict(values, row_version=versioning.next_change_version(db))
+        db.query(models.Shipment).filter(models.Shipment.shipid == shipid).update(values, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def contender(barrier: threading.Barrier, shipid: str, vendor: models.MVendor, results: list):
+    db = database.SessionLocal()
+    try:
+        barrier.wait()
+        start = time.perf_counter()
+        won = crud.claim_shipment(db, shipid=shipid, vencode=vendor.vencode, grade=vendor.grade,
+                                  carlicense="BENCH", carnote=None, username="bench")
+        if won:
+            db.commit()
+        else:
+            db.rollback()
+        results.append((won, time.perf_counter() - start))
+    except Exception as e:
+        db.rollback()
+        results.append((None, 0.0))
+        print(f"ERROR: claim failed: {e}")
+    finally:
+        db.close()
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark concurrent first-come-first-served claims on one shipment")
+    parser.add_argument("--shipid", required=True)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    db = database.SessionLocal()
+    shipment = db.get(models.Shipment, args.shipid)
+    vendors = db.query(models.MVendor).all()
+    db.close()
+    if not shipment or not vendors:
+        print("ERROR: shipment or vendors not found")
+        return 1
+    original = {column: getattr(shipment, column) for column in RESTORE_COLUMNS}
+    if args.clients + 1 > settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW:
+        print(f"WARNING: {args.clients} clients > DB pool capacity; part of the latency is pool wait (see DB_POOL_SIZE)")
+
+    latencies, bad_rounds = [], 0
+    try:
+        for round_no in range(1, args.rounds + 1):
+            set_shipment(args.shipid, {"docstat": 'BC', "current_grade_to_assign": None, "vencode": None})
+            barrier = threading.Barrier(args.clients)
+            results: list = []
+            threads = [threading.Thread(target=contender, args=(barrier, args.shipid, vendors[i % len(vendors)], results))
+                       for i in range(args.clients)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            winners = sum(1 for won, _ in results if won)
+            errors = sum(1 for won, _ in results if won is None)
+            latencies.extend(elapsed for won, elapsed in results if won is not None)
+            bad_rounds += 0 if winners == 1 else 1
+            print(f"round {round_no}: winners={winners} losers={len(results) - winners - errors} errors={errors}")
+    finally:
+        set_shipment(args.shipid, original)
+
+    if latencies:
+        ms = [value * 1000 for value in latencies]
+        print(f"claims={len(ms)} p50={percentile(ms, 50):.2f}ms p90={percentile(ms, 90):.2f}ms "
+              f"p99={percentile(ms, 99):.2f}ms max={max(ms):.2f}ms")
+    print("OK   exactly one winner per round" if not bad_rounds else f"FAIL {bad_rounds} round(s) without exactly one winner")
+    return 1 if bad_rounds else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+# bench_list_projection.py
+# เทียบต้นทุนต่อแถวของรายการ Shipment ระหว่างโหลดเป็น Entity (load_profiles.SHIPMENT_LIST)
+# กับ Projection แบบ Core (app/db/projections.py) ที่ async_crud ใช้ กับฐานข้อมูลใน .env (อ่านอย่างเดียว)
+# แยกวัดช่วงโหลด (Query -> Object/dict ที่พร้อม Serialize) กับช่วง Serialize (serialization.SHIPMENT_LIST)
+# เวลาเป็น best of --repeat, หน่วยความจำคือส่วนที่ผลโหลดถือไว้ (tracemalloc) และตรวจว่า JSON ของสองทางเหมือนกัน
+# รันด้วย: python bench_list_projection.py [--limit 200 1000] [--repeat 5]
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+# เพิ่ม Path ของโปรเจกต์
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(project_root)
+
+import orjson
+from sqlalchemy import select
+
+from app.core import serialization
+from app.db import async_crud, database, load_profiles, models, pagination, projections
+
+def orm_load(db, limit: int) -> list:
+    stmt = select(models.Shipment).options(*load_profiles.SHIPMENT_LIST).order_by(models.Shipment.apmdate.desc())
+    stmt = pagination.keyset(stmt, async_crud.APMDATE_KEYS, None, limit, descending=True)
+    return db.execute(stmt).unique().scalars().all()[:limit]
+
+def projection_load(db, limit: int) -> list:
+    stmt = pagination.keyset(async_crud.shipments_stmt(), async_crud.APMDATE_KEYS, None, limit, descending=True)
+    rows = db.execute(stmt).all()[:limit]
+    detail_rows = []
+    for shipids in projections.FULL.detail_batches(rows):
+        detail_rows.extend(db.execute(projections.details_stmt(shipids)).all())
+    return projections.FULL.assemble(rows, detail_rows)
+
+def measure(load, limit: int, repeat: int):
+    """(JSON, เวลาโหลด ms, เวลา Serialize ms, หน่วยความจำที่ผลโหลดถือไว้ KiB)"""
+    load_ms = dump_ms = None
+    for _ in range(repeat):
+        db = database.ReadSessionLocal()
+        try:
+            start = time.perf_counter()
+            items = load(db, limit)
+            loaded = time.perf_counter()
+            body = serialization.SHIPMENT_LIST.dump_json(items)
+            done = time.perf_counter()
+        finally:
+            db.close()
+        load_ms = (loaded - start) * 1000 if load_ms is None else min(load_ms, (loaded - start) * 1000)
+        dump_ms = (done - loaded) * 1000 if dump_ms is None else min(dump_ms, (done - loaded) * 1000)
+
+    # หน่วยความจำที่ยังถือไว้หลังโหลด (Entity + Identity Map ของ Session / dict ของ Projection) ก่อนปิด Session
+    db = database.ReadSessionLocal()
+    try:
+        tracemalloc.start()
+        items = load(db, limit)
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del items
+    finally:
+        db.close()
+    return body, load_ms, dump_ms, retained / 1024
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ORM entity vs Core projection for shipment lists")
+    parser.add_argument("--limit", type=int, nargs="+", default=[200, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    different = False
+    for limit in args.limit:
+        results = [(name, *measure(load, limit, args.repeat))
+                   for name, load in (("ORM entities (SHIPMENT_LIST)", orm_load), ("Core projection", projection_load))]
+        rows = len(orjson.loads(results[1][1]))
+        same = orjson.loads(results[0][1]) == orjson.loads(results[1][1])
+        different = different or not same
+        print(f"--- first page, limit {limit} ({rows} rows), best of {args.repeat} ---")
+        for name, _, load_ms, dump_ms, kib in results:
+            per_row = f"{load_ms * 1000 / rows:7.1f} us/row" if rows else ""
+            print(f"{name:<30} load {load_ms:8.1f} ms {per_row}  retained {kib:8.0f} KiB  serialize {dump_ms:7.1f} ms")
+        if rows:
+            (_, _, orm_ms, _, orm_kib), (_, _, ms, _, kib) = results
+            print(f"{'ORM / projection':<30} load x{orm_ms / ms:5.1f}  retained memory x{orm_kib / kib:5.1f}")
+        print("OK   same JSON" if same else "FAIL DIFFERENT JSON")
+    return 1 if different else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
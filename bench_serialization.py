@@ -0,0 +1,134 @@
+# bench_serialization.py
+# เทียบเวลาแปลงรายการ Shipment เป็น JSON ระหว่างทางเดิมของ FastAPI (response_model + json) กับ app/core/serialization.py
+# ใช้ Shipment จำลองในหน่วยความจำ (ไม่ต่อฐานข้อมูล) ที่มี mshiptype/mprovince/mleadtime/mvendor และ details ครบเหมือน SHIPMENT_LIST
+# ท้ายแต่ละชุดเทียบขนาด Payload และเวลา Decode ของ JSON กับ MessagePack (Accept: application/msgpack)
+# รันด้วย: python bench_serialization.py [--rows 1000 10000] [--repeat 5] [--details 2]
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import List
+
+# เพิ่ม Path ของโปรเจกต์
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(project_root)
+
+import msgpack
+import orjson
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from app.core import serialization
+from app.core.config import settings
+from app.db import models
+from app.schemas import shipment_schemas
+
+def _as_loaded(obj):
+    # Object ที่โหลดจากฐานข้อมูลจะมีค่าทุกคอลัมน์ (รวม NULL) อยู่แล้ว ทำให้ Object จำลองเหมือนกัน
+    for column in obj.__table__.columns:
+        if column.key not in obj.__dict__:
+            setattr(obj, column.key, None)
+    return obj
+
+def make_shipments(count: int, details: int) -> list:
+    shiptype = models.MShipType(cartype="4W", cartypedes="4 ล้อ")
+    province = models.MProvince(province=10, provname="กรุงเทพมหานคร")
+    leadtime = models.MLeadTime(route="R001", leadtime=Decimal("1.5"))
+    vendor = models.MVendor(vencode="V001", venname="ขนส่งตัวอย่าง", grade="A")
+    shipments = []
+    for i in range(count):
+        shipment = models.Shipment(
+            shipid=f"S{i:07d}", customer_name=f"ลูกค้า {i}", shippoint="WH7", province=10, route="R001", cartype="4W",
+            quantity=i % 40, volume_cbm=Decimal("12.500"), apmdate=datetime(2025, 7, 1, 8) + timedelta(minutes=i),
+            docstat="03", is_on_hold=False, vencode="V001", carlicense="70-1234", confirmed_by_grade="A",
+            crdate=datetime(2025, 6, 30, 9), chuser="dispatcher", chdate=datetime(2025, 7, 1, 7, 30), row_version=i,
+        )
+        _as_loaded(shipment)
+        shipment.mshiptype, shipment.mprovince, shipment.mleadtime, shipment.mvendor = shiptype, province, leadtime, vendor
+        shipment.details = [
+            _as_loaded(models.DOH(doid=f"D{i:07d}{j}", shipid=shipment.shipid, dlvdate=date(2025, 7, 2), cusid="C001",
+                       cusname=f"ร้าน {j}", route="R001", province="10", volumn=Decimal("6.250")))
+            for j in range(details)
+        ]
+        shipments.append(shipment)
+    return shipments
+
+def as_mappings(shipments: list) -> list:
+    """แถวแบบ Row Mapping (dict) เหมือนผลจาก Core select() ที่ Project คอลัมน์มาแล้ว"""
+    columns = [column.key for column in models.Shipment.__table__.columns]
+    detail_columns = [column.key for column in models.DOH.__table__.columns]
+    rows = []
+    for shipment in shipments:
+        row = {column: getattr(shipment, column) for column in columns}
+        row["mshiptype"] = {"cartype": shipment.mshiptype.cartype, "cartypedes": shipment.mshiptype.cartypedes}
+        row["mprovince"] = {"province": shipment.mprovince.province, "provname": shipment.mprovince.provname}
+        row["mleadtime"] = {"leadtime": shipment.mleadtime.leadtime}
+        row["mvendor"] = {"vencode": shipment.mvendor.vencode, "venname": shipment.mvendor.venname, "grade": shipment.mvendor.grade}
+        row["details"] = [{column: getattr(detail, column) for column in detail_columns} for detail in shipment.details]
+        rows.append(row)
+    return rows
+
+RESPONSE_FIELD = create_model_field("Response_read_shipments", List[shipment_schemas.Shipment], mode="serialization")
+
+async def fastapi_default(shipments: list) -> bytes:
+    # ทางเดิม: serialize_response ของ FastAPI (Validate ผ่าน response_model) แล้ว JSONResponse (json ของ stdlib)
+    content = await serialize_response(field=RESPONSE_FIELD, response_content=shipments, is_coroutine=True)
+    return JSONResponse(content).body
+
+def timed(fn, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark shipment list serialization paths")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--details", type=int, default=2, help="DOH lines per shipment")
+    args = parser.parse_args()
+
+    for count in args.rows:
+        shipments = make_shipments(count, args.details)
+        rows = as_mappings(shipments)
+        baseline = orjson.loads(asyncio.run(fastapi_default(shipments)))
+
+        def with_setting(fast: bool, data):
+            def run():
+                settings.FAST_SERIALIZATION = fast
+                return serialization.SHIPMENT_LIST.dump_json(data)
+            return run
+
+        paths = [
+            ("fastapi response_model + json", lambda: asyncio.run(fastapi_default(shipments))),
+            ("TypeAdapter (ORM objects)", with_setting(False, shipments)),
+            ("RowSerializer + orjson (ORM objects)", with_setting(True, shipments)),
+            ("RowSerializer + orjson (row mappings)", with_setting(True, rows)),
+        ]
+        print(f"--- {count} rows ({args.details} details each), best of {args.repeat} ---")
+        reference = None
+        for name, fn in paths:
+            body = fn()
+            same = orjson.loads(body) == baseline
+            ms = timed(fn, args.repeat)
+            reference = reference or ms
+            print(f"{name:<40} {ms:9.1f} ms  x{reference / ms:5.1f}  {len(body) / 1024:8.0f} KiB  {'same JSON' if same else 'DIFFERENT JSON'}")
+
+        settings.FAST_SERIALIZATION = True
+        json_body = serialization.SHIPMENT_LIST.dump_json(shipments)
+        msgpack_body = serialization.SHIPMENT_LIST.dump_msgpack(shipments)
+        same = msgpack.unpackb(msgpack_body) == baseline
+        for name, body, decode in (("JSON", json_body, orjson.loads), ("MessagePack", msgpack_body, msgpack.unpackb)):
+            ms = timed(lambda: decode(body), args.repeat)
+            print(f"{name + ' payload / decode':<40} {ms:9.1f} ms  {len(body) / 1024:15.0f} KiB  {'same data' if same else 'DIFFERENT DATA'}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
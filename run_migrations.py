@@ -0,0 +1,14 @@
+# run_migrations.py
+import os
+import sys
+
+# เพิ่ม Path ของโปรเจกต์
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(project_root)
+
+from app.db import database, migrations
+
+if __name__ == "__main__":
+    applied = migrations.run_migrations(database.engine)
+    if applied:
+        print(f"INFO: Applied migrations: {applied}")
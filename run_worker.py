@@ -4,14 +4,15 @@ import logging
 from datetime import datetime, timedelta, timezone
 from apscheduler.schedulers.blocking import BlockingScheduler
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 
 # --- ส่วน Setup Path และ Logging (เหมือนเดิม) ---
 # เพิ่ม Path ของโปรเจกต์
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(project_root)
 
-from app.db import crud, models, database
-from app.core import firebase_service
+from app.db import crud, event_log, load_profiles, models, database, pool_metrics, transactions, versioning
+from app.core import firebase_service, realtime
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -29,104 +30,171 @@ def check_expired_shipments_job():
     logging.info("Worker Job: Starting check for expired shipments...")
     db: Session = database.SessionLocal() # สร้าง Session ใหม่ทุกครั้งที่ Job ทำงาน
     try:
-        # กำหนดเวลาหมดอายุ (30 นาทีที่แล้ว)
-        expiration_time_limit = datetime.now(timezone.utc) - timedelta(minutes=RESPONSE_TIMEOUT_MINUTES)
-        
-        # 1. Query หา Shipments ที่รอการตอบรับจากเกรดที่ระบุ ('02') และหมดเวลาแล้ว
-        expired_shipments = db.query(models.Shipment).filter(
-            models.Shipment.docstat == '02',
-            models.Shipment.assigned_at <= expiration_time_limit
-        ).all()
-        
-        if not expired_shipments:
-            logging.info("Worker Job: No expired shipments found.")
-            return
+        # Deadlock / Lock wait timeout กับ Request ของ API ที่แก้ Shipment ชุดเดียวกัน: ลองใหม่ทั้งชุด (app/db/transactions.py)
+        transactions.run_with_retry(db, lambda: _process_expired_shipments(db), "worker.check_expired_shipments")
+    except StaleDataError as e:
+        # Vendor/Dispatcher แก้ Shipment ในชุดนี้ไปก่อน (row_version ไม่ตรง) ไม่เขียนทับ รอบถัดไปจะอ่านค่าใหม่แล้วทำต่อ
+        logging.warning(f"Worker Job: Shipment changed concurrently, batch skipped until next run: {e}")
+        db.rollback()
+    except Exception as e:
+        logging.error(f"Worker Job: An error occurred: {e}", exc_info=True)
+        db.rollback() # Rollback ถ้าเกิดปัญหา
+    finally:
+        db.close() # ปิด Session เสมอ
+        logging.info("Worker Job: Check finished, database session closed.")
 
-        logging.info(f"Worker Job: Found {len(expired_shipments)} expired shipments. Broadcasting them...")
+def _process_expired_shipments(db: Session):
+    """
+    งานหลักของ check_expired_shipments_job: แก้ทุก Shipment ที่หมดเวลาแล้ว commit ครั้งเดียว
+    Realtime / Event Log / Notification ส่งหลัง commit เท่านั้น จึงเรียกซ้ำทั้งฟังก์ชันได้เมื่อต้อง Retry
+    """
+    # กำหนดเวลาหมดอายุ (30 นาทีที่แล้ว)
+    expiration_time_limit = datetime.now(timezone.utc) - timedelta(minutes=RESPONSE_TIMEOUT_MINUTES)
+    
+    # 1. Query หา Shipments ที่รอการตอบรับจากเกรดที่ระบุ ('02') และหมดเวลาแล้ว
+    expired_shipments = db.query(models.Shipment).options(*load_profiles.SHIPMENT_WORKER).filter(
+        models.Shipment.docstat == '02',
+        models.Shipment.assigned_at <= expiration_time_limit
+    ).all()
+    
+    if not expired_shipments:
+        logging.info("Worker Job: No expired shipments found.")
+        return
+
+    logging.info(f"Worker Job: Found {len(expired_shipments)} expired shipments. Broadcasting them...")
+    
+    realtime_events = [] # ส่ง Event ให้ API (WebSocket) หลัง commit สำเร็จ
+    event_rows = []
+    notifications = [] # เข้าคิว FCM หลัง commit เช่นกัน ถ้า Transaction ถูกลองใหม่จะไม่ส่งซ้ำ
+
+    # 2. Loop จัดการแต่ละ Shipment ที่หมดเวลา
+    for shipment in expired_shipments:
+        before = realtime.snapshot(shipment)
+        logging.info(f"  - Processing expired shipment: {shipment.shipid} from grade {shipment.current_grade_to_assign}")
+        grade_that_timed_out = shipment.current_grade_to_assign
+        vendor_to_reject = crud.get_vendor_by_grade(db, grade=grade_that_timed_out) # <--- สร้างฟังก์ชันนี้ใน CRUD
+
+        # 2. บันทึก Vendor ที่ปล่อยงานหมดเวลาลง shipment_rejection
+        if vendor_to_reject:
+            crud.add_shipment_rejection(db, shipment, vendor_to_reject.vencode_ref)
+        # 3. Logic ใหม่: เปลี่ยนสถานะเป็น Broadcast ('BC')
+        shipment.docstat = 'BC'
+        shipment.current_grade_to_assign = None # ไม่มีเกรดที่เจาะจงแล้ว
+        shipment.assigned_at = None # ล้างเวลา
+        shipment.chuser = 'AUTOMATED_WORKER'
+        shipment.chdate = datetime.now(timezone.utc)
+        shipment.assigned_at = datetime.now(timezone.utc)
+        realtime_events.append(realtime.shipment_event(shipment, before))
+        event_rows.append(event_log.build_row(
+            "offer_expired", shipment, before,
+            vencode=vendor_to_reject.vencode_ref if vendor_to_reject else None,
+            grade=grade_that_timed_out
+        ))
+
+        # 4. ส่ง Notification ไปหา Vendor ทุกคน
+        # (ยกเว้นเกรด A ที่เพิ่งปล่อยให้หมดเวลา เพื่อไม่ให้เกิดความสับสน)
+        vendors_to_notify = crud.get_all_vendors(db) # ใช้ฟังก์ชันจาก crud
+        grade_that_timed_out = shipment.current_grade_to_assign # เกรดเดิมก่อนจะเปลี่ยน
         
-        # 2. Loop จัดการแต่ละ Shipment ที่หมดเวลา
-        for shipment in expired_shipments:
-            logging.info(f"  - Processing expired shipment: {shipment.shipid} from grade {shipment.current_grade_to_assign}")
-            grade_that_timed_out = shipment.current_grade_to_assign
-            vendor_to_reject = crud.get_vendor_by_grade(db, grade=grade_that_timed_out) # <--- สร้างฟังก์ชันนี้ใน CRUD
-
-            # 2. เตรียม List ของคนที่ถูก Reject
-            existing_rejected_list = shipment.rejected_by_vencodes or []
-            if vendor_to_reject and vendor_to_reject.vencode_ref not in existing_rejected_list:
-                existing_rejected_list.append(vendor_to_reject.vencode_ref)
-            # 3. Logic ใหม่: เปลี่ยนสถานะเป็น Broadcast ('BC')
-            shipment.rejected_by_vencodes = existing_rejected_list
-            shipment.docstat = 'BC'
-            shipment.current_grade_to_assign = None # ไม่มีเกรดที่เจาะจงแล้ว
-            shipment.assigned_at = None # ล้างเวลา
-            shipment.chuser = 'AUTOMATED_WORKER'
-            shipment.chdate = datetime.now(timezone.utc)
-            shipment.assigned_at = datetime.now(timezone.utc)
-
-            # 4. ส่ง Notification ไปหา Vendor ทุกคน
-            # (ยกเว้นเกรด A ที่เพิ่งปล่อยให้หมดเวลา เพื่อไม่ให้เกิดความสับสน)
-            vendors_to_notify = crud.get_all_vendors(db) # ใช้ฟังก์ชันจาก crud
-            grade_that_timed_out = shipment.current_grade_to_assign # เกรดเดิมก่อนจะเปลี่ยน
+        for vendor in vendors_to_notify:
+            # ไม่ต้องส่งหา Vendor ในเกรดที่เพิ่งหมดเวลาไป
+            if vendor.vendor_details and vendor.vendor_details.grade == grade_that_timed_out:
+                continue
             
-            for vendor in vendors_to_notify:
-                # ไม่ต้องส่งหา Vendor ในเกรดที่เพิ่งหมดเวลาไป
-                if vendor.vendor_details and vendor.vendor_details.grade == grade_that_timed_out:
-                    continue
-                
-                if vendor.fcm_token:
-                    firebase_service.send_fcm_notification(
-                        token=vendor.fcm_token, 
-                        title="[งานเปิด] มีงานใหม่ให้เลือก!", 
-                        body=f"Shipment ID: {shipment.shipid} เปิดให้รับงาน (หมดเวลาจากเกรดก่อนหน้า)"
-                    )
-            logging.info(f"    -> Broadcast notification sent for {shipment.shipid}")
-        expired_broadcast_shipments = db.query(models.Shipment).filter(
-            models.Shipment.docstat == 'BC',
-            models.Shipment.assigned_at <= expiration_time_limit
-        ).all()
+            if vendor.fcm_token:
+                notifications.append(dict(
+                    token=vendor.fcm_token, 
+                    title="[งานเปิด] มีงานใหม่ให้เลือก!", 
+                    body=f"Shipment ID: {shipment.shipid} เปิดให้รับงาน (หมดเวลาจากเกรดก่อนหน้า)",
+                    shipment_id=shipment.shipid
+                ))
+        logging.info(f"    -> Broadcast notification queued for {shipment.shipid}")
+    expired_broadcast_shipments = db.query(models.Shipment).options(*load_profiles.SHIPMENT_WORKER).filter(
+        models.Shipment.docstat == 'BC',
+        models.Shipment.assigned_at <= expiration_time_limit
+    ).all()
+    
+    if expired_broadcast_shipments:
+        logging.info(f"Worker Job: Found {len(expired_broadcast_shipments)} broadcast shipments to mark as rejected.")
         
-        if expired_broadcast_shipments:
-            logging.info(f"Worker Job: Found {len(expired_broadcast_shipments)} broadcast shipments to mark as rejected.")
+        # ดึง Dispatcher ทั้งหมดมาเพื่อส่ง Notification ทีเดียว
+        dispatchers_to_notify = crud.get_all_dispatchers(db)
+
+        for shipment in expired_broadcast_shipments:
+            logging.info(f"  - Processing expired broadcast shipment: {shipment.shipid}")
+            before = realtime.snapshot(shipment)
             
-            # ดึง Dispatcher ทั้งหมดมาเพื่อส่ง Notification ทีเดียว
-            dispatchers_to_notify = crud.get_all_dispatchers(db)
-
-            for shipment in expired_broadcast_shipments:
-                logging.info(f"  - Processing expired broadcast shipment: {shipment.shipid}")
-                
-                # --- Logic ใหม่: เปลี่ยนสถานะเป็น 'RJ' (Rejected All) ---
-                shipment.docstat = 'HD'  # เปลี่ยนเป็น Hold ก่อน
-                shipment.current_grade_to_assign = None
-                shipment.assigned_at = None
-                shipment.chuser = 'AUTOMATED_WORKER'
-                shipment.chdate = datetime.now(timezone.utc)
-
-                # --- ส่ง Notification แจ้งเตือน Dispatcher ---
-                if dispatchers_to_notify:
-                    for dispatcher in dispatchers_to_notify:
-                        if dispatcher.fcm_token:
-                            firebase_service.send_fcm_notification(
-                                token=dispatcher.fcm_token,
-                                title="⚠️ งานไม่มีผู้รับ (Unclaimed Job)",
-                                body=f"Shipment ID: {shipment.shipid} ไม่มี Vendor กดรับภายในเวลาที่กำหนด"
-                            )
-
-        # 5. Commit การเปลี่ยนแปลงทั้งหมดลงฐานข้อมูล
-        db.commit()
-        logging.info(f"Worker Job: Successfully processed and broadcasted {len(expired_shipments)} shipments.")
+            # --- Logic ใหม่: เปลี่ยนสถานะเป็น 'RJ' (Rejected All) ---
+            shipment.docstat = 'HD'  # เปลี่ยนเป็น Hold ก่อน
+            shipment.current_grade_to_assign = None
+            shipment.assigned_at = None
+            shipment.chuser = 'AUTOMATED_WORKER'
+            shipment.chdate = datetime.now(timezone.utc)
+            realtime_events.append(realtime.shipment_event(shipment, before))
+            event_rows.append(event_log.build_row("broadcast_expired", shipment, before))
+
+            # --- ส่ง Notification แจ้งเตือน Dispatcher ---
+            if dispatchers_to_notify:
+                for dispatcher in dispatchers_to_notify:
+                    if dispatcher.fcm_token:
+                        notifications.append(dict(
+                            token=dispatcher.fcm_token,
+                            title="⚠️ งานไม่มีผู้รับ (Unclaimed Job)",
+                            body=f"Shipment ID: {shipment.shipid} ไม่มี Vendor กดรับภายในเวลาที่กำหนด",
+                            shipment_id=shipment.shipid
+                        ))
+
+    # 5. Commit การเปลี่ยนแปลงทั้งหมดลงฐานข้อมูล
+    db.commit()
+    for event in realtime_events:
+        realtime.publish(event)
+    event_log.append(event_rows)
+    for notification in notifications:
+        firebase_service.queue_fcm_notification(**notification)
+    logging.info(f"Worker Job: Successfully processed and broadcasted {len(expired_shipments)} shipments.")
+
+def purge_idempotency_keys_job():
+    """ลบ Idempotency-Key ที่เกิน IDEMPOTENCY_KEY_TTL_HOURS แล้ว"""
+    db: Session = database.SessionLocal()
+    try:
+        deleted = crud.delete_expired_idempotency_keys(db)
+        if deleted:
+            logging.info(f"Worker Job: Purged {deleted} expired idempotency keys.")
+    except Exception as e:
+        logging.error(f"Worker Job: Failed to purge idempotency keys: {e}", exc_info=True)
+        db.rollback()
+    finally:
+        db.close()
 
+def purge_change_log_job():
+    """ลบแถวเก่าของ shipment_change_log (ใช้แค่คำนวณ high_water_mark ของ Delta-sync)"""
+    db: Session = database.SessionLocal()
+    try:
+        deleted = versioning.purge_change_log(db)
+        if deleted:
+            logging.info(f"Worker Job: Purged {deleted} old change log rows.")
     except Exception as e:
-        logging.error(f"Worker Job: An error occurred: {e}", exc_info=True)
-        db.rollback() # Rollback ถ้าเกิดปัญหา
+        logging.error(f"Worker Job: Failed to purge change log: {e}", exc_info=True)
+        db.rollback()
     finally:
-        db.close() # ปิด Session เสมอ
-        logging.info("Worker Job: Check finished, database session closed.")
+        db.close()
+
+def log_pool_metrics_job():
+    """บันทึกสถิติ Connection Pool และจำนวน Retry ของ Worker ลง Log (Worker ไม่มี HTTP Endpoint ให้ดู)"""
+    for name, stats in pool_metrics.snapshot().items():
+        logging.info(f"DB Pool [{name}]: {stats}")
+    for name, stats in transactions.snapshot().items():
+        logging.info(f"DB Retry [{name}]: {stats}")
 
 
 if __name__ == "__main__":
+    database.use_worker_pool() # Pool แยกของ Worker (WORKER_DB_POOL_SIZE / WORKER_DB_MAX_OVERFLOW)
     scheduler = BlockingScheduler(timezone="UTC") 
 
     scheduler.add_job(check_expired_shipments_job, 'interval', minutes=1, id='check_expired_shipments_job')
+    scheduler.add_job(purge_idempotency_keys_job, 'interval', hours=1, id='purge_idempotency_keys_job')
+    scheduler.add_job(purge_change_log_job, 'interval', hours=1, id='purge_change_log_job')
+    scheduler.add_job(log_pool_metrics_job, 'interval', minutes=15, id='log_pool_metrics_job')
 
     logging.info("Scheduler started. Press Ctrl+C to exit.")
 
@@ -134,4 +202,6 @@ if __name__ == "__main__":
         scheduler.start()
     except (KeyboardInterrupt, SystemExit):
         scheduler.shutdown()
+        firebase_service.flush_pending_notifications() # ส่งข้อความที่ยังค้างในคิวก่อนปิด
+        event_log.flush()
         logging.info("Scheduler shut down successfully.")
\ No newline at end of file
@@ -0,0 +1,148 @@
+# tests/test_query_counts.py
+# จำนวน SQL ที่แต่ละ Endpoint (GET) ยิงไปยังฐานข้อมูล ต้องไม่เกินงบที่คาดไว้ตาม load_profiles
+# ใช้จับ N+1 / Eager Load เกินจำเป็น: Seed หลาย Shipment ที่มีหลาย DOH ต่อรายการ ถ้าโหลดทีละแถวจำนวน Query จะเกินงบทันที
+# ต้องใช้ MySQL จริง (ดู tests/conftest.py) ถ้าไม่ได้ตั้ง TEST_DATABASE_URL จะถูก Skip
+# รัน: TEST_DATABASE_URL=mysql+pymysql://... python -m pytest tests/test_query_counts.py
+from datetime import date, datetime, time, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app.core import security
+from app.core.config import settings
+from app.db import database, models
+from app.main import app
+from tests.conftest import TEST_DATABASE_URL, requires_mysql
+
+pytestmark = requires_mysql
+
+DAY = date(2025, 7, 1)
+SHIPPOINT = "WH7"
+DISPATCHER = "dispatcher1"
+VENDOR = "vendor1"
+SHIPID = "S0001"
+
+class QueryCounter:
+    def __init__(self, engines):
+        self.count = 0
+        self.engines = list({id(engine): engine for engine in engines}.values())
+        for engine in self.engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def reset(self):
+        self.count = 0
+
+    def remove(self):
+        for engine in self.engines:
+            event.remove(engine, "before_cursor_execute", self._on_execute)
+
+def _seed(db):
+    db.add_all([
+        models.MWarehouse(warehouse_code=SHIPPOINT, warehouse_name="คลัง 7"),
+        models.MProvince(province=10, provname="กรุงเทพฯ", stat="ใช้งาน"),
+        models.MShipType(cartype="4W", cartypedes="4 ล้อ", stat="ใช้งาน"),
+        models.MLeadTime(route="R1", provth="กรุงเทพฯ", routedes="R1", proven="Bangkok", zone="C", zonedes="Central", leadtime=1),
+        models.MVendor(vencode="V001", venname="Vendor 1", grade="A"),
+        models.MVendor(vencode="V002", venname="Vendor 2", grade="B"),
+    ])
+    db.flush()
+    round_ = models.BookingRound(round_name="รอบ 10:00", round_date=DAY, round_time=time(10, 0),
+                                 warehouse_code=SHIPPOINT, created_by=DISPATCHER)
+    db.add_all([
+        models.MCar(carlicense="70-0001", vencode="V001", venname="Vendor 1", conid="001", cartype="4W", cartypedes="4 ล้อ"),
+        models.SystemUser(username=DISPATCHER, hashed_password=security.get_password_hash("secret"),
+                          role=models.UserRoleEnum.dispatcher),
+        models.SystemUser(username=VENDOR, hashed_password=security.get_password_hash("secret"),
+                          role=models.UserRoleEnum.vendor, vencode_ref="V001"),
+        round_,
+    ])
+    db.flush()
+
+    # สถานะละหลายรายการ แต่ละรายการมี DOH 2 บรรทัด
+    states = ([{"docstat": "01"}] * 4                                                    # ยังไม่เข้ารอบ (/unassigned)
+              + [{"docstat": "01", "booking_round_id": round_.id}] * 3                   # อยู่ในรอบ
+              + [{"docstat": "04", "vencode": "V001", "carlicense": "70-0001"}] * 3      # /my-orders
+              + [{"docstat": "06", "vencode": "V001"}] * 3                               # /my-history
+              + [{"docstat": "HD", "is_on_hold": True, "docstat_before_hold": "01"}] * 2 # /held
+              + [{"docstat": "02", "current_grade_to_assign": "B"}] * 2)                 # V001 ปฏิเสธไปแล้ว
+    for n, state in enumerate(states, start=1):
+        apmdate = datetime.combine(DAY, time(8, 0)) + timedelta(hours=n % 10)
+        shipment = models.Shipment(shipid=f"S{n:04d}", customer_name=f"ลูกค้า {n}", shippoint=SHIPPOINT, province=10,
+                                   route="R1", cartype="4W", volume_cbm=1.5, apmdate=apmdate,
+                                   crdate=apmdate - timedelta(days=1), chdate=apmdate, **state)
+        db.add(shipment)
+        db.flush()
+        db.add_all([
+            models.DOH(doid=f"D{n:04d}{line}", shipid=shipment.shipid, dlvdate=DAY, cusid=f"C{n:04d}",
+                       cusname=f"ลูกค้า {n}", route="R1", province="10", volumn=0.75)
+            for line in (1, 2)
+        ])
+        if state["docstat"] == "02":
+            db.add(models.ShipmentRejection(shipid=shipment.shipid, vencode="V001", rejected_at=apmdate))
+    db.commit()
+
+@pytest.fixture(scope="module")
+def client(mysql_engine):
+    # NullPool: TestClient เปิด Event Loop ใหม่ทุก Request จึงใช้ Connection ของ aiomysql ข้าม Request ไม่ได้
+    async_engine = create_async_engine(TEST_DATABASE_URL.replace("mysql+pymysql://", "mysql+aiomysql://", 1), poolclass=NullPool)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(database, "SessionLocal", sessionmaker(autocommit=False, autoflush=False, bind=mysql_engine))
+        monkeypatch.setattr(database, "ReadSessionLocal", sessionmaker(autocommit=False, autoflush=False, bind=mysql_engine,
+                                                                       class_=database.ReadOnlySession))
+        monkeypatch.setattr(database, "AsyncSessionLocal", async_sessionmaker(bind=async_engine, class_=AsyncSession,
+                                                                              autoflush=False, expire_on_commit=False))
+        monkeypatch.setattr(database, "AsyncReadSessionLocal", async_sessionmaker(bind=async_engine, class_=AsyncSession,
+                                                                                  sync_session_class=database.ReadOnlySession,
+                                                                                  autoflush=False, expire_on_commit=False))
+        # แถวที่เพิ่ง Seed ต้องอยู่ใต้ High-water mark ของ /changes ทันที
+        monkeypatch.setattr(settings, "DELTA_SYNC_LAG_SECONDS", 0)
+
+        with database.SessionLocal() as db:
+            _seed(db)
+
+        yield TestClient(app)
+    async_engine.sync_engine.dispose()
+
+@pytest.fixture(scope="module")
+def counter(client, mysql_engine):
+    # นับทั้ง Engine แบบ Sync และ Async (ใช้ Engine ที่ Session ผูกอยู่จริง) รวมฝั่งอ่านด้วย
+    engines = [database.SessionLocal.kw["bind"], database.ReadSessionLocal.kw["bind"],
+               database.AsyncSessionLocal.kw["bind"].sync_engine, database.AsyncReadSessionLocal.kw["bind"].sync_engine]
+    query_counter = QueryCounter(engines)
+    yield query_counter
+    query_counter.remove()
+
+def _auth(username: str) -> dict:
+    return {"Authorization": "Bearer " + security.create_access_token({"sub": username})}
+
+ENDPOINTS = [
+    # (path, params, ผู้ใช้, งบจำนวน Query สูงสุด)
+    # auth 1 + shipment 1 + details (selectin) 1
+    pytest.param("/api/v1/shipments/", {}, DISPATCHER, 3, id="list (dispatcher)"),
+    pytest.param("/api/v1/shipments/", {}, VENDOR, 3, id="list (vendor)"),
+    pytest.param("/api/v1/shipments/held", {}, DISPATCHER, 3, id="held"),
+    pytest.param("/api/v1/shipments/my-orders", {}, VENDOR, 3, id="my-orders (vendor)"),
+    pytest.param("/api/v1/shipments/my-history", {}, DISPATCHER, 3, id="my-history (dispatcher)"),
+    pytest.param("/api/v1/shipments/unassigned", {"crdate": DAY.isoformat(), "shippoint": SHIPPOINT}, DISPATCHER, 3, id="unassigned"),
+    # auth 1 + shipment และ details JOIN ใน Query เดียว
+    pytest.param(f"/api/v1/shipments/{SHIPID}", {}, DISPATCHER, 2, id="single shipment"),
+    # auth 1 + high-water mark 1 + shipment 1 + details 1 + rejections 1
+    pytest.param("/api/v1/shipments/changes", {"since": 0}, VENDOR, 5, id="changes (vendor)"),
+    # round 1 + shipments 1 + details 1
+    pytest.param("/api/v1/booking-rounds", {"round_date": DAY.isoformat(), "warehouse_code": SHIPPOINT}, None, 3,
+                 id="booking rounds by date"),
+]
+
+@pytest.mark.parametrize("path, params, username, budget", ENDPOINTS)
+def test_endpoint_query_budget(client, counter, path, params, username, budget):
+    counter.reset()
+    response = client.get(path, params=params, headers=_auth(username) if username else {})
+    assert response.status_code == 200, response.text
+    assert counter.count <= budget, f"{counter.count} queries (budget {budget})"
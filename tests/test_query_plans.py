@@ -0,0 +1,109 @@
+# tests/test_query_plans.py
+# EXPLAIN ของ Query ที่ถูกเรียกบ่อยต้องใช้ Index ที่คาดไว้ (Migration v4) ไม่ใช่ Full Table Scan
+# ต้องใช้ MySQL จริง (ดู tests/conftest.py) ถ้าไม่ได้ตั้ง TEST_DATABASE_URL จะถูก Skip
+# ตารางที่มีข้อมูลน้อย Optimizer จะเลือก Full Scan เอง จึง Seed Shipment หลายหมื่นแถวที่กระจายค่าแบบข้อมูลจริง:
+# ส่วนใหญ่จ่ายงานแล้ว (04) กระจายหลาย Vendor / คลัง / วัน ส่วนที่รอ Vendor, ยังไม่เข้ารอบ และจบงานแล้วมีสัดส่วนน้อย
+# รัน: TEST_DATABASE_URL=mysql+pymysql://... python -m pytest tests/test_query_plans.py
+from datetime import date, datetime, time, timedelta, timezone
+
+import pytest
+from sqlalchemy import insert, select, text
+
+from app.db import async_crud, models, pagination
+from tests.conftest import requires_mysql
+
+pytestmark = requires_mysql
+
+SHIPMENT_ROWS = 20000
+WAREHOUSES = [f"WH{n}" for n in range(1, 9)]
+VENDORS = [f"V{n:03d}" for n in range(1, 51)]
+ROUNDS = 100
+PAST_STATUSES = ["05", "06", "RJ"]
+
+def _shipment_row(i: int, today_8am: datetime) -> dict:
+    apmdate = today_8am - timedelta(days=i % 400, hours=i % 10)
+    row = {
+        "shipid": f"S{i:07d}", "customer_name": f"Customer {i % 500}",
+        "shippoint": WAREHOUSES[i % len(WAREHOUSES)], "province": 10, "route": "R1", "cartype": "4W",
+        "volume_cbm": 1.5, "apmdate": apmdate, "crdate": apmdate - timedelta(days=1),
+        "booking_round_id": i % ROUNDS + 1, "is_on_hold": False, "docstat": "04",
+        "vencode": VENDORS[i % len(VENDORS)], "chdate": apmdate + timedelta(hours=2),
+        "assigned_at": None, "docstat_before_hold": None,
+    }
+    bucket = i % 100
+    if bucket < 2:     # รอ Vendor ตอบรับ (บางส่วนหมดเวลาแล้ว)
+        row.update(docstat="02", vencode=None, chdate=None, assigned_at=datetime.now() - timedelta(minutes=10 * (i % 6)))
+    elif bucket < 4:   # ยังไม่เข้ารอบ
+        row.update(docstat="01", vencode=None, chdate=None, booking_round_id=None)
+    elif bucket < 9:   # จบงานแล้ว / ยกเลิก / ถูกปฏิเสธทั้งหมด
+        row.update(docstat=PAST_STATUSES[i % len(PAST_STATUSES)])
+    elif bucket < 10:  # พักงาน
+        row.update(docstat="HD", vencode=None, chdate=None, is_on_hold=True, docstat_before_hold="01")
+    return row
+
+@pytest.fixture(scope="module")
+def conn(mysql_engine):
+    today_8am = datetime.combine(date.today(), time(8, 0))
+    with mysql_engine.begin() as seed:
+        seed.execute(insert(models.MWarehouse), [{"warehouse_code": code, "warehouse_name": code} for code in WAREHOUSES])
+        seed.execute(insert(models.MProvince), [{"province": 10, "provname": "กรุงเทพฯ", "stat": "ใช้งาน"}])
+        seed.execute(insert(models.MShipType), [{"cartype": "4W", "cartypedes": "4 ล้อ", "stat": "ใช้งาน"}])
+        seed.execute(insert(models.MLeadTime), [{"route": "R1", "provth": "กรุงเทพฯ", "routedes": "R1", "proven": "Bangkok",
+                                                 "zone": "C", "zonedes": "Central", "leadtime": 1}])
+        seed.execute(insert(models.MVendor), [{"vencode": code, "venname": code, "grade": "ABCD"[n % 4]} for n, code in enumerate(VENDORS)])
+        seed.execute(insert(models.BookingRound), [
+            {"id": n, "round_name": f"Round {n}", "round_date": date.today() - timedelta(days=n), "round_time": time(10, 0),
+             "warehouse_code": WAREHOUSES[n % len(WAREHOUSES)], "created_by": "seed"}
+            for n in range(1, ROUNDS + 1)
+        ])
+        batch = 2000
+        for start in range(0, SHIPMENT_ROWS, batch):
+            seed.execute(insert(models.Shipment), [_shipment_row(i, today_8am) for i in range(start, start + batch)])
+        # อัปเดตสถิติของ Index ทันที ไม่รอ Background Stats ของ InnoDB
+        seed.execute(text("ANALYZE TABLE shipment"))
+    with mysql_engine.connect() as connection:
+        yield connection
+
+def _hot_queries():
+    today = date.today()
+    day_start = datetime.combine(today, time.min)
+    return [
+        pytest.param(
+            select(models.Shipment.shipid).where(
+                models.Shipment.docstat == '02',
+                models.Shipment.assigned_at <= datetime.now(timezone.utc) - timedelta(minutes=30)
+            ),
+            ("ix_shipment_docstat_assigned_at",), id="worker: expired offers"),
+        pytest.param(
+            async_crud.unassigned_shipments_stmt({"crdate": today, "shippoint": "WH7"}),
+            ("ix_shipment_unassigned",), id="/shipments/unassigned"),
+        pytest.param(
+            select(models.Shipment.shipid).where(
+                models.Shipment.booking_round_id.is_(None),
+                models.Shipment.is_on_hold == False,
+                models.Shipment.shippoint == "WH7",
+                models.Shipment.crdate >= day_start,
+                models.Shipment.crdate < day_start + timedelta(days=1)
+            ),
+            ("ix_shipment_shippoint_crdate", "ix_shipment_unassigned"), id="assign-all (shippoint + crdate)"),
+        pytest.param(
+            async_crud.ongoing_shipments_stmt(vencode="V001"),
+            ("ix_shipment_vencode_docstat",), id="/shipments/my-orders (vendor)"),
+        pytest.param(
+            pagination.keyset(async_crud.past_shipments_stmt(), async_crud.CHDATE_KEYS, None, 200, descending=True),
+            ("ix_shipment_docstat_chdate",), id="/shipments/my-history (dispatcher)"),
+        pytest.param(
+            pagination.keyset(async_crud.shipments_stmt(), async_crud.APMDATE_KEYS, None, 200, descending=True),
+            ("ix_shipment_apmdate",), id="/shipments/ (dispatcher, first page)"),
+    ]
+
+def _explain(conn, stmt) -> list:
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    # PyMySQL ใช้ paramstyle แบบ Positional (%s) จึงต้องเรียงค่าตาม positiontup
+    params = tuple(compiled.params[key] for key in compiled.positiontup)
+    return conn.exec_driver_sql("EXPLAIN " + compiled.string, params).mappings().all()
+
+@pytest.mark.parametrize("stmt, expected_keys", _hot_queries())
+def test_hot_query_uses_expected_index(conn, stmt, expected_keys):
+    shipment_rows = [row for row in _explain(conn, stmt) if row["table"] == models.Shipment.__tablename__]
+    assert shipment_rows and shipment_rows[0]["key"] in expected_keys, shipment_rows
@@ -0,0 +1,99 @@
+# tests/test_read_your_writes.py
+# Routing ของ get_read_db (Replica / Primary) และ Read-your-writes
+# ใช้ SQLite สองไฟล์แทน Primary กับ Replica: แต่ละไฟล์มีตาราง marker ที่บอกว่า Request อ่านจากฝั่งไหน
+# รัน: python -m pytest tests
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from jose import jwt
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core import security
+from app.core.config import settings
+from app.db import database
+from app.main import read_your_writes
+
+def _stand_in(path, name: str):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE marker (name VARCHAR(10))"))
+        conn.execute(text("INSERT INTO marker (name) VALUES (:name)"), {"name": name})
+    return engine
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    primary = _stand_in(tmp_path / "primary.db", "primary")
+    replica = _stand_in(tmp_path / "replica.db", "replica")
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(bind=primary))
+    monkeypatch.setattr(database, "ReadSessionLocal", sessionmaker(bind=replica, class_=database.ReadOnlySession))
+    monkeypatch.setattr(settings, "REPLICA_STICKY_SECONDS", 5.0)
+
+    app = FastAPI()
+    app.middleware("http")(read_your_writes)
+
+    @app.get("/read")
+    def read(db: Session = Depends(database.get_read_db)):
+        return {"source": db.execute(text("SELECT name FROM marker")).scalar_one()}
+
+    @app.post("/write")
+    def write(fail: bool = False):
+        if fail:
+            raise HTTPException(status_code=400, detail="rejected")
+        return {}
+
+    yield TestClient(app)
+    primary.dispose()
+    replica.dispose()
+
+def _auth(username: str) -> dict:
+    return {"Authorization": "Bearer " + security.create_access_token({"sub": username})}
+
+def _source(client: TestClient, headers: dict) -> str:
+    response = client.get("/read", headers=headers)
+    assert response.status_code == 200
+    return response.json()["source"]
+
+def test_reads_go_to_replica_by_default(client):
+    assert _source(client, {}) == "replica"
+    assert _source(client, _auth("alice")) == "replica"
+
+def test_write_makes_same_user_read_from_primary(client):
+    response = client.post("/write", headers=_auth("alice"))
+    assert response.headers[database.READ_AFTER_HEADER]
+    assert database.READ_AFTER_COOKIE in response.cookies
+    assert _source(client, _auth("alice")) == "primary" # Cookie ที่ TestClient เก็บไว้
+
+def test_header_token_works_without_cookie(client):
+    token = client.post("/write", headers=_auth("alice")).headers[database.READ_AFTER_HEADER]
+    client.cookies.clear() # Client อื่น (เช่นแอปมือถือ) ที่ไม่เก็บ Cookie
+    assert _source(client, _auth("alice")) == "replica"
+    assert _source(client, {**_auth("alice"), database.READ_AFTER_HEADER: token}) == "primary"
+
+def test_token_is_bound_to_the_writer(client):
+    token = client.post("/write", headers=_auth("alice")).headers[database.READ_AFTER_HEADER]
+    client.cookies.clear()
+    assert _source(client, {**_auth("bob"), database.READ_AFTER_HEADER: token}) == "replica"
+    assert _source(client, {database.READ_AFTER_HEADER: token}) == "replica"
+
+def test_expired_or_forged_token_reads_from_replica(client):
+    expired = jwt.encode({"read_after": "alice", "exp": datetime.now(timezone.utc) - timedelta(seconds=1)},
+                         settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    forged = jwt.encode({"read_after": "alice", "exp": datetime.now(timezone.utc) + timedelta(seconds=60)},
+                        "not-the-secret", algorithm=settings.ALGORITHM)
+    for token in (expired, forged, "garbage"):
+        assert _source(client, {**_auth("alice"), database.READ_AFTER_HEADER: token}) == "replica"
+
+def test_no_token_for_failed_or_anonymous_writes(client, monkeypatch):
+    assert database.READ_AFTER_HEADER not in client.post("/write?fail=true", headers=_auth("alice")).headers
+    assert database.READ_AFTER_HEADER not in client.post("/write").headers
+    monkeypatch.setattr(settings, "REPLICA_STICKY_SECONDS", 0.0)
+    assert database.READ_AFTER_HEADER not in client.post("/write", headers=_auth("alice")).headers
+    assert _source(client, _auth("alice")) == "replica"
+
+def test_token_cannot_be_used_as_access_token(client):
+    token = client.post("/write", headers=_auth("alice")).headers[database.READ_AFTER_HEADER]
+    with pytest.raises(HTTPException):
+        security.get_user_from_token(None, token)